@@ -0,0 +1,168 @@
+# Copyright Red Hat 2019, Jake Hunsaker <jhunsake@redhat.com>
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Programmatic interface to sos-collector, for tools that want to run a
+collection without shelling out and act on each node's sosreport as soon as
+it has been retrieved.
+
+A collection is configured with a Configuration object, exactly as the
+command line options would configure it, and yields events as it runs:
+
+    from soscollector.api import Collection
+    from soscollector.configuration import Configuration
+
+    config = Configuration({'nodes': ['node1', 'node2'],
+                            'cluster_type': 'none', 'no_local': True})
+    for event in Collection(config):
+        if event['event'] == 'report':
+            process(event['path'])
+
+Collection is also an async iterator, for use with 'async for' on python
+versions that support it.
+
+Every event is a dict with at least the 'event', 'node' and 'time' keys. The
+events are:
+
+    log             a line of console output, in 'message'
+    connected       connected to node, with its 'facts'
+    connect_failed  could not connect to node, with the 'error'
+    progress        node has started the 'stage' 'sosreport' or 'retrieve'
+    report          sosreport of node retrieved to 'path', with 'timings'
+    failed          no sosreport could be collected from node, with 'error'
+    complete        the collection finished, with the 'archive' created and
+                    the number of reports 'retrieved' out of 'total'
+    aborted         the collection stopped early, with 'message' and 'status'
+
+Paths to sosreports are valid until the 'complete' event, after which the
+reports only exist within the archive.
+'''
+
+import threading
+import time
+
+from six.moves import queue
+
+_DONE = object()
+
+
+def emit_event(config, event, node=None, **data):
+    '''Send an event to the hook set in the configuration, if any. Errors in
+    the hook never interrupt the collection.
+    '''
+    hook = config['event_hook']
+    if not hook:
+        return
+    data.update({'event': event, 'node': node, 'time': time.time()})
+    try:
+        hook(data)
+    except Exception:
+        pass
+
+
+class _EventStream(object):
+    '''File-like object for the console log handler, which turns console
+    output into log events'''
+
+    def __init__(self, config):
+        self.config = config
+
+    def write(self, msg):
+        emit_event(self.config, 'log', message=msg.rstrip('\n'))
+
+    def flush(self):
+        pass
+
+
+class Collection(object):
+    '''Runs a collection in a background thread, and iterates over the events
+    it produces. The collection starts when iteration begins, or when
+    start() is called.
+
+    Collections run non-interactively: they never prompt, and errors that
+    would make sos-collector exit instead end the collection with an
+    'aborted' event. Passwords, if needed, must already be set in the
+    configuration.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.events = queue.Queue()
+        self.status = None
+        self.archive = None
+        self._thread = None
+        self.config['batch'] = True
+        self.config['embedded'] = True
+        self.config['event_hook'] = self.events.put
+        if not self.config['ui_stream']:
+            self.config['ui_stream'] = _EventStream(self.config)
+
+    def start(self):
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def wait(self):
+        '''Block until the collection has finished, returning its status'''
+        self.start()
+        self._thread.join()
+        return self.status
+
+    def _run(self):
+        # imported here as the collector itself emits events through this
+        # module
+        from soscollector.sos_collector import SosCollector, reset_logging
+        try:
+            sc = SosCollector(self.config)
+            sc.collect()
+            self.archive = getattr(sc, 'archive', None)
+            self.status = 0
+        except SystemExit as err:
+            self.status = err.code if err.code is not None else 0
+        except Exception as err:
+            self.status = 1
+            emit_event(self.config, 'aborted', message=str(err), status=1)
+        finally:
+            reset_logging(self.config)
+            self.events.put(_DONE)
+
+    def __iter__(self):
+        return self.start()
+
+    def __next__(self):
+        event = self.events.get()
+        if event is _DONE:
+            # leave the marker for any other consumer
+            self.events.put(_DONE)
+            raise StopIteration
+        return event
+
+    next = __next__
+
+    def __aiter__(self):
+        return self.start()
+
+    def __anext__(self):
+        import asyncio
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(None, self._next_async)
+
+    def _next_async(self):
+        try:
+            return self.__next__()
+        except StopIteration:
+            raise StopAsyncIteration
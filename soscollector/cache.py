@@ -0,0 +1,156 @@
+# Copyright Red Hat 2019, Jake Hunsaker <jhunsake@redhat.com>
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Local cache of the sosreports retrieved from nodes, so that a collection
+repeated within a short time reuses them instead of running sosreport again.
+
+Archives are stored by the sha256 of their content, and indexed by a key
+made of the node, the final sos command line and the plugins available on
+the node, so a change to any of those misses the cache.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from soscollector.journal import sha256_file
+
+CACHE_INDEX = 'index.db'
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        node TEXT,
+        name TEXT,
+        digest TEXT,
+        size INTEGER,
+        created REAL,
+        last_used REAL
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_entries_digest ON entries (digest)',
+    'CREATE INDEX IF NOT EXISTS idx_entries_used ON entries (last_used)'
+]
+
+
+def cache_key(node, sos_cmd, sos_version, plugins):
+    '''Returns the cache key for a sosreport of node made with sos_cmd'''
+    data = json.dumps([node, sos_cmd.strip(), sos_version,
+                       sorted(plugins or [])])
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class ArchiveCache(object):
+    '''Content-addressed store of retrieved sosreports.
+
+    Entries older than max_age seconds are not used. Once the archives in
+    the cache take up more than max_size bytes, the least recently used
+    entries are removed.
+    '''
+
+    def __init__(self, path, max_size, max_age):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.objects = os.path.join(path, 'objects')
+        if not os.path.isdir(self.objects):
+            os.makedirs(self.objects, 0o700)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(path, CACHE_INDEX),
+                                  check_same_thread=False)
+        with self.db:
+            for stmt in SCHEMA:
+                self.db.execute(stmt)
+
+    def close(self):
+        self.db.close()
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects, digest)
+
+    def get(self, key, dest_dir):
+        '''Copy the cached archive for key into dest_dir. Returns the path of
+        the copy, or None if there is no fresh entry for key.
+        '''
+        with self._lock:
+            row = self.db.execute('SELECT name, digest, created FROM entries '
+                                  'WHERE key = ?', (key,)).fetchone()
+            if not row:
+                return None
+            name, digest, created = row
+            obj = self._object_path(digest)
+            if time.time() - created > self.max_age or \
+                    not os.path.exists(obj):
+                return None
+            with self.db:
+                self.db.execute('UPDATE entries SET last_used = ? WHERE '
+                                'key = ?', (time.time(), key))
+        dest = os.path.join(dest_dir, name)
+        shutil.copy(obj, dest)
+        return dest
+
+    def put(self, key, node, path):
+        '''Add the archive at path to the cache under key'''
+        digest = sha256_file(path)
+        obj = self._object_path(digest)
+        # the object is stored and its entry added under the same lock, as
+        # an eviction in between would remove the object as unused
+        with self._lock:
+            if not os.path.exists(obj):
+                tmp = obj + '.tmp'
+                try:
+                    os.link(path, tmp)
+                except OSError:
+                    shutil.copy(path, tmp)
+                os.rename(tmp, obj)
+            now = time.time()
+            with self.db:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, '
+                    '?)', (key, node, os.path.basename(path), digest,
+                           os.path.getsize(obj), now, now)
+                )
+            self._evict()
+
+    def _evict(self):
+        '''Remove expired entries, then the least recently used entries until
+        the cache fits in max_size. Must be called with the lock held.
+        '''
+        with self.db:
+            self.db.execute('DELETE FROM entries WHERE created < ?',
+                            (time.time() - self.max_age,))
+            # the size of each object is only counted once, as entries may
+            # share an object
+            rows = self.db.execute(
+                'SELECT digest, MAX(size), MAX(last_used) FROM entries GROUP '
+                'BY digest ORDER BY MAX(last_used) DESC'
+            ).fetchall()
+            total = 0
+            for digest, size, _ in rows:
+                total += size
+                if total > self.max_size:
+                    self.db.execute('DELETE FROM entries WHERE digest = ?',
+                                    (digest,))
+        used = set(r[0] for r in self.db.execute('SELECT digest FROM entries'))
+        for fname in os.listdir(self.objects):
+            if fname not in used and not fname.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(self.objects, fname))
+                except OSError:
+                    pass
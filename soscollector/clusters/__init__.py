@@ -13,9 +13,12 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import json
 import logging
 import subprocess
 
+from six import StringIO
+from xml.etree import ElementTree
 from soscollector.configuration import ClusterOption
 
 
@@ -26,6 +29,10 @@ class Cluster(object):
     sos_plugins = []
     sos_plugin_options = {}
     sos_preset = ''
+    # plugins and plugin options that collect the same cluster-wide data on
+    # every node, and so only need to be used on one of them
+    cluster_scoped_plugins = []
+    cluster_scoped_options = []
     cluster_name = None
 
     def __init__(self, config):
@@ -46,6 +53,10 @@ class Cluster(object):
             if cls.__name__ != 'Cluster':
                 self.cluster_type.append(cls.__name__)
         self.node_list = None
+        self.node_attrs = {}
+        self.user_plugins = []
+        self.added_plugins = []
+        self.added_options = []
         self.logger = logging.getLogger('sos_collector')
         self.console = logging.getLogger('sos_collector_console')
         self.options = []
@@ -141,7 +152,80 @@ class Cluster(object):
         '''
         pass
 
+    def add_node(self, name, **attrs):
+        '''Record attributes for an enumerated node, such as its role or if
+        the cluster reports it as being online. Profiles should call this for
+        each node found by get_nodes() when that information is available.
+
+        Topology is reported with the datacenter, cluster and rack
+        attributes and the roles list, which --domain-key selects from.
+        '''
+        self.node_attrs[name] = attrs
+
+    def get_node_attrs(self, name):
+        '''Returns the attributes recorded for a node during enumeration'''
+        return self.node_attrs.get(name, {})
+
+    def get_node_domain(self, name):
+        '''Returns the failure domain of a node, which is the value of the
+        --domain-key attribute the profile reported for it, such as its
+        datacenter, cluster, rack or role. Nodes without the attribute
+        share the None domain.
+        '''
+        key = self.config['domain_key'] or 'cluster'
+        attrs = self.get_node_attrs(name)
+        if key in ('role', 'roles'):
+            roles = attrs.get('roles')
+            return ','.join(sorted(r for r in roles if r)) if roles else None
+        if key.startswith('label.'):
+            return (attrs.get('labels') or {}).get(key.split('.', 1)[1])
+        return attrs.get(key)
+
+    def parse_json_output(self, output):
+        '''Parse the JSON output of a command run on the master, ignoring any
+        text such as password prompts that precedes the JSON document
+        '''
+        idxs = [output.find('{'), output.find('['), len(output)]
+        start = min(i for i in idxs if i >= 0)
+        return json.loads(output[start:])
+
+    def iter_xml_elements(self, output, path):
+        '''Iteratively parse the XML output of a command run on the master,
+        yielding each element whose tag and that of its parent match path.
+
+        For example, a path of ('nodes', 'node') will yield the node elements
+        that are direct children of a nodes element. Elements are cleared
+        once yielded so that large documents are not held in memory.
+        '''
+        start = output.find('<')
+        if start < 0:
+            return
+        stack = []
+        events = ElementTree.iterparse(StringIO(output[start:]),
+                                       events=('start', 'end'))
+        for event, elem in events:
+            if event == 'start':
+                stack.append(elem.tag)
+                continue
+            if tuple(stack[-len(path):]) == tuple(path):
+                yield elem
+                elem.clear()
+            stack.pop()
+
+    def parse_psql_rows(self, output, sep='|'):
+        '''Parse the unaligned, tuples-only output of a psql query (psql -At)
+        and return a list of the fields of each row
+        '''
+        rows = []
+        for line in output.splitlines():
+            line = line.strip()
+            if not line or line.startswith('could not change directory'):
+                continue
+            rows.append([f.strip() for f in line.split(sep)])
+        return rows
+
     def _get_nodes(self):
+        self.node_attrs = {}
         try:
             return self.format_node_list()
         except Exception as e:
@@ -177,15 +261,58 @@ class Cluster(object):
                 self.log_debug('Cluster specified preset %s but user has also '
                                'defined a preset. Using user specification.'
                                % self.sos_preset)
+        self.user_plugins = (list(self.config['enable_plugins']) +
+                             list(self.config['only_plugins']))
         if self.sos_plugins:
             for plug in self.sos_plugins:
                 if plug not in self.config['sos_cmd']:
                     self.config['enable_plugins'].append(plug)
+                    self.added_plugins.append(plug)
         if self.sos_plugin_options:
             for opt in self.sos_plugin_options:
                 if not any(opt in o for o in self.config['plugin_options']):
                     option = '%s=%s' % (opt, self.sos_plugin_options[opt])
                     self.config['plugin_options'].append(option)
+                    self.added_options.append(option)
+
+    def get_scoped_plugins(self):
+        '''Returns the cluster-scoped plugins that are not explicitly enabled
+        by the user, and so may be skipped on all but one node
+        '''
+        return [p for p in self.cluster_scoped_plugins
+                if p not in self.user_plugins]
+
+    def get_scoped_options(self):
+        '''Returns the plugin options added by this profile that are cluster
+        scoped, either on their own or through their plugin
+        '''
+        scoped = []
+        for opt in self.added_options:
+            name = opt.split('=')[0]
+            if name in self.cluster_scoped_options or \
+                    name.split('.')[0] in self.get_scoped_plugins():
+                scoped.append(opt)
+        return scoped
+
+    def designate_scoped_node(self, nodes):
+        '''Pick the node, out of the SosNodes being collected from, that
+        collects the cluster-scoped plugins and options.
+
+        By default this is the master node if a sosreport is collected from
+        it, otherwise the first node on which all of the plugins involved are
+        enabled, otherwise the first node.
+        '''
+        if not nodes:
+            return None
+        if self.master in nodes:
+            return self.master
+        plugins = set(self.get_scoped_plugins())
+        plugins.update(o.split('.')[0] for o in self.get_scoped_options())
+        nodes = sorted(nodes, key=lambda n: n.address)
+        for node in nodes:
+            if all(node._check_enabled(p) for p in plugins):
+                return node
+        return nodes[0]
 
     def format_node_list(self):
         '''Format the returned list of nodes from a cluster into a known
@@ -23,29 +23,55 @@ class kubernetes(Cluster):
     packages = ('kubernetes-master',)
     sos_plugins = ['kubernetes']
     sos_plugin_options = {'kubernetes.all': 'on'}
+    # every master would otherwise collect all objects in all namespaces
+    cluster_scoped_options = ['kubernetes.all']
 
     cmd = 'kubectl'
+    role_label = 'node-role.kubernetes.io/'
 
     option_list = [
         ('label', '', 'Filter node list to those with matching label'),
         ('role', '', 'Filter node list to those with matching role')
     ]
 
+    def _topology(self, labels, key):
+        '''Returns the topology label key of a node, or its older
+        failure-domain.beta form'''
+        return labels.get('topology.kubernetes.io/%s' % key,
+                          labels.get('failure-domain.beta.kubernetes.io/%s'
+                                     % key))
+
     def get_nodes(self):
-        self.cmd += ' get nodes'
+        cmd = '%s get nodes -o json' % self.cmd
+        selectors = []
         if self.get_option('label'):
-            self.cmd += ' -l %s ' % quote(self.get_option('label'))
-        res = self.exec_master_cmd(self.cmd)
+            selectors.append(self.get_option('label'))
+        roles = [x for x in self.get_option('role').split(',') if x]
+        # a single role can be filtered server side, but label selectors
+        # cannot express 'any of' across multiple role labels
+        if len(roles) == 1:
+            selectors.append('%s%s' % (self.role_label, roles[0]))
+        if selectors:
+            cmd += ' -l %s' % quote(','.join(selectors))
+        res = self.exec_master_cmd(cmd)
         if res['status'] == 0:
             nodes = []
-            roles = [x for x in self.get_option('role').split(',') if x]
-            for nodeln in res['stdout'].splitlines()[1:]:
-                node = nodeln.split()
-                if not roles:
-                    nodes.append(node[0])
-                else:
-                    if node[2] in roles:
-                        nodes.append(node[0])
+            for item in self.parse_json_output(res['stdout'])['items']:
+                node = item['metadata']['name']
+                labels = item['metadata'].get('labels', {})
+                node_roles = [lbl[len(self.role_label):] for lbl in labels
+                              if lbl.startswith(self.role_label)]
+                if roles and not set(roles).intersection(node_roles):
+                    continue
+                ready = None
+                for cond in item.get('status', {}).get('conditions', []):
+                    if cond.get('type') == 'Ready':
+                        ready = cond.get('status') == 'True'
+                self.add_node(node, roles=node_roles, online=ready,
+                              labels=labels,
+                              datacenter=self._topology(labels, 'region'),
+                              rack=self._topology(labels, 'zone'))
+                nodes.append(node)
             return nodes
         else:
             raise Exception('Node enumeration did not return usable output')
@@ -24,7 +24,29 @@ class ovirt(Cluster):
 
     cluster_name = 'Community oVirt'
     packages = ('ovirt-engine',)
-    db_exec = '/usr/share/ovirt-engine/dbscripts/engine-psql.sh -c'
+    db_exec = '/usr/share/ovirt-engine/dbscripts/engine-psql.sh -At -c'
+
+    # vds_dynamic.status values, from the engine's VDSStatus enum
+    host_status = {
+        0: 'unassigned',
+        1: 'down',
+        2: 'maintenance',
+        3: 'up',
+        4: 'non-responsive',
+        5: 'error',
+        6: 'installing',
+        7: 'install-failed',
+        8: 'reboot',
+        9: 'preparing-for-maintenance',
+        10: 'non-operational',
+        11: 'pending-approval',
+        12: 'initializing',
+        13: 'connecting',
+        14: 'installing-os',
+        15: 'kdumping'
+    }
+    offline_status = ('down', 'non-responsive', 'reboot', 'installing-os',
+                      'kdumping')
 
     option_list = [
         ('no-database', False, 'Do not collect a database dump'),
@@ -66,10 +88,12 @@ class ovirt(Cluster):
     def format_db_cmd(self):
         cluster = self._sql_scrub(self.get_option('cluster'))
         datacenter = self._sql_scrub(self.get_option('datacenter'))
-        self.dbquery = ("SELECT host_name from vds_static where cluster_id in "
-                        "(select cluster_id FROM cluster WHERE name like '%s'"
-                        " and storage_pool_id in (SELECT id FROM storage_pool "
-                        "WHERE name like '%s'))" % (cluster, datacenter))
+        self.dbquery = ("SELECT s.host_name, d.status, c.name, p.name FROM "
+                        "vds_static s JOIN vds_dynamic d ON s.vds_id = "
+                        "d.vds_id JOIN cluster c ON s.cluster_id = "
+                        "c.cluster_id JOIN storage_pool p ON "
+                        "c.storage_pool_id = p.id WHERE c.name like '%s' "
+                        "and p.name like '%s'" % (cluster, datacenter))
         self.log_debug('Query command for ovirt DB set to: %s' % self.dbquery)
 
     def get_nodes(self):
@@ -77,8 +101,22 @@ class ovirt(Cluster):
             return []
         res = self._run_db_query(self.dbquery)
         if res['status'] == 0:
-            nodes = res['stdout'].splitlines()[2:-1]
-            return [n.split('(')[0].strip() for n in nodes]
+            nodes = []
+            for row in self.parse_psql_rows(res['stdout']):
+                if len(row) != 4:
+                    continue
+                node, status, cluster, datacenter = row
+                try:
+                    status = self.host_status[int(status)]
+                except (KeyError, ValueError):
+                    status = None
+                online = None
+                if status:
+                    online = status not in self.offline_status
+                self.add_node(node, online=online, status=status,
+                              cluster=cluster, datacenter=datacenter)
+                nodes.append(node)
+            return nodes
         else:
             raise Exception('database query failed, return code: %s'
                             % res['status'])
@@ -156,5 +194,6 @@ class rhhi_virt(rhv):
         ret = self._run_db_query('SELECT count(server_id) FROM gluster_server')
         if ret['status'] == 0:
             # if there are any entries in this table, RHHI-V is in use
-            return ret['stdout'].splitlines()[2].strip() != '0'
+            rows = self.parse_psql_rows(ret['stdout'])
+            return bool(rows) and rows[0][0] != '0'
         return False
@@ -27,36 +27,23 @@ class pacemaker(Cluster):
     ]
 
     def get_nodes(self):
-        self.res = self.exec_master_cmd('pcs status')
+        self.res = self.exec_master_cmd('crm_mon --one-shot --as-xml')
         if self.res['status'] != 0:
             self.log_error('Cluster status could not be determined. Is the '
                            'cluster running on this node?')
             return []
-        if 'node names do not match' in self.res['stdout']:
-            self.log_warn('Warning: node name mismatch reported. Attempts to '
-                          'connect to some nodes may fail.\n')
-        return self.parse_pcs_output()
+        return self.parse_crm_mon_output()
 
-    def parse_pcs_output(self):
+    def parse_crm_mon_output(self):
         nodes = []
-        if self.get_option('online'):
-            nodes += self.get_online_nodes()
-        if self.get_option('offline'):
-            nodes += self.get_offline_nodes()
+        for node in self.iter_xml_elements(self.res['stdout'],
+                                           ('nodes', 'node')):
+            name = node.get('name')
+            online = node.get('online') == 'true'
+            self.add_node(name, online=online, roles=[node.get('type')],
+                          standby=node.get('standby') == 'true')
+            if online and self.get_option('online'):
+                nodes.append(name)
+            if not online and self.get_option('offline'):
+                nodes.append(name)
         return nodes
-
-    def get_online_nodes(self):
-        for line in self.res['stdout'].splitlines():
-            if line.startswith('Online:'):
-                nodes = line.split('[')[1].split(']')[0]
-                return [n for n in nodes.split(' ') if n]
-
-    def get_offline_nodes(self):
-        offline = []
-        for line in self.res['stdout'].splitlines():
-            if line.startswith('Node') and line.endswith('(offline)'):
-                offline.append(line.split()[1].replace(':', ''))
-            if line.startswith('OFFLINE:'):
-                nodes = line.split('[')[1].split(']')[0]
-                offline.extend([n for n in nodes.split(' ') if n])
-        return offline
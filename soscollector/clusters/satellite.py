@@ -25,18 +25,14 @@ class satellite(Cluster):
 
     def _psql_cmd(self, query):
         _cmd = "su postgres -c %s"
-        _dbcmd = "psql foreman -c %s"
+        _dbcmd = "psql foreman -At -c %s"
         return _cmd % quote(_dbcmd % quote(query))
 
     def get_nodes(self):
         cmd = self._psql_cmd('select name from smart_proxies')
         res = self.exec_master_cmd(cmd, need_root=True)
         if res['status'] == 0:
-            idx = 2
-            if 'could not change' in res['stdout']:
-                idx = 3
-            nodes = [n.strip() for n in res['stdout'].splitlines()[idx:-1]]
-            return nodes
+            return [row[0] for row in self.parse_psql_rows(res['stdout'])]
 
     def set_node_label(self, node):
         if node.address == self.master.address:
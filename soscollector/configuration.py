@@ -89,6 +89,57 @@ class Configuration(dict):
         self['password_per_node'] = False
         self['group'] = None
         self['save_group'] = ''
+        self['inventory'] = False
+        self['relays'] = []
+        self['offline_timeout'] = 5
+        self['prescan'] = False
+        self['prescan_timeout'] = 5
+        self['ssh_rate'] = 10
+        self['ssh_retries'] = 3
+        self['conn_limiter'] = None
+        self['persist_connections'] = False
+        self['control_dir'] = None
+        self['control_persist'] = 600
+        self['jump_host'] = None
+        self['jump_control_path'] = None
+        self['jump_concurrency'] = 10
+        self['embedded'] = False
+        self['ui_stream'] = None
+        self['fact_cache'] = None
+        self['event_hook'] = None
+        self['resume'] = None
+        self['resume_archive'] = None
+        self['detach'] = False
+        self['poll_interval'] = 30
+        self['harvest'] = False
+        self['harvest_age'] = '1d'
+        self['cache'] = False
+        self['cache_dir'] = None
+        self['cache_age'] = '1h'
+        self['cache_size'] = 2048
+        self['archive_cache'] = None
+        self['no_cluster_scoping'] = False
+        self['scoped_node'] = None
+        self['shard_nodes'] = []
+        self['shard_slower_than'] = None
+        self['shard_max'] = 4
+        self['auto_tune'] = False
+        self['throttle'] = None
+        self['max_load'] = None
+        self['max_pressure'] = None
+        self['hold_timeout'] = 600
+        self['guardrail'] = None
+        self['domain_key'] = 'cluster'
+        self['domain_limit'] = 0
+        self['connect_threads'] = None
+        self['exec_threads'] = None
+        self['transfer_threads'] = None
+        self['cleanup_threads'] = None
+        self['adaptive'] = False
+        self['fd_budget'] = None
+        self['sos_lists'] = {}
+        self['no_sos_memo'] = False
+        self['sos_memo'] = None
 
     def parse_node_strings(self):
         '''
@@ -155,7 +206,7 @@ class Configuration(dict):
     def parse_options(self):
         self.parse_cluster_options()
         for opt in ['skip_plugins', 'enable_plugins', 'plugin_options',
-                    'only_plugins']:
+                    'only_plugins', 'shard_nodes']:
             if self[opt]:
                 opts = []
                 if isinstance(self[opt], six.string_types):
@@ -0,0 +1,298 @@
+# Copyright Red Hat 2019, Jake Hunsaker <jhunsake@redhat.com>
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Long running sos-collector daemon, which accepts collection jobs over a local
+Unix socket so that repeated collections do not pay for interpreter startup,
+the local ssh capability check, SSH handshakes or host fact discovery.
+
+The protocol is line based JSON. A client sends a single request line such as
+
+    {"action": "collect", "options": {...}}
+
+where options are the parsed command line options of sos-collector. The
+daemon replies with one line per event, either {"event": "log", ...} for
+console output of the job, or a final {"event": "result", ...}.
+'''
+
+import copy
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from getpass import getpass
+from six.moves import socketserver
+
+from soscollector import __version__
+from soscollector.sshpool import default_control_dir, prepare_control_dir
+
+DAEMON_SOCKET = 'daemon.sock'
+# seconds that facts discovered for a node are reused for
+FACT_CACHE_TTL = 300
+# options holding local paths, made absolute before being sent to the daemon
+PATH_OPTIONS = ('ssh_key', 'tmp_dir', 'resume')
+
+
+def default_daemon_socket(control_dir=None):
+    '''Returns the default path of the daemon socket, which lives in the
+    private directory of shared control sockets'''
+    return os.path.join(control_dir or default_control_dir(), DAEMON_SOCKET)
+
+
+class FactCache(object):
+    '''Host facts and sos information discovered for nodes by earlier jobs,
+    reused by later jobs for up to ttl seconds'''
+
+    def __init__(self, ttl=FACT_CACHE_TTL):
+        self.ttl = ttl
+        self.facts = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''Returns the cached facts for key, the connection of a node as
+        user@address:port, or None if there are none or they have expired'''
+        with self._lock:
+            entry = self.facts.get(key)
+            if not entry:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self.facts[key]
+                return None
+            return copy.deepcopy(entry[1])
+
+    def set(self, key, facts):
+        with self._lock:
+            self.facts[key] = (time.time(), copy.deepcopy(facts))
+
+    def clear(self):
+        with self._lock:
+            self.facts = {}
+
+
+class ClientStream(object):
+    '''File-like object given to the console log handler of a job, which
+    forwards the job's output to the connected client'''
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, msg):
+        msg = msg.rstrip('\n')
+        try:
+            _send(self.wfile, {'event': 'log', 'message': msg})
+        except (IOError, socket.error):
+            # the client went away, the job carries on regardless
+            pass
+
+    def flush(self):
+        pass
+
+
+def _send(wfile, msg):
+    wfile.write((json.dumps(msg) + '\n').encode('utf-8'))
+    wfile.flush()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            action = request.get('action')
+        except ValueError:
+            action = None
+        if action == 'ping':
+            _send(self.wfile, {'event': 'pong', 'version': __version__})
+        elif action == 'collect':
+            result = self.server.daemon.run_job(request.get('options', {}),
+                                                ClientStream(self.wfile))
+            _send(self.wfile, result)
+        elif action == 'shutdown':
+            _send(self.wfile, {'event': 'result', 'status': 0})
+            threading.Thread(target=self.server.shutdown).start()
+        else:
+            _send(self.wfile, {'event': 'result', 'status': 1,
+                               'error': 'Invalid request'})
+
+
+class _DaemonServer(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class CollectorDaemon(object):
+    '''Serves collection jobs on a Unix socket.
+
+    Jobs are run one at a time, as the sos-collector loggers are shared by
+    the whole process, but requests such as ping are answered while a job is
+    running. Every job uses the shared directory of control sockets with
+    persistent connections, so connections opened by one job are reused by
+    the next, and facts discovered for nodes are cached between jobs.
+    '''
+
+    def __init__(self, socket_path=None, control_dir=None,
+                 fact_ttl=FACT_CACHE_TTL):
+        self.control_dir = prepare_control_dir(control_dir or
+                                               default_control_dir())
+        self.socket_path = socket_path or \
+            default_daemon_socket(self.control_dir)
+        self.facts = FactCache(fact_ttl)
+        self.server = None
+        self.jobs = 0
+        self._job_lock = threading.Lock()
+
+    def bind(self):
+        '''Create the listening socket, replacing a stale socket left behind
+        by a daemon that is no longer running'''
+        if os.path.exists(self.socket_path):
+            if daemon_available(self.socket_path):
+                raise OSError("A daemon is already listening on %s"
+                              % self.socket_path)
+            os.remove(self.socket_path)
+        old_umask = os.umask(0o177)
+        try:
+            self.server = _DaemonServer(self.socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self.server.daemon = self
+
+    def serve_forever(self):
+        if not self.server:
+            self.bind()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        if self.server:
+            self.server.shutdown()
+
+    def close(self):
+        if self.server:
+            self.server.server_close()
+            self.server = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def run_job(self, options, stream):
+        '''Run a collection with the given command line options, sending the
+        console output to stream. Returns the result event for the client
+        '''
+        # imported here so that clients only importing this module to talk
+        # to a daemon do not pay for loading the collector
+        from soscollector.configuration import Configuration
+        from soscollector.sos_collector import SosCollector, reset_logging
+
+        with self._job_lock:
+            self.jobs += 1
+            options = dict(options)
+            options.update({
+                'batch': True,
+                'embedded': True,
+                'persist_connections': True,
+                'control_dir': self.control_dir
+            })
+            result = {'event': 'result', 'status': 0, 'archive': None}
+            config = None
+            try:
+                config = Configuration(options)
+                config['ui_stream'] = stream
+                config['fact_cache'] = self.facts
+                sc = SosCollector(config)
+                sc.collect()
+                result['archive'] = getattr(sc, 'archive', None)
+            except SystemExit as err:
+                result['status'] = err.code if err.code is not None else 0
+            except Exception as err:
+                result['status'] = 1
+                result['error'] = str(err)
+            finally:
+                if config is not None:
+                    reset_logging(config)
+            return result
+
+
+def _connect(path, timeout=None):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    sock.connect(path)
+    return sock
+
+
+def daemon_available(path, timeout=1):
+    '''Returns True if a daemon is answering on the socket at path'''
+    if not os.path.exists(path):
+        return False
+    try:
+        sock = _connect(path, timeout)
+        try:
+            sock.sendall(b'{"action": "ping"}\n')
+            reply = sock.makefile('rb').readline()
+            return json.loads(reply.decode('utf-8'))['event'] == 'pong'
+        finally:
+            sock.close()
+    except (socket.error, ValueError, KeyError):
+        return False
+
+
+def prepare_job_options(options):
+    '''Prepare command line options to be sent to the daemon. Paths are made
+    absolute, as the daemon runs from a different directory, and the client
+    prompts for the passwords the options call for, since a job run by the
+    daemon cannot prompt for them itself
+    '''
+    for opt in PATH_OPTIONS:
+        if options.get(opt):
+            options[opt] = os.path.abspath(options[opt])
+    user = options.get('ssh_user') or 'root'
+    if options.get('password'):
+        options['password'] = getpass('Provide the SSH password for user %s: '
+                                      % user)
+    if user != 'root' and not options.get('insecure_sudo'):
+        if options.get('password'):
+            options['sudo_pw'] = options['password']
+        else:
+            options['sudo_pw'] = getpass('A non-root user has been provided. '
+                                         'Provide sudo password for %s on '
+                                         'remote nodes: ' % user)
+    if options.get('become_root') and user != 'root':
+        options['root_password'] = getpass('User %s will attempt to become '
+                                           'root. Provide root password: '
+                                           % user)
+    return options
+
+
+def send_request(path, request, out=sys.stderr):
+    '''Send a request to the daemon at path, writing the output of the job
+    to out as it arrives. Returns the final result event.
+    '''
+    sock = _connect(path)
+    try:
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        for line in sock.makefile('rb'):
+            msg = json.loads(line.decode('utf-8'))
+            if msg['event'] == 'log':
+                out.write(msg['message'] + '\n')
+                out.flush()
+            else:
+                return msg
+    finally:
+        sock.close()
+    return {'event': 'result', 'status': 1,
+            'error': 'Connection to daemon closed unexpectedly'}
@@ -67,6 +67,15 @@ class CommandTimeoutException(Exception):
         super(CommandTimeoutException, self).__init__(message)
 
 
+class ConnectionRejectedException(Exception):
+    '''Raised when the remote host resets or closes a connection attempt, as
+    sshd does when its MaxStartups limit is exceeded'''
+
+    def __init__(self, address=''):
+        message = "Connection to %s was reset or closed" % address
+        super(ConnectionRejectedException, self).__init__(message)
+
+
 class ConnectionTimeoutException(Exception):
     '''Raised when a timeout expires while trying to connect to the host'''
 
@@ -97,3 +106,11 @@ class UnsupportedHostException(Exception):
     def __init__(self):
         message = 'Host did not match any supported distributions'
         super(UnsupportedHostException, self).__init__(message)
+
+
+class InventoryQueryException(Exception):
+    '''Raised when a host inventory query expression cannot be parsed'''
+
+    def __init__(self, expression=''):
+        message = "Invalid inventory query: %s" % expression
+        super(InventoryQueryException, self).__init__(message)
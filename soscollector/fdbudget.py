@@ -0,0 +1,114 @@
+# Copyright Red Hat 2019, Jake Hunsaker <jhunsake@redhat.com>
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Budget of the file descriptors used by the ssh, scp and local commands that
+sos-collector runs through pexpect. Each of these holds a pty and pipes in
+the collector for as long as it runs, so with enough nodes at once the
+collector runs out of descriptors and fails with EMFILE errors.
+
+Once the limit is raised, descriptors above FD_SETSIZE (1024) are handed
+out, which select() cannot wait on, so pexpect sessions must be spawned with
+use_poll=True.
+'''
+
+import threading
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# descriptors held by the collector for each running child, which is the pty
+# of the pexpect session plus the pipes used while spawning it
+FDS_PER_CHILD = 3
+
+# descriptors left for logs, archives, sockets and the python runtime
+RESERVED_FDS = 64
+
+# the soft limit to aim for when the hard limit is unlimited, which Linux
+# does not allow RLIMIT_NOFILE to be set to
+NOFILE_TARGET = 65536
+
+
+def raise_nofile_limit(target=None):
+    '''Raise the soft RLIMIT_NOFILE as far as the hard limit allows, or to
+    target if lower. Returns the resulting soft limit, or None if there is
+    no limit or it cannot be determined.
+    '''
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    want = NOFILE_TARGET if hard == resource.RLIM_INFINITY else hard
+    if target:
+        want = min(want, target)
+    if soft != resource.RLIM_INFINITY and soft < want:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (want, hard))
+            soft = want
+        except (OSError, ValueError):
+            pass
+    if soft == resource.RLIM_INFINITY:
+        return None
+    return soft
+
+
+class FdBudget(object):
+    '''Limits the number of child processes running at once to what the
+    descriptor limit allows.
+
+    limit is the soft RLIMIT_NOFILE. Of this, reserved descriptors are kept
+    for everything else the collector has open, and the rest is divided into
+    slots of per_child descriptors.
+    '''
+
+    def __init__(self, limit, per_child=FDS_PER_CHILD,
+                 reserved=RESERVED_FDS):
+        self.limit = limit
+        self.slots = max(1, (limit - reserved) // per_child)
+        self.in_flight = 0
+        self.peak = 0
+        self.waits = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        '''Block until a child process may be started'''
+        with self._cond:
+            if self.in_flight >= self.slots:
+                self.waits += 1
+            while self.in_flight >= self.slots:
+                self._cond.wait()
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+
+@contextmanager
+def child_slot(budget):
+    '''Hold a slot of budget, if there is one, while a child process runs'''
+    if budget is None:
+        yield
+        return
+    budget.acquire()
+    try:
+        yield
+    finally:
+        budget.release()
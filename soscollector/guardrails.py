@@ -0,0 +1,189 @@
+# Copyright Red Hat 2019, Jake Hunsaker <jhunsake@redhat.com>
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Guardrails that limit the impact of sosreport on busy production nodes.
+
+sosreport can be run at a lower CPU and IO priority, either with nice and
+ionice or in a transient systemd scope with reduced CPU and IO weights.
+
+The load and pressure (PSI) of each node can also be sampled before and
+while sosreport runs on it. A node that is over the thresholds holds its
+failure domain, and no new sosreport is started in that domain until the
+node recovers or the hold times out.
+'''
+
+import re
+import threading
+import time
+
+THROTTLE_MODES = ('nice', 'systemd')
+
+# seconds between samples of a node's load and pressure
+SAMPLE_INTERVAL = 15
+
+PRESSURE_CMD = ("sh -c 'nproc; cat /proc/loadavg; "
+                "cat /proc/pressure/cpu /proc/pressure/io 2>/dev/null'")
+
+# systemd 231 replaced CPUShares and BlockIOWeight with CPUWeight and IOWeight
+SYSTEMD_WEIGHTS_VERSION = 231
+
+
+def throttle_command(cmd, mode, systemd_version=None):
+    '''Wrap cmd so that it runs with reduced CPU and IO priority'''
+    if mode == 'systemd':
+        if systemd_version and systemd_version < SYSTEMD_WEIGHTS_VERSION:
+            props = '-p CPUShares=128 -p BlockIOWeight=100'
+        else:
+            props = '-p CPUWeight=10 -p IOWeight=10'
+        return 'systemd-run --scope %s %s' % (props, cmd)
+    if mode == 'nice':
+        return 'nice -n 19 ionice -c 2 -n 7 %s' % cmd
+    return cmd
+
+
+def parse_systemd_version(output):
+    '''Returns the version from the output of systemctl --version'''
+    match = re.search(r'systemd (\d+)', output)
+    return int(match.group(1)) if match else None
+
+
+def parse_pressure(output):
+    '''Parse the output of PRESSURE_CMD into a dict of the 1 minute 'load'
+    per CPU and the 10 second 'some' averages of 'cpu' and 'io' pressure.
+    Pressure is None on kernels without PSI.
+    '''
+    sample = {'load': None, 'cpu': None, 'io': None}
+    cpus = 1
+    psi = []
+    for line in output.splitlines():
+        line = line.strip()
+        if re.match(r'^\d+$', line):
+            cpus = max(int(line), 1)
+        elif re.match(r'^\d+\.\d+ \d+\.\d+ \d+\.\d+ ', line):
+            sample['load'] = float(line.split()[0])
+        elif line.startswith('some '):
+            match = re.search(r'avg10=(\d+(\.\d+)?)', line)
+            if match:
+                psi.append(float(match.group(1)))
+    if sample['load'] is not None:
+        sample['load'] = sample['load'] / cpus
+    # cpu pressure is printed before io pressure
+    if psi:
+        sample['cpu'] = psi[0]
+    if len(psi) > 1:
+        sample['io'] = psi[1]
+    return sample
+
+
+class Guardrail(object):
+    '''Tracks which failure domains are held by nodes over the load or
+    pressure thresholds.
+
+    max_load is the load per CPU and max_pressure the percentage of time
+    tasks were stalled on CPU or IO above which a node is over threshold.
+    Either may be None to not check it.
+    '''
+
+    def __init__(self, max_load=None, max_pressure=None, hold_timeout=600,
+                 interval=SAMPLE_INTERVAL):
+        self.max_load = max_load
+        self.max_pressure = max_pressure
+        self.hold_timeout = hold_timeout
+        self.interval = interval
+        self.holders = {}
+        self._cond = threading.Condition()
+
+    def over_threshold(self, sample):
+        if self.max_load is not None and sample['load'] is not None and \
+                sample['load'] >= self.max_load:
+            return True
+        if self.max_pressure is not None:
+            for key in ('cpu', 'io'):
+                if sample[key] is not None and \
+                        sample[key] >= self.max_pressure:
+                    return True
+        return False
+
+    def update(self, domain, node, over):
+        '''Record if node, in domain, is over the thresholds'''
+        with self._cond:
+            holders = self.holders.setdefault(domain, set())
+            if over:
+                holders.add(node)
+            else:
+                holders.discard(node)
+                self._cond.notify_all()
+
+    def is_held(self, domain, node=None):
+        '''Is domain held by any node other than node'''
+        with self._cond:
+            return bool(self.holders.get(domain, set()) - set([node]))
+
+    def wait(self, domain, node, sample_func):
+        '''Block until neither domain nor node is over the thresholds, or
+        hold_timeout has passed. sample_func returns a new sample of the
+        node. Returns the seconds spent waiting.
+        '''
+        start = time.time()
+        while True:
+            sample = sample_func()
+            over = sample is not None and self.over_threshold(sample)
+            self.update(domain, node, over)
+            if not over and not self.is_held(domain, node):
+                break
+            if time.time() - start >= self.hold_timeout:
+                break
+            with self._cond:
+                self._cond.wait(self.interval)
+        self.update(domain, node, False)
+        return time.time() - start
+
+    def monitor(self, domain, node, sample_func):
+        '''Start sampling node in the background, holding domain while the
+        node is over the thresholds. Returns the monitor, which must be
+        stopped when the node's sosreport has finished.
+        '''
+        return GuardrailMonitor(self, domain, node, sample_func).start()
+
+
+class GuardrailMonitor(object):
+
+    def __init__(self, guardrail, domain, node, sample_func):
+        self.guardrail = guardrail
+        self.domain = domain
+        self.node = node
+        self.sample_func = sample_func
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.guardrail.interval):
+            sample = self.sample_func()
+            if sample is not None:
+                self.guardrail.update(
+                    self.domain, self.node,
+                    self.guardrail.over_threshold(sample)
+                )
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.guardrail.update(self.domain, self.node, False)
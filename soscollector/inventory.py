@@ -0,0 +1,234 @@
+# Copyright Red Hat 2019, Jake Hunsaker <jhunsake@redhat.com>
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from soscollector.exceptions import InventoryQueryException
+
+INVENTORY_NAME = 'inventory.db'
+
+# columns of the nodes table that may be used directly in a query expression
+NODE_COLUMNS = ('name', 'cluster', 'cluster_type', 'master')
+# columns holding timestamps, compared against an age such as '7d'
+AGE_COLUMNS = ('last_seen', 'last_success')
+# columns holding a duration in seconds
+DURATION_COLUMNS = ('last_duration',)
+
+UNITS = {
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+    'w': 604800
+}
+
+TERM_REGEX = re.compile(r'^\s*(?P<key>[\w.\-/]+)\s*'
+                        r'(?P<op>!=|>=|<=|=|>|<)\s*(?P<value>.*?)\s*$')
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS nodes (
+        name TEXT PRIMARY KEY,
+        cluster TEXT,
+        cluster_type TEXT,
+        master TEXT,
+        facts TEXT,
+        last_seen REAL,
+        last_success REAL,
+        last_duration REAL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS node_roles (
+        name TEXT NOT NULL,
+        role TEXT NOT NULL,
+        PRIMARY KEY (name, role)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS node_labels (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT,
+        PRIMARY KEY (name, key)
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_nodes_cluster ON nodes (cluster)',
+    'CREATE INDEX IF NOT EXISTS idx_nodes_type ON nodes (cluster_type)',
+    'CREATE INDEX IF NOT EXISTS idx_nodes_success ON nodes (last_success)',
+    'CREATE INDEX IF NOT EXISTS idx_nodes_seen ON nodes (last_seen)',
+    'CREATE INDEX IF NOT EXISTS idx_roles_role ON node_roles (role)',
+    'CREATE INDEX IF NOT EXISTS idx_labels_kv ON node_labels (key, value)'
+]
+
+
+def is_query(group):
+    '''Returns True if the given --group value is an inventory query
+    expression rather than the name of a host group file
+    '''
+    return any(c in group for c in '=<>')
+
+
+def parse_seconds(value):
+    '''Converts a value such as '90', '30m' or '7d' into seconds'''
+    match = re.match(r'^(\d+(?:\.\d+)?)\s*([smhdw]?)$', value.strip())
+    if not match:
+        raise InventoryQueryException(value)
+    return float(match.group(1)) * UNITS[match.group(2) or 's']
+
+
+def split_terms(expression):
+    '''Split a query expression on ',' or 'and' into individual terms'''
+    terms = re.split(r',|\s+and\s+', expression, flags=re.I)
+    return [t for t in terms if t.strip()]
+
+
+class HostInventory(object):
+    '''SQLite backed inventory of nodes seen by sos-collector.
+
+    Each node is stored with the cluster it was enumerated from, the roles
+    and labels the cluster profile reported for it, the host facts found
+    during the last connection, and the time and duration of the last
+    successful collection.
+
+    The inventory can be queried with simple expressions made up of terms
+    joined by ',' or 'and', for example:
+
+        role=worker and last_success>7d
+        cluster=prod,label.zone=east
+
+    Age columns (last_seen, last_success) compare the age of the timestamp,
+    so 'last_success>7d' matches nodes that have not been successfully
+    collected from in the last 7 days, including nodes that never were.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            for stmt in SCHEMA:
+                self.db.execute(stmt)
+
+    def close(self):
+        self.db.close()
+
+    def update_node(self, name, cluster=None, cluster_type=None, master=None,
+                    roles=None, labels=None, facts=None, success=False,
+                    duration=None):
+        '''Add or update a node in the inventory. Roles and labels, if
+        given, replace the previously recorded values for the node
+        '''
+        now = time.time()
+        with self._lock, self.db:
+            cur = self.db.execute('SELECT facts, last_success, last_duration '
+                                  'FROM nodes WHERE name = ?', (name,))
+            row = cur.fetchone()
+            _facts, last_success, last_duration = row or (None, None, None)
+            if facts is not None:
+                _facts = json.dumps(facts, sort_keys=True)
+            if success:
+                last_success = now
+                if duration is not None:
+                    last_duration = duration
+            self.db.execute(
+                'INSERT OR REPLACE INTO nodes (name, cluster, cluster_type, '
+                'master, facts, last_seen, last_success, last_duration) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (name, cluster, cluster_type, master, _facts, now,
+                 last_success, last_duration)
+            )
+            if roles is not None:
+                self.db.execute('DELETE FROM node_roles WHERE name = ?',
+                                (name,))
+                self.db.executemany(
+                    'INSERT OR IGNORE INTO node_roles VALUES (?, ?)',
+                    [(name, r) for r in roles if r]
+                )
+            if labels is not None:
+                self.db.execute('DELETE FROM node_labels WHERE name = ?',
+                                (name,))
+                self.db.executemany(
+                    'INSERT INTO node_labels VALUES (?, ?, ?)',
+                    [(name, k, labels[k]) for k in labels]
+                )
+
+    def get_node(self, name):
+        '''Returns a dict of the recorded information for a node'''
+        cur = self.db.execute('SELECT name, cluster, cluster_type, master, '
+                              'facts, last_seen, last_success, last_duration '
+                              'FROM nodes WHERE name = ?', (name,))
+        row = cur.fetchone()
+        if not row:
+            return None
+        keys = ('name', 'cluster', 'cluster_type', 'master', 'facts',
+                'last_seen', 'last_success', 'last_duration')
+        node = dict(zip(keys, row))
+        node['facts'] = json.loads(node['facts']) if node['facts'] else {}
+        node['roles'] = [r[0] for r in self.db.execute(
+            'SELECT role FROM node_roles WHERE name = ?', (name,))]
+        node['labels'] = dict(self.db.execute(
+            'SELECT key, value FROM node_labels WHERE name = ?', (name,)))
+        return node
+
+    def _build_term(self, term, now):
+        '''Translate a single query term into a SQL clause and parameters'''
+        match = TERM_REGEX.match(term)
+        if not match:
+            raise InventoryQueryException(term)
+        key, op, value = match.group('key', 'op', 'value')
+        key = key.lower()
+        if key in AGE_COLUMNS:
+            if op in ('=', '!='):
+                raise InventoryQueryException(term)
+            # an older timestamp means a larger age, so flip the operator
+            flip = {'>': '<', '<': '>', '>=': '<=', '<=': '>='}
+            clause = '%s %s ?' % (key, flip[op])
+            if op.startswith('>'):
+                clause = '(%s OR %s IS NULL)' % (clause, key)
+            return clause, [now - parse_seconds(value)]
+        if key in DURATION_COLUMNS:
+            return '%s %s ?' % (key, op), [parse_seconds(value)]
+        if op not in ('=', '!='):
+            raise InventoryQueryException(term)
+        negate = 'NOT ' if op == '!=' else ''
+        if key in NODE_COLUMNS:
+            if any(c in value for c in '*?['):
+                return '%s%s GLOB ?' % (negate, key), [value]
+            return '%s%s = ?' % (negate, key), [value]
+        if key in ('role', 'roles'):
+            return ('%sname IN (SELECT name FROM node_roles WHERE role = ?)'
+                    % negate, [value])
+        if key.startswith('label.'):
+            return ('%sname IN (SELECT name FROM node_labels WHERE key = ? '
+                    'AND value = ?)' % negate, [key.split('.', 1)[1], value])
+        raise InventoryQueryException(term)
+
+    def query(self, expression):
+        '''Return the names of all nodes matching the query expression'''
+        now = time.time()
+        clauses = []
+        params = []
+        for term in split_terms(expression):
+            clause, args = self._build_term(term, now)
+            clauses.append(clause)
+            params.extend(args)
+        if not clauses:
+            raise InventoryQueryException(expression)
+        sql = ('SELECT name FROM nodes WHERE %s ORDER BY name'
+               % ' AND '.join(clauses))
+        return [r[0] for r in self.db.execute(sql, params)]
+
+    def query_nodes(self, expression):
+        '''Like query(), but return the full record for each node'''
+        return [self.get_node(n) for n in self.query(expression)]
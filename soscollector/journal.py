@@ -0,0 +1,205 @@
+# Copyright Red Hat 2019, Jake Hunsaker <jhunsake@redhat.com>
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Append-only journal of a collection run, kept in the run's tmp_dir, which
+records the state transitions of every node and the checksum of each
+retrieved sosreport. A run that crashed or had failed nodes can be resumed
+from the journal, collecting only from the nodes that do not already have a
+verified sosreport.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import threading
+import time
+
+JOURNAL_NAME = 'journal.jsonl'
+
+# events of the event stream that are recorded in the journal
+JOURNAL_EVENTS = ('connected', 'connect_failed', 'progress', 'report',
+                  'failed', 'complete', 'aborted')
+
+
+def sha256_file(path):
+    '''Returns the sha256 checksum of the file at path'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fobj:
+        for chunk in iter(lambda: fobj.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sha256_report(path):
+    '''Returns the checksum of a retrieved sosreport. A sharded sosreport is
+    a directory of shard archives, whose checksum is that of a manifest of
+    the name and sha256 checksum of every file in it.
+    '''
+    if not os.path.isdir(path):
+        return sha256_file(path)
+    manifest = hashlib.sha256()
+    for fname in sorted(os.listdir(path)):
+        fpath = os.path.join(path, fname)
+        if os.path.isfile(fpath):
+            manifest.update(('%s %s\n' % (sha256_file(fpath), fname))
+                            .encode('utf-8'))
+    return manifest.hexdigest()
+
+
+def _free_name(directory, name, start=1):
+    '''Returns name with a number added before its extension, such as
+    sos-collector.1.log, that does not exist yet in directory'''
+    base, ext = os.path.splitext(name)
+    idx = start
+    while os.path.exists(os.path.join(directory, '%s.%s%s' % (base, idx,
+                                                              ext))):
+        idx += 1
+    return '%s.%s%s' % (base, idx, ext)
+
+
+def preserve_logs(directory, logs):
+    '''Rename the log files of a previous run so that the resumed run does
+    not archive two logs under the same name.
+
+    logs is a dict of {archived name: name in directory}. Logs extracted from
+    an archive are found under their archived name instead.
+    '''
+    for arcname, fname in logs.items():
+        for cand in (fname, arcname):
+            src = os.path.join(directory, cand)
+            if os.path.isfile(src):
+                os.rename(src, os.path.join(directory,
+                                            _free_name(directory, arcname)))
+                break
+
+
+def archive_member_path(name):
+    '''Returns the path of an archive member relative to the top directory
+    that every sos-collector archive has. Absolute paths, and paths that
+    would leave the directory the archive is extracted into, are rejected.
+    '''
+    parts = name.split('/')
+    if name.startswith('/') or '..' in parts:
+        raise ValueError('Refusing to extract %s from archive' % name)
+    parts = [p for p in parts if p not in ('', '.')]
+    if len(parts) > 1:
+        parts = parts[1:]
+    return os.path.join(*parts)
+
+
+def extract_run_archive(archive, dest):
+    '''Extract the contents of a sos-collector archive into dest, so that
+    the run it was created by can be resumed. Members keep their path
+    below the top directory of the archive, so that the shard directories
+    of sharded sosreports stay intact.
+    '''
+    with tarfile.open(archive, 'r:*') as tar:
+        for member in tar.getmembers():
+            if not member.isfile():
+                continue
+            path = os.path.join(dest, archive_member_path(member.name))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as out:
+                shutil.copyfileobj(tar.extractfile(member), out)
+
+
+class RunJournal(object):
+    '''Journal of a single run directory. Every record is a JSON object on
+    its own line, written and synced to disk before record() returns, so
+    that the journal survives the collector being killed at any point.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(path)
+        self._lock = threading.Lock()
+
+    def record(self, event, node=None, **data):
+        '''Append a record for event to the journal'''
+        data.update({'event': event, 'node': node,
+                     'time': data.get('time', time.time())})
+        line = json.dumps(data, sort_keys=True) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as jfile:
+                jfile.write(line)
+                jfile.flush()
+                os.fsync(jfile.fileno())
+
+    def record_event(self, event):
+        '''Record an event from the collection event stream. Retrieved
+        sosreports are recorded with their checksum, or the checksum of the
+        manifest of their shards.
+        '''
+        if event['event'] not in JOURNAL_EVENTS:
+            return
+        data = dict(event)
+        if data['event'] == 'report' and data.get('path'):
+            data['file'] = os.path.basename(data.pop('path'))
+            try:
+                data['sha256'] = sha256_report(
+                    os.path.join(self.directory, data['file'])
+                )
+            except (IOError, OSError):
+                data['sha256'] = None
+        self.record(data.pop('event'), data.pop('node', None), **data)
+
+    def read(self):
+        '''Returns all records in the journal. A partially written last
+        line, left by a crash, is ignored.
+        '''
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, 'r') as jfile:
+            for line in jfile:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+
+    def last_start(self):
+        '''Returns the start record of the most recent run'''
+        starts = [r for r in self.read() if r['event'] == 'start']
+        return starts[-1] if starts else None
+
+    def node_states(self):
+        '''Returns a dict of {node: last record} for every node'''
+        states = {}
+        for record in self.read():
+            if record.get('node') and 'relay' not in record:
+                states[record['node']] = record
+        return states
+
+    def completed_nodes(self):
+        '''Returns the nodes whose last recorded state is a retrieved
+        sosreport that is still present in the run directory with the
+        recorded checksum
+        '''
+        done = set()
+        for node, record in self.node_states().items():
+            if record['event'] != 'report' or not record.get('sha256'):
+                continue
+            path = os.path.join(self.directory, record['file'])
+            try:
+                if sha256_report(path) == record['sha256']:
+                    done.add(node)
+            except (IOError, OSError):
+                continue
+        return done
@@ -0,0 +1,163 @@
+# Copyright Red Hat 2019, Jake Hunsaker <jhunsake@redhat.com>
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Reachability pre-scan for nodes, used to find nodes that cannot be reached
+on the SSH port before any ssh processes are spawned for them.
+'''
+
+import errno
+import os
+import resource
+import select
+import socket
+import threading
+import time
+
+from six.moves import queue
+
+# never use more than this many sockets at once, regardless of fd limits
+MAX_SOCKETS = 1024
+
+
+def _resolve(node, port):
+    return socket.getaddrinfo(node, port, 0, socket.SOCK_STREAM)[0]
+
+
+def resolve_nodes(nodes, port, timeout, threads=64):
+    '''Resolve the addresses of all nodes concurrently.
+
+    Name resolution is blocking, so this is done by a set of worker threads.
+    Nodes that have not resolved before timeout expires are reported as
+    failed. A lookup cannot be interrupted, so the workers are daemon threads
+    that finish any lookups in progress in the background, without holding
+    up the exit of sos-collector, and results that arrive late are dropped.
+
+    Returns a tuple of ({node: addrinfo}, {node: error})
+    '''
+    resolved = {}
+    failed = {}
+    if not nodes:
+        return resolved, failed
+    pending = queue.Queue()
+    for node in nodes:
+        pending.put(node)
+    cond = threading.Condition()
+    state = {'open': True}
+
+    def worker():
+        while True:
+            try:
+                node = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                addrinfo, error = _resolve(node, port), None
+            except Exception as err:
+                addrinfo = None
+                error = 'could not resolve hostname: %s' % err
+            with cond:
+                if not state['open']:
+                    return
+                if error:
+                    failed[node] = error
+                else:
+                    resolved[node] = addrinfo
+                cond.notify()
+
+    for _ in range(min(threads, len(nodes))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+    deadline = time.time() + timeout
+    with cond:
+        while len(resolved) + len(failed) < len(nodes):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            cond.wait(remaining)
+        state['open'] = False
+        for node in nodes:
+            if node not in resolved and node not in failed:
+                failed[node] = 'timeout resolving hostname'
+    return resolved, failed
+
+
+def _socket_budget():
+    '''Number of sockets the scan may hold open at once, leaving half of the
+    process' file descriptor limit for everything else
+    '''
+    soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if soft == resource.RLIM_INFINITY:
+        return MAX_SOCKETS
+    return max(1, min(MAX_SOCKETS, soft // 2))
+
+
+def scan_nodes(nodes, port, timeout=5):
+    '''Check that a TCP connection can be opened to port on every node.
+
+    Names are resolved concurrently, then non-blocking connections are
+    started to all nodes at once and polled for completion. The number of
+    sockets open at the same time is limited by _socket_budget(). As each
+    connection completes, the next one is started.
+
+    Each node gets at most timeout seconds to resolve, and timeout seconds
+    to accept the connection.
+
+    Returns a dict of {node: error} for all nodes that could not be reached
+    '''
+    resolved, failed = resolve_nodes(nodes, port, timeout)
+    queue = list(resolved.items())
+    budget = _socket_budget()
+    poller = select.poll()
+    inflight = {}
+
+    def _start(node, addrinfo):
+        family, socktype, proto, _, sockaddr = addrinfo
+        sock = socket.socket(family, socktype, proto)
+        sock.setblocking(0)
+        err = sock.connect_ex(sockaddr)
+        if err in (0, errno.EINPROGRESS, errno.EALREADY, errno.EWOULDBLOCK):
+            inflight[sock.fileno()] = (node, sock, time.time() + timeout)
+            poller.register(sock, select.POLLOUT | select.POLLERR |
+                            select.POLLHUP)
+        else:
+            failed[node] = os.strerror(err)
+            sock.close()
+
+    def _finish(fd, error=None):
+        node, sock, _ = inflight.pop(fd)
+        poller.unregister(fd)
+        if error is None:
+            err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                error = os.strerror(err)
+        if error:
+            failed[node] = error
+        sock.close()
+
+    while queue or inflight:
+        while queue and len(inflight) < budget:
+            _start(*queue.pop())
+        if not inflight:
+            continue
+        expires = min(i[2] for i in inflight.values())
+        wait_ms = max(0, int((expires - time.time()) * 1000))
+        for fd, event in poller.poll(wait_ms):
+            _finish(fd)
+        now = time.time()
+        for fd in [f for f in inflight if inflight[f][2] <= now]:
+            _finish(fd, 'timeout connecting to port %s' % port)
+    return failed
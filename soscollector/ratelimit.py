@@ -0,0 +1,135 @@
+# Copyright Red Hat 2019, Jake Hunsaker <jhunsake@redhat.com>
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Admission control for new SSH connections, so that raising --threads does not
+exceed the rate at which sshd accepts unauthenticated connections (the sshd
+MaxStartups limit) on the nodes, or on a jump host they are reached through.
+'''
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    '''Allows up to rate acquisitions per second, with bursts of up to burst
+    acquisitions.
+
+    When the remote end rejects connections, throttle() halves the rate, down
+    to a minimum of min_rate. Each successful connection then raises the rate
+    again by a tenth of the configured rate through recover().
+    '''
+
+    def __init__(self, rate, burst=None, min_rate=0.1):
+        if rate <= 0:
+            raise ValueError('rate must be greater than 0')
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.min_rate = min(min_rate, self.max_rate)
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.last = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self):
+        '''Block until a token is available, then take it'''
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def throttle(self):
+        '''Halve the rate and drop any saved up burst'''
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def recover(self):
+        '''Raise the rate back towards the configured rate'''
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class ConnectionLimiter(object):
+    '''Keeps a TokenBucket for each host that connections are made to, either
+    directly or through a jump host, so that the connection rate is limited
+    for each of them independently
+    '''
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.slots = {}
+        self._lock = threading.Lock()
+
+    def set_concurrency(self, key, limit):
+        '''Limit the number of connection attempts that may be in progress
+        to or through the host key at the same time
+        '''
+        if limit:
+            self.slots[key] = threading.BoundedSemaphore(limit)
+
+    def acquire_slot(self, key):
+        '''Block until a connection attempt through key may start'''
+        if key in self.slots:
+            self.slots[key].acquire()
+
+    def release_slot(self, key):
+        '''Release the slot taken by acquire_slot()'''
+        if key in self.slots:
+            self.slots[key].release()
+
+    def _get_bucket(self, key):
+        with self._lock:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(self.rate, self.burst)
+            return self.buckets[key]
+
+    def acquire(self, *keys):
+        '''Block until a new connection may be made to all of the given
+        hosts. Keys that are None are ignored.
+        '''
+        for key in keys:
+            if key:
+                self._get_bucket(key).acquire()
+
+    def throttle(self, *keys):
+        '''Lower the connection rate to the given hosts after a connection
+        was rejected
+        '''
+        for key in keys:
+            if key:
+                self._get_bucket(key).throttle()
+
+    def recover(self, *keys):
+        '''Raise the connection rate to the given hosts after a connection
+        was successful
+        '''
+        for key in keys:
+            if key:
+                self._get_bucket(key).recover()
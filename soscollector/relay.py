@@ -0,0 +1,213 @@
+# Copyright Red Hat 2019, Jake Hunsaker <jhunsake@redhat.com>
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Helpers for hierarchical collection, where sos-collector is run on one or
+more relay nodes that each collect sosreports from a shard of the node list
+and return a single archive to the top level collector.
+'''
+
+import fnmatch
+import json
+import os
+import re
+import shlex
+import shutil
+import tarfile
+
+from pipes import quote
+from soscollector.journal import JOURNAL_NAME, archive_member_path
+
+TIMING_REPORT = 'timings.json'
+RELAY_CMD = 'sos-collector'
+
+# options that are passed through unchanged to the sub-collectors
+RELAY_PASSTHRU = [
+    ('ssh_user', '--ssh-user'),
+    ('ssh_port', '--ssh-port'),
+    ('threads', '--threads'),
+    ('timeout', '--timeout'),
+    ('label', '--label'),
+    ('case_id', '--case-id'),
+    ('preset', '--preset'),
+    ('log_size', '--log-size'),
+    ('compression', '--compression-type'),
+    ('chroot', '--chroot'),
+    ('sysroot', '--sysroot'),
+    ('image', '--image'),
+    ('poll_interval', '--poll-interval'),
+    ('harvest_age', '--harvest-age'),
+    ('cache_age', '--cache-age'),
+    ('shard_slower_than', '--shard-slower-than'),
+    ('shard_max', '--shard-max'),
+    ('throttle', '--throttle'),
+    ('max_load', '--max-load'),
+    ('max_pressure', '--max-pressure'),
+    ('hold_timeout', '--hold-timeout'),
+    ('connect_threads', '--connect-threads'),
+    ('exec_threads', '--exec-threads'),
+    ('transfer_threads', '--transfer-threads'),
+    ('cleanup_threads', '--cleanup-threads')
+]
+
+RELAY_FLAGS = [
+    ('insecure_sudo', '--insecure-sudo'),
+    ('alloptions', '--alloptions'),
+    ('all_logs', '--all-logs'),
+    ('verify', '--verify'),
+    ('detach', '--detach'),
+    ('harvest', '--harvest'),
+    ('cache', '--cache'),
+    ('auto_tune', '--auto-tune'),
+    ('adaptive', '--adaptive'),
+    ('no_sos_memo', '--no-sos-memo')
+]
+
+RELAY_LISTS = [
+    ('enable_plugins', '--enable-plugins'),
+    ('skip_plugins', '--skip-plugins'),
+    ('only_plugins', '--only-plugins'),
+    ('plugin_options', '--plugin-options'),
+    ('shard_nodes', '--shard')
+]
+
+
+def parse_relays(relays):
+    '''Parse the --relay option values into a list of (relay, pattern)
+    tuples. A relay may be given as just an address, or as 'address=pattern'
+    in which case only nodes matching the shell-style pattern are assigned
+    to that relay.
+    '''
+    parsed = []
+    for relay in relays:
+        for _relay in relay.split(','):
+            if not _relay.strip():
+                continue
+            addr, _, pattern = _relay.partition('=')
+            parsed.append((addr.strip(), pattern.strip() or None))
+    return parsed
+
+
+def shard_nodes(nodes, relays):
+    '''Split the node list between the given relays.
+
+    Nodes matching the pattern of a relay are assigned to that relay. The
+    remaining nodes are distributed round-robin between the relays that
+    were not given a pattern. Nodes that cannot be assigned to any relay
+    are returned separately so they can be collected from directly.
+
+    Returns a tuple of ({relay: [nodes]}, [unassigned nodes])
+    '''
+    shards = dict((r[0], []) for r in relays)
+    general = [r[0] for r in relays if not r[1]]
+    unassigned = []
+    idx = 0
+    for node in sorted(nodes):
+        for relay, pattern in relays:
+            if pattern and re.match(fnmatch.translate(pattern), node):
+                shards[relay].append(node)
+                break
+        else:
+            if general:
+                shards[general[idx % len(general)]].append(node)
+                idx += 1
+            else:
+                unassigned.append(node)
+    return shards, unassigned
+
+
+def build_relay_cmd(config, shard, collect_local=False):
+    '''Build the sos-collector command line run on a relay node in order to
+    collect from the nodes in shard.
+
+    If collect_local is True, the relay is itself part of the shard and the
+    sub-collector is allowed to collect a sosreport from its localhost.
+    '''
+    cmd = ('%s --batch --cluster-type=none --nodes=%s'
+           % (RELAY_CMD, quote(','.join(shard))))
+    if not collect_local:
+        cmd += ' --no-local'
+    for opt, flag in RELAY_PASSTHRU:
+        if config[opt]:
+            cmd += ' %s=%s' % (flag, quote(str(config[opt])))
+    for opt, flag in RELAY_FLAGS:
+        if config[opt]:
+            cmd += ' %s' % flag
+    for opt, flag in RELAY_LISTS:
+        if config[opt]:
+            cmd += ' %s=%s' % (flag, quote(','.join(config[opt])))
+    if config['sos_opt_line']:
+        # the option is usually already shell quoted by the configuration,
+        # so recover its value before quoting it for the relay's shell
+        try:
+            opt_line = ' '.join(shlex.split(config['sos_opt_line']))
+        except ValueError:
+            opt_line = config['sos_opt_line']
+        cmd += ' --sos-cmd=%s' % quote(opt_line)
+    return cmd
+
+
+def find_relay_archive(output):
+    '''Returns the path of the archive a sub-collector reported creating'''
+    path = None
+    for line in output.splitlines():
+        if fnmatch.fnmatch(line.strip(), '*/sos-collector-*.tar.gz'):
+            path = line.strip()
+    return path
+
+
+def merge_relay_archive(archive, dest, relay):
+    '''Extract the contents of a relay's archive into dest.
+
+    Members are extracted below dest with their path in the archive, less
+    its top directory, so the shard directories of sharded sosreports stay
+    intact. The relay's log files are renamed to include the name of the
+    relay, and its timing report is returned rather than extracted. The
+    relay's journal is skipped, as it would replace the journal of this
+    collection.
+
+    Returns a tuple of ([sosreport names], timing report dict)
+    '''
+    reports = []
+    timings = {}
+    with tarfile.open(archive, 'r:gz') as tar:
+        for member in tar.getmembers():
+            if not member.isfile():
+                continue
+            fname = archive_member_path(member.name)
+            if fname == JOURNAL_NAME:
+                continue
+            src = tar.extractfile(member)
+            if fname == TIMING_REPORT:
+                timings = json.loads(src.read().decode('utf-8'))
+                continue
+            if fname in ('sos-collector.log', 'ui.log'):
+                name, ext = os.path.splitext(fname)
+                fname = '%s-%s%s' % (name, relay, ext)
+            path = os.path.join(dest, fname)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as out:
+                shutil.copyfileobj(src, out)
+            # a sharded sosreport is its directory of shards
+            topdir = fname.split(os.sep)[0]
+            if topdir != fname:
+                if fnmatch.fnmatch(topdir, 'sosreport-*') and \
+                        topdir not in reports:
+                    reports.append(topdir)
+            elif fnmatch.fnmatch(fname, 'sosreport-*tar*') and not \
+                    fname.endswith(('.md5', '.sha256')):
+                reports.append(fname)
+    return reports, timings
@@ -0,0 +1,249 @@
+# Copyright Red Hat 2019, Jake Hunsaker <jhunsake@redhat.com>
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Scheduling of node collections across failure domains, such as the oVirt
+clusters or Kubernetes zones that nodes are in, so that sosreport does not
+run on every member of one domain at the same time, and adaptive limits on
+how many nodes are worked on at once.
+'''
+
+import multiprocessing
+import os
+import threading
+import time
+
+from collections import deque, OrderedDict
+
+from soscollector.exceptions import (CommandTimeoutException,
+                                     ConnectionRejectedException,
+                                     ConnectionTimeoutException,
+                                     ControlSocketMissingException)
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# errors that suggest the collector, the network or the nodes are overloaded,
+# rather than a problem with one node
+CONGESTION_ERRORS = (CommandTimeoutException, ConnectionRejectedException,
+                     ConnectionTimeoutException, ControlSocketMissingException,
+                     EnvironmentError)
+
+
+def collector_pressure(fd_ratio=0.8, load_ratio=2.0):
+    '''Is the system running sos-collector short on file descriptors, or
+    loaded beyond load_ratio per CPU'''
+    if resource:
+        try:
+            soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+            fds = len(os.listdir('/proc/self/fd'))
+            if soft > 0 and fds >= soft * fd_ratio:
+                return True
+        except (OSError, ValueError):
+            pass
+    try:
+        load = os.getloadavg()[0]
+        if load / multiprocessing.cpu_count() >= load_ratio:
+            return True
+    except (OSError, NotImplementedError):
+        pass
+    return False
+
+
+class DomainScheduler(object):
+    '''Hands out nodes to workers, at most limit nodes of any one failure
+    domain at a time. A limit of 0 does not cap the domains.
+
+    Domains take turns: the next node comes from the domain with the fewest
+    running nodes, and of those, the one served least recently. This keeps
+    the workers busy across all domains instead of draining one domain
+    after another.
+    '''
+
+    def __init__(self, nodes, domain_func, limit=0):
+        self.limit = limit
+        self.queues = OrderedDict()
+        self.domains = {}
+        for node in nodes:
+            domain = domain_func(node)
+            self.domains[node] = domain
+            self.queues.setdefault(domain, deque()).append(node)
+        self.running = dict((d, 0) for d in self.queues)
+        self.served = dict((d, i) for i, d in enumerate(self.queues))
+        self._turn = len(self.queues)
+        self._cond = threading.Condition()
+
+    def remaining(self):
+        '''Returns the number of nodes not handed out yet'''
+        with self._cond:
+            return sum(len(q) for q in self.queues.values())
+
+    def _pick(self):
+        cands = [d for d, q in self.queues.items() if q and
+                 (not self.limit or self.running[d] < self.limit)]
+        if not cands:
+            return None
+        domain = min(cands, key=lambda d: (self.running[d], self.served[d]))
+        self.running[domain] += 1
+        self.served[domain] = self._turn
+        self._turn += 1
+        return self.queues[domain].popleft()
+
+    def next(self):
+        '''Returns the next node to run, waiting for a node of a capped
+        domain to finish if needed, or None once every node has been
+        handed out
+        '''
+        with self._cond:
+            while True:
+                node = self._pick()
+                if node is not None:
+                    return node
+                if not any(self.queues.values()):
+                    return None
+                self._cond.wait()
+
+    def runnable(self):
+        '''Returns all nodes that can be run now, without waiting'''
+        nodes = []
+        with self._cond:
+            node = self._pick()
+            while node is not None:
+                nodes.append(node)
+                node = self._pick()
+        return nodes
+
+    def done(self, node):
+        '''Mark a node handed out by next() or runnable() as finished'''
+        with self._cond:
+            self.running[self.domains[node]] -= 1
+            self._cond.notify_all()
+
+    def run(self, func, workers, pool, controller=None):
+        '''Run func on every node, with the given number of workers in the
+        ThreadPoolExecutor pool.
+
+        If an AIMDController is given, it limits how many of the workers run
+        at once, and func should return True when the node failed in a way
+        that suggests overload.
+        '''
+        def worker():
+            while True:
+                token = controller.acquire() if controller else None
+                node = self.next()
+                if node is None:
+                    if controller:
+                        controller.cancel(token)
+                    return
+                congested = False
+                try:
+                    congested = func(node)
+                finally:
+                    self.done(node)
+                    if controller:
+                        controller.release(token, error=bool(congested))
+        return [pool.submit(worker) for _ in range(workers)]
+
+
+class AIMDController(object):
+    '''Adaptive concurrency limit, with additive increase and multiplicative
+    decrease.
+
+    The limit starts at start and grows by one for every limit tasks that
+    succeed, up to maximum. It is multiplied by decrease when a task fails
+    with an error that suggests overload, or when pressure_func reports that
+    the collector is short on resources. Only tasks that started after the
+    last decrease can cause another, so one burst of failures only cuts the
+    limit once.
+
+    With latency_factor set, successful tasks whose latency is more than
+    latency_factor times the lowest seen do not raise the limit.
+    '''
+
+    def __init__(self, maximum, start=2, minimum=1, decrease=0.5,
+                 latency_factor=None, pressure_func=collector_pressure):
+        self.maximum = max(maximum, 1)
+        self.minimum = max(min(minimum, self.maximum), 1)
+        self.start = max(min(start, self.maximum), self.minimum)
+        self.limit = float(self.start)
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.pressure_func = pressure_func
+        self.baseline = None
+        self.in_flight = 0
+        self.peak = self.start
+        self.decreases = 0
+        self.created = time.time()
+        self.history = [(0.0, self.start)]
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+
+    def current(self):
+        return int(self.limit)
+
+    def acquire(self):
+        '''Block until a task may start, returning a token to release()'''
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        return time.time()
+
+    def cancel(self, token):
+        '''Give back a slot from acquire() without judging the outcome'''
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def release(self, token, error=False, latency=None):
+        '''Report the outcome of the task started with token'''
+        if latency is None:
+            latency = time.time() - token
+        pressure = self.pressure_func() if self.pressure_func else False
+        with self._cond:
+            self.in_flight -= 1
+            old = int(self.limit)
+            if error or pressure:
+                if token >= self._last_decrease:
+                    self.limit = max(self.limit * self.decrease,
+                                     self.minimum)
+                    self._last_decrease = time.time()
+                    self.decreases += 1
+            else:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                healthy = (self.latency_factor is None or
+                           latency <= self.baseline * self.latency_factor)
+                if healthy:
+                    self.limit = min(self.limit + 1.0 / int(self.limit),
+                                     self.maximum)
+            if int(self.limit) != old:
+                self.history.append((round(time.time() - self.created, 3),
+                                     int(self.limit)))
+                self.peak = max(self.peak, int(self.limit))
+            self._cond.notify_all()
+
+    def report(self):
+        '''Returns the chosen limits, for the timing report'''
+        return {
+            'start': self.start,
+            'maximum': self.maximum,
+            'peak': self.peak,
+            'final': int(self.limit),
+            'decreases': self.decreases,
+            'history': self.history
+        }
@@ -27,39 +27,115 @@ import tempfile
 import shutil
 import subprocess
 import sys
+import time
 
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
-from .sosnode import SosNode
+from .sosnode import SosNode, SosInfoMemo
 from distutils.sysconfig import get_python_lib
 from getpass import getpass
 from pipes import quote
-from six.moves import input
+from six.moves import input, queue
 from textwrap import fill
 from soscollector import __version__
-from soscollector.exceptions import ControlPersistUnsupportedException
+from soscollector.api import emit_event
+from soscollector.cache import ArchiveCache
+from soscollector.fdbudget import FdBudget, raise_nofile_limit
+from soscollector.exceptions import (ControlPersistUnsupportedException,
+                                     InventoryQueryException)
+from soscollector.guardrails import Guardrail
+from soscollector.journal import (RunJournal, JOURNAL_NAME,
+                                  extract_run_archive, preserve_logs)
+from soscollector.inventory import (HostInventory, INVENTORY_NAME, is_query,
+                                    parse_seconds)
+from soscollector.netscan import scan_nodes
+from soscollector.ratelimit import ConnectionLimiter
+from soscollector.scheduler import (AIMDController, DomainScheduler,
+                                    CONGESTION_ERRORS)
+from soscollector.sshpool import (default_control_dir, prepare_control_dir,
+                                  sweep_control_dir, control_path_fits)
+from soscollector.relay import (parse_relays, shard_nodes, build_relay_cmd,
+                                find_relay_archive, merge_relay_archive,
+                                TIMING_REPORT)
 
 COLLECTOR_LIB_DIR = '/var/lib/sos-collector'
 
 
+def reset_logging(config=None):
+    '''Remove the handlers SosCollector added to the sos-collector loggers,
+    closing the log files they write to. Used when collections are run
+    repeatedly in the same process, so that handlers do not accumulate.
+
+    If config is given, only the handlers of the collection run with that
+    configuration are removed, leaving those of any other collection or
+    caller in place.
+    '''
+    for name in ('sos_collector', 'sos_collector_console'):
+        logger = logging.getLogger(name)
+        for handler in list(logger.handlers):
+            if config is not None and \
+                    getattr(handler, 'sos_config', None) is not config:
+                continue
+            logger.removeHandler(handler)
+            handler.close()
+            stream = getattr(handler, 'stream', None)
+            # only the log files have a name, console streams are left open
+            if stream not in (sys.stdout, sys.stderr) and \
+                    hasattr(stream, 'name'):
+                stream.close()
+
+
 class SosCollector():
     '''Main sos-collector class'''
 
+    # set once the local ssh has been found to support ControlPersist, so
+    # that jobs run by a long lived daemon only check once
+    control_persist_supported = False
+
     def __init__(self, config):
         os.umask(0o77)
         self.config = config
         self.client_list = []
         self.node_list = []
         self.master = False
+        self.jump = None
         self.retrieved = 0
+        self.report_num = 0
         self.need_local_sudo = False
+        self.relay_shards = {}
+        self.relay_timings = {}
+        self.controllers = {}
+        self.prescan_time = None
+        self.journal = None
+        self.resumed = set()
+        self._lock = threading.Lock()
         self.clusters = self.config['cluster_types']
         if not self.config['list_options']:
             try:
-                if not self.config['tmp_dir']:
+                if self.config['resume']:
+                    self._prepare_resume()
+                elif not self.config['tmp_dir']:
                     self.create_tmp_dir()
                 self._setup_logging()
+                self._setup_journal()
                 self._check_for_control_persist()
+                self.config['conn_limiter'] = ConnectionLimiter(
+                    self.config['ssh_rate']
+                )
+                if self.config['max_load'] is not None or \
+                        self.config['max_pressure'] is not None:
+                    self.config['guardrail'] = Guardrail(
+                        self.config['max_load'], self.config['max_pressure'],
+                        self.config['hold_timeout']
+                    )
+                if self.config['persist_connections']:
+                    self._setup_control_dir()
+                self._check_control_path()
+                self._setup_fd_budget()
+                if not self.config['no_sos_memo']:
+                    self.config['sos_memo'] = SosInfoMemo()
+                if self.config['cache']:
+                    self._setup_cache()
                 self.log_debug('Executing %s' % ' '.join(s for s in sys.argv))
                 self.log_debug("Found cluster profiles: %s"
                                % self.clusters.keys())
@@ -101,8 +177,8 @@ class SosCollector():
         chandler.setFormatter(cfmt)
         self.console.addHandler(chandler)
 
-        # also print to console
-        ui = logging.StreamHandler()
+        # also print to console, or to the client of a daemon job
+        ui = logging.StreamHandler(self.config['ui_stream'])
         fmt = logging.Formatter('%(message)s')
         ui.setFormatter(fmt)
         if self.config['verbose']:
@@ -111,6 +187,10 @@ class SosCollector():
             ui.setLevel(logging.INFO)
         self.console.addHandler(ui)
 
+        # mark the handlers as this collection's, for reset_logging()
+        for handler in (hndlr, chandler, ui):
+            handler.sos_config = self.config
+
     def _check_for_control_persist(self):
         '''Checks to see if the local system supported SSH ControlPersist.
 
@@ -129,6 +209,8 @@ class SosCollector():
         Returns
             True if ControlPersist is supported, else raise Exception.
         '''
+        if SosCollector.control_persist_supported:
+            return True
         ssh_cmd = ['ssh', '-o', 'ControlPersist']
         cmd = subprocess.Popen(ssh_cmd, stdout=subprocess.PIPE,
                                stderr=subprocess.PIPE)
@@ -136,11 +218,125 @@ class SosCollector():
         err = err.decode('utf-8')
         if 'Bad configuration option' in err or 'Usage:' in err:
             raise ControlPersistUnsupportedException
+        SosCollector.control_persist_supported = True
         return True
 
+    def _prepare_resume(self):
+        '''When resuming a run with --resume, use the run directory of that
+        run as tmp_dir, or if given the archive the run created, extract it
+        into a new tmp_dir and replace the archive once done
+        '''
+        path = os.path.abspath(self.config['resume'])
+        if os.path.isdir(path):
+            journal = RunJournal(os.path.join(path, JOURNAL_NAME))
+            start = journal.last_start() or {}
+            self.config['tmp_dir'] = path
+            self.config['tmp_dir_created'] = start.get('tmp_dir_created',
+                                                       False)
+        elif tarfile.is_tarfile(path):
+            self.create_tmp_dir()
+            extract_run_archive(path, self.config['tmp_dir'])
+            self.config['resume_archive'] = path
+            journal = RunJournal(os.path.join(self.config['tmp_dir'],
+                                              JOURNAL_NAME))
+            start = journal.last_start() or {}
+        else:
+            raise Exception('%s is not a run directory or archive' % path)
+        if not start:
+            raise Exception('No run journal found in %s' % path)
+        preserve_logs(self.config['tmp_dir'], start.get('logs', {}))
+
+    def _setup_journal(self):
+        '''Start recording the run in the journal in tmp_dir, which is fed
+        by the same events as the streaming API
+        '''
+        self.journal = RunJournal(os.path.join(self.config['tmp_dir'],
+                                               JOURNAL_NAME))
+        if self.config['resume']:
+            self.resumed = self.journal.completed_nodes()
+            self.log_info('Resuming run in %s, %s nodes already have a '
+                          'verified sosreport'
+                          % (self.config['tmp_dir'], len(self.resumed)))
+            self.log_debug('Skipping collection from %s'
+                           % ', '.join(sorted(self.resumed)))
+        hook = self.config['event_hook']
+
+        def _record(event):
+            try:
+                self.journal.record_event(event)
+            except (IOError, OSError):
+                # tmp_dir is removed once the archive is created, which is
+                # before the 'complete' event
+                pass
+            if hook:
+                hook(event)
+
+        self.config['event_hook'] = _record
+        self.journal.record(
+            'start',
+            version=__version__,
+            tmp_dir_created=self.config['tmp_dir_created'],
+            logs={'sos-collector.log': os.path.basename(self.logfile.name),
+                  'ui.log': os.path.basename(self.console_log_file.name)}
+        )
+
+    def _setup_cache(self):
+        '''Open the cache of sosreports retrieved by recent collections'''
+        cdir = self.config['cache_dir'] or os.path.join(COLLECTOR_LIB_DIR,
+                                                        'cache')
+        try:
+            age = parse_seconds(str(self.config['cache_age']))
+        except InventoryQueryException:
+            self._exit('Invalid --cache-age value: %s'
+                       % self.config['cache_age'])
+        try:
+            self.config['archive_cache'] = ArchiveCache(
+                cdir, self.config['cache_size'] * 1024 * 1024, age
+            )
+            self.log_debug('Using sosreport cache in %s' % cdir)
+        except Exception as err:
+            self.log_error('Could not open sosreport cache %s, sosreports '
+                           'will not be cached: %s' % (cdir, err))
+
+    def _setup_control_dir(self):
+        '''Prepare the directory of control sockets that is shared between
+        runs when persistent connections are used, and remove any sockets in
+        it that are no longer usable
+        '''
+        cdir = self.config['control_dir'] or default_control_dir()
+        self.config['control_dir'] = prepare_control_dir(cdir)
+        alive = sweep_control_dir(cdir)
+        self.log_debug('Using persistent control sockets in %s, %s are alive'
+                       % (cdir, alive))
+
+    def _check_control_path(self):
+        '''Make sure control sockets can be created in the socket directory
+        without overflowing the socket path limit, which ssh otherwise
+        reports with an unclear error for every node'''
+        sdir = self.config['control_dir'] or self.config['tmp_dir']
+        if not control_path_fits(sdir):
+            self._exit('The path of %s is too long for SSH control sockets. '
+                       'Use a shorter --tmp-dir or --control-dir' % sdir)
+
+    def _setup_fd_budget(self):
+        '''Raise the open file limit as far as allowed, and limit the number
+        of commands run at once to what it allows'''
+        limit = raise_nofile_limit()
+        if not limit:
+            return
+        budget = FdBudget(limit)
+        self.config['fd_budget'] = budget
+        self.log_debug('Open file limit is %s, allowing %s commands to run '
+                       'at once' % (limit, budget.slots))
+        if budget.slots < self.config['threads']:
+            self.log_warn('The open file limit of %s only allows %s commands '
+                          'to run at once, fewer than --threads'
+                          % (limit, budget.slots))
+
     def _exit(self, msg, error=1):
         '''Used to safely terminate if sos-collector encounters an error'''
         self.log_error(msg)
+        emit_event(self.config, 'aborted', message=msg, status=error)
         try:
             self.close_all_connections()
         except Exception:
@@ -150,6 +346,26 @@ class SosCollector():
     def _parse_options(self):
         '''If there are cluster options set on the CLI, override the defaults
         '''
+        if self.config['harvest']:
+            try:
+                parse_seconds(str(self.config['harvest_age']))
+            except InventoryQueryException:
+                self._exit('Invalid --harvest-age value: %s'
+                           % self.config['harvest_age'])
+        if self.config['domain_limit'] < 0:
+            self._exit('--domain-limit cannot be negative')
+        if self.config['ssh_rate'] <= 0:
+            self._exit('--ssh-rate must be greater than 0')
+        for stage in ('connect', 'exec', 'transfer', 'cleanup'):
+            threads = self.config['%s_threads' % stage]
+            if threads is not None and threads < 1:
+                self._exit('--%s-threads must be at least 1' % stage)
+        if self.config['shard_slower_than']:
+            try:
+                parse_seconds(str(self.config['shard_slower_than']))
+            except InventoryQueryException:
+                self._exit('Invalid --shard-slower-than value: %s'
+                           % self.config['shard_slower_than'])
         if self.config['cluster_options']:
             for opt in self.config['cluster_options']:
                 match = False
@@ -305,7 +521,14 @@ class SosCollector():
 
         Host groups define a list of nodes and/or regexes and optionally the
         master and cluster-type options.
+
+        If the group is not an existing file but is a query expression, such
+        as 'role=worker and last_success>7d', the nodes are instead selected
+        from the host inventory.
         '''
+        if (is_query(self.config['group']) and not
+                os.path.exists(self.config['group'])):
+            return self._load_inventory_group()
         if os.path.exists(self.config['group']):
             fname = self.config['group']
         elif os.path.exists(
@@ -328,6 +551,91 @@ class SosCollector():
                 self.log_debug("Adding %s to node list" % _group['nodes'])
                 self.config['nodes'].extend(_group['nodes'])
 
+    def _get_inventory_path(self):
+        '''Returns the path to the host inventory database'''
+        return os.path.join(COLLECTOR_LIB_DIR, INVENTORY_NAME)
+
+    def _load_inventory_group(self):
+        '''
+        Selects the nodes matching the --group query expression from the
+        host inventory. If all matched nodes share the same master and/or
+        cluster type, those options are set as they would be from a host
+        group file.
+        '''
+        path = self._get_inventory_path()
+        if not os.path.exists(path):
+            raise OSError("%s no such file" % path)
+        self.log_debug("Querying host inventory %s for '%s'"
+                       % (path, self.config['group']))
+        inv = HostInventory(path)
+        try:
+            _nodes = inv.query_nodes(self.config['group'])
+        finally:
+            inv.close()
+        if not _nodes:
+            raise Exception('No nodes in inventory match query')
+        for key in ['master', 'cluster_type']:
+            vals = set(n[key] for n in _nodes)
+            if len(vals) == 1 and not self.config[key]:
+                val = vals.pop()
+                if val:
+                    self.log_debug("Setting option '%s' to '%s' per host "
+                                   "inventory" % (key, val))
+                    self.config[key] = val
+        names = [n['name'] for n in _nodes]
+        self.log_debug("Adding %s to node list" % names)
+        self.config['nodes'].extend(names)
+
+    def update_inventory(self):
+        '''
+        Records the nodes collected from in this run, along with their facts
+        and the result and duration of collection, in the host inventory
+        '''
+        if not os.path.isdir(COLLECTOR_LIB_DIR):
+            raise OSError("%s no such directory" % COLLECTOR_LIB_DIR)
+        inv = HostInventory(self._get_inventory_path())
+        try:
+            for client in self.client_list:
+                if client.local and self.config['no_local']:
+                    continue
+                name = client.address
+                if client.local:
+                    name = self.config['hostname']
+                facts = {}
+                if getattr(client, 'host', None):
+                    facts = client.host.report_facts()
+                facts['hostname'] = client.hostname
+                facts['sos_version'] = client.sos_info['version']
+                if client.shard_paths:
+                    facts['shards'] = len(client.shard_paths)
+                if client.resources:
+                    facts.update(client.resources)
+                attrs = {}
+                if self.config['cluster']:
+                    attrs = self.config['cluster'].get_node_attrs(name)
+                roles = list(attrs.get('roles') or [])
+                if client.cluster_label:
+                    roles.append(client.cluster_label)
+                labels = dict(attrs.get('labels') or {})
+                if self.config['label']:
+                    labels['label'] = self.config['label']
+                inv.update_node(
+                    name,
+                    cluster=(attrs.get('cluster') or self.config['master'] or
+                             self.config['hostname']),
+                    cluster_type=self.config['cluster_type'],
+                    master=self.config['master'],
+                    roles=roles,
+                    labels=labels,
+                    facts=facts,
+                    success=client.retrieved,
+                    duration=client.timings.get('total')
+                )
+        finally:
+            inv.close()
+        self.log_debug('Updated host inventory for %s nodes'
+                       % len(self.client_list))
+
     def write_host_group(self):
         '''
         Saves the results of this run of sos-collector to a host group file
@@ -382,7 +690,9 @@ this utility or remote systems that it connects to.
                    'nodes unless the --password option is provided.\n')
             self.console.info(self._fmt_msg(msg))
 
-        if self.config['password'] or self.config['password_per_node']:
+        # when embedded in the daemon, passwords are given by the client
+        if (self.config['password'] or self.config['password_per_node']) \
+                and not self.config['embedded']:
             self.log_debug('password specified, not using SSH keys')
             msg = ('Provide the SSH password for user %s: '
                    % self.config['ssh_user'])
@@ -390,12 +700,13 @@ this utility or remote systems that it connects to.
 
         if self.config['need_sudo'] and not self.config['insecure_sudo']:
             if not self.config['password']:
-                self.log_debug('non-root user specified, will request '
-                               'sudo password')
-                msg = ('A non-root user has been provided. Provide sudo '
-                       'password for %s on remote nodes: '
-                       % self.config['ssh_user'])
-                self.config['sudo_pw'] = getpass(prompt=msg)
+                if not self.config['embedded']:
+                    self.log_debug('non-root user specified, will request '
+                                   'sudo password')
+                    msg = ('A non-root user has been provided. Provide sudo '
+                           'password for %s on remote nodes: '
+                           % self.config['ssh_user'])
+                    self.config['sudo_pw'] = getpass(prompt=msg)
             else:
                 if not self.config['insecure_sudo']:
                     self.config['sudo_pw'] = self.config['password']
@@ -403,9 +714,10 @@ this utility or remote systems that it connects to.
         if self.config['become_root']:
             if not self.config['ssh_user'] == 'root':
                 self.log_debug('non-root user asking to become root remotely')
-                msg = ('User %s will attempt to become root. '
-                       'Provide root password: ' % self.config['ssh_user'])
-                self.config['root_password'] = getpass(prompt=msg)
+                if not self.config['embedded']:
+                    msg = ('User %s will attempt to become root. Provide '
+                           'root password: ' % self.config['ssh_user'])
+                    self.config['root_password'] = getpass(prompt=msg)
                 self.config['need_sudo'] = False
             else:
                 self.log_info('Option to become root but ssh user is root.'
@@ -419,6 +731,9 @@ this utility or remote systems that it connects to.
                 self.log_error("Could not load specified group %s: %s"
                                % (self.config['group'], err))
 
+        if self.config['jump_host']:
+            self.connect_to_jump_host()
+
         if self.config['master']:
             self.connect_to_master()
             self.config['no_local'] = True
@@ -517,6 +832,27 @@ this utility or remote systems that it connects to.
                 quote(self.config['compression']))
         self.log_debug('Initial sos cmd set to %s' % self.config['sos_cmd'])
 
+    def connect_to_jump_host(self):
+        '''If run with --jump-host, open the master connection to the jump
+        host that the sessions to all other nodes are tunnelled through
+        '''
+        try:
+            self.jump = SosNode(self.config['jump_host'], self.config,
+                                load_facts=False)
+            if not self.jump.connected:
+                raise Exception('connection failed')
+        except Exception as e:
+            self.log_debug('Failed to connect to jump host: %s' % e)
+            self._exit('Could not connect to jump host. Aborting...', 1)
+        self.config['jump_control_path'] = self.jump.control_path
+        self.config['conn_limiter'].set_concurrency(
+            self.config['jump_host'], self.config['jump_concurrency']
+        )
+        self.log_debug('Connections to nodes will be made through jump host '
+                       '%s, at most %s at a time'
+                       % (self.config['jump_host'],
+                          self.config['jump_concurrency']))
+
     def connect_to_master(self):
         '''If run with --master, we will run cluster checks again that
         instead of the localhost.
@@ -649,6 +985,47 @@ this utility or remote systems that it connects to.
         except (TypeError, ValueError):
             self.config['hostlen'] = len(self.config['master'])
 
+    def _node_offline(self, node):
+        '''Returns True if the cluster profile reported the node as being
+        offline during enumeration'''
+        if not self.config['cluster']:
+            return False
+        attrs = self.config['cluster'].get_node_attrs(node)
+        return attrs.get('online') is False
+
+    def _offline_last(self, nodes):
+        '''Returns nodes with those the cluster reports as offline moved to
+        the end, so they do not hold connection slots while reachable nodes
+        wait'''
+        offline = [n for n in nodes if self._node_offline(n)]
+        if offline:
+            self.log_info('Cluster reports %s nodes as offline, these will '
+                          'be attempted last: %s'
+                          % (len(offline), ', '.join(sorted(offline))))
+        return [n for n in nodes if n not in offline] + offline
+
+    def _prescan_nodes(self, nodes):
+        '''Check that all nodes accept TCP connections on the SSH port
+        before any ssh sessions are attempted, and remove those that do not
+        from the given list of nodes
+        '''
+        start = time.time()
+        self.log_debug('Checking %s nodes are reachable on port %s'
+                       % (len(nodes), self.config['ssh_port']))
+        failed = scan_nodes(nodes, self.config['ssh_port'],
+                            self.config['prescan_timeout'])
+        self.prescan_time = time.time() - start
+        for node in sorted(failed):
+            self.log_debug('%s is unreachable: %s' % (node, failed[node]))
+            emit_event(self.config, 'connect_failed', node,
+                       error=failed[node])
+        if failed:
+            self.log_warn('%s nodes could not be reached on port %s and will '
+                          'be skipped: %s'
+                          % (len(failed), self.config['ssh_port'],
+                             ', '.join(sorted(failed))))
+        return [n for n in nodes if n not in failed]
+
     def _connect_to_node(self, node):
         '''Try to connect to the node, and if we can add to the client list to
         run sosreport on
@@ -657,26 +1034,191 @@ this utility or remote systems that it connects to.
             node - a tuple specifying (address, password). If no password, set
                    to None
         '''
+        timeout = 15
+        offline = self._node_offline(node[0])
+        if offline:
+            timeout = self.config['offline_timeout']
+            self.log_debug('%s reported offline by cluster, probing with a %s '
+                           'second timeout' % (node[0], timeout))
+        controller = self.controllers.get('connect')
+        token = controller.acquire() if controller else None
+        congested = False
+        latency = None
         try:
-            client = SosNode(node[0], self.config, password=node[1])
+            client = SosNode(node[0], self.config, password=node[1],
+                             connect_timeout=timeout)
+            latency = client.timings.get('connect')
             if client.connected:
                 self.client_list.append(client)
+                self._emit_connected(client)
             else:
                 client.close_ssh_session()
-        except Exception:
-            pass
+                emit_event(self.config, 'connect_failed', node[0],
+                           error='node could not be used for collection')
+        except Exception as err:
+            # nodes the cluster already reports as down are expected to fail
+            congested = isinstance(err, CONGESTION_ERRORS) and not offline
+            emit_event(self.config, 'connect_failed', node[0],
+                       error=str(err))
+        finally:
+            if controller:
+                controller.release(token, error=congested, latency=latency)
+
+    def _emit_connected(self, client):
+        emit_event(self.config, 'connected', client.address,
+                   hostname=client.hostname,
+                   facts=client.host.report_facts() if client.host else {},
+                   sos_version=client.sos_info['version'])
+
+    def _relays_supported(self):
+        '''Sub-collectors run non-interactively on the relays, so they cannot
+        be used when passwords would need to be provided to them
+        '''
+        if self.config['password'] or self.config['password_per_node']:
+            return False
+        if self.config['become_root']:
+            return False
+        if self.config['need_sudo'] and not self.config['insecure_sudo']:
+            return False
+        return True
+
+    def _assign_relays(self, nodes):
+        '''Split the given node names between the relays given with --relay.
+
+        Returns the list of nodes that are not handled by any relay and
+        should be collected from directly.
+        '''
+        if not self._relays_supported():
+            self.log_warn('Relays require SSH keys and passwordless sudo, if '
+                          'sudo is used. Collecting from all nodes directly.')
+            return nodes
+        relays = parse_relays(self.config['relays'])
+        shards, direct = shard_nodes(nodes, relays)
+        self.relay_shards = dict((r, s) for r, s in shards.items() if s)
+        for relay in self.relay_shards:
+            self.log_debug('Relay %s assigned nodes %s'
+                           % (relay, self.relay_shards[relay]))
+        if direct:
+            self.log_debug('Nodes not assigned to a relay: %s' % direct)
+        return direct
+
+    def _collect_relay(self, relay, shard):
+        '''Run sos-collector on a relay node to collect sosreports from the
+        nodes in shard, then retrieve the relay's archive and merge its
+        contents and timing report into this collection
+        '''
+        start = time.time()
+        retrieved = []
+        node = None
+        try:
+            node = SosNode(relay, self.config, load_facts=False)
+            names = [relay, node.address]
+            if node.local:
+                names.append(self.config['hostname'])
+            collect_local = any(n in shard for n in names)
+            _shard = [n for n in shard if n not in names]
+            cmd = build_relay_cmd(self.config, _shard, collect_local)
+            self.log_info('Starting sub-collector on relay %s for %s nodes'
+                          % (relay, len(shard)))
+            # the relay may need several rounds of collection for its shard
+            rounds = len(shard) // max(self.config['threads'], 1) + 2
+            res = node.run_command(cmd,
+                                   timeout=self.config['timeout'] * rounds)
+            path = find_relay_archive(res['stdout'])
+            if res['status'] != 0 or not path:
+                raise Exception('sub-collector failed with code %s'
+                                % res['status'])
+            if not node.retrieve_file(path):
+                raise Exception('could not retrieve archive %s' % path)
+            local = os.path.join(self.config['tmp_dir'], path.split('/')[-1])
+            retrieved, timings = merge_relay_archive(
+                local, self.config['tmp_dir'], relay
+            )
+            os.remove(local)
+            node.remove_file(path)
+            for fname in retrieved:
+                emit_event(self.config, 'report', relay,
+                           path=os.path.join(self.config['tmp_dir'], fname),
+                           relay=relay)
+            with self._lock:
+                self.retrieved += len(retrieved)
+                for name, _timings in timings.get('nodes', {}).items():
+                    _timings['relay'] = relay
+                    self.relay_timings.setdefault('nodes', {})[name] = \
+                        _timings
+            self.log_info('Relay %s returned %s of %s sosreports'
+                          % (relay, len(retrieved), len(shard)))
+        except Exception as err:
+            self.log_error('Failed to collect from relay %s: %s'
+                           % (relay, err))
+        finally:
+            if node:
+                node.close_ssh_session()
+            with self._lock:
+                self.relay_timings.setdefault('relays', {})[relay] = {
+                    'nodes': len(shard),
+                    'retrieved': len(retrieved),
+                    'total': time.time() - start
+                }
+
+    def write_timing_report(self):
+        '''Write a JSON report of the time spent on each node, and on each
+        relay if used, to be included in the final archive
+        '''
+        report = {
+            'version': __version__,
+            'threads': self.config['threads'],
+            'total': time.time() - self.start_time,
+            'prescan': self.prescan_time,
+            'nodes': {},
+            'relays': self.relay_timings.get('relays', {})
+        }
+        for client in self.client_list:
+            if client.local and self.config['no_local']:
+                continue
+            report['nodes'][client._hostname] = client.timings
+        report['nodes'].update(self.relay_timings.get('nodes', {}))
+        if self.controllers:
+            report['concurrency'] = dict(
+                (stage, ctl.report())
+                for stage, ctl in self.controllers.items()
+            )
+        fname = os.path.join(self.config['tmp_dir'], TIMING_REPORT)
+        with open(fname, 'w') as tfile:
+            json.dump(report, tfile, indent=4, sort_keys=True)
 
     def collect(self):
         ''' For each node, start a collection thread and then tar all
         collected sosreports '''
+        self.start_time = time.time()
+        resumed = 0
         if self.master.connected:
-            self.client_list.append(self.master)
+            if self.master.address in self.resumed:
+                resumed += 1
+            else:
+                self.client_list.append(self.master)
+                if not (self.master.local and self.config['no_local']):
+                    self._emit_connected(self.master)
 
         self.console.info("\nConnecting to nodes...")
         filters = [self.master.address, self.master.hostname]
-        nodes = [(n, None) for n in self.node_list if n not in filters]
+        nodes = [n for n in self.node_list if n not in filters]
+        if self.resumed:
+            resumed += len([n for n in nodes if n in self.resumed])
+            nodes = [n for n in nodes if n not in self.resumed]
+            self.retrieved = resumed
+        if self.config['relays']:
+            nodes = self._assign_relays(nodes)
+        nodes = self._offline_last(nodes)
+        # nodes behind a jump host cannot be reached directly from here
+        if nodes and self.config['prescan'] and not self.config['jump_host']:
+            nodes = self._prescan_nodes(nodes)
+        nodes = [(n, None) for n in nodes]
 
         if self.config['password_per_node']:
+            if self.config['embedded']:
+                self._exit('Per-node passwords cannot be prompted for when '
+                           'run non-interactively', 1)
             _nodes = []
             for node in nodes:
                 msg = ("Please enter the password for %s@%s: "
@@ -686,44 +1228,372 @@ this utility or remote systems that it connects to.
             nodes = _nodes
 
         try:
-            pool = ThreadPoolExecutor(self.config['threads'])
+            if self.relay_shards:
+                relay_pool = ThreadPoolExecutor(len(self.relay_shards))
+                for relay, shard in self.relay_shards.items():
+                    relay_pool.submit(self._collect_relay, relay, shard)
+
+            if self.config['adaptive']:
+                self._create_controllers()
+            pool = ThreadPoolExecutor(self._stage_threads('connect'))
             pool.map(self._connect_to_node, nodes, chunksize=1)
             pool.shutdown(wait=True)
 
             self.report_num = len(self.client_list)
             if self.config['no_local'] and self.master.address == 'localhost':
                 self.report_num -= 1
+            self.report_num += sum(len(s) for s in self.relay_shards.values())
+            self.report_num += resumed
+            self._designate_scoped_node()
+            self._select_shard_nodes()
 
             self.console.info("\nBeginning collection of sosreports from %s "
                               "nodes, collecting a maximum of %s "
                               "concurrently\n"
-                              % (self.report_num, self.config['threads'])
+                              % (self.report_num,
+                                 self._stage_threads('exec'))
                               )
 
-            pool = ThreadPoolExecutor(self.config['threads'])
-            pool.map(self._collect, self.client_list, chunksize=1)
-            pool.shutdown(wait=True)
+            self._collect_nodes()
+            self._log_controllers()
+            if self.relay_shards:
+                relay_pool.shutdown(wait=True)
         except KeyboardInterrupt:
             self.log_error('Exiting on user cancel\n')
             os._exit(130)
         except Exception as err:
+            # a daemon job must not take the daemon down with it
+            if self.config['embedded']:
+                self._exit('Could not connect to nodes: %s' % err, 1)
             self.log_error('Could not connect to nodes: %s' % err)
             os._exit(1)
 
-        if hasattr(self.config['cluster'], 'run_extra_cmd'):
-            self.console.info('Collecting additional data from master node...')
-            files = self.config['cluster']._run_extra_cmd()
-            if files:
-                self.master.collect_extra_cmd(files)
         msg = '\nSuccessfully captured %s of %s sosreports'
         self.log_info(msg % (self.retrieved, self.report_num))
+        if self.config['inventory']:
+            try:
+                self.update_inventory()
+            except Exception as err:
+                self.log_error("Could not update host inventory: %s" % err)
+        if self.config['archive_cache']:
+            self.config['archive_cache'].close()
         self.close_all_connections()
         if self.retrieved > 0:
+            try:
+                self.write_timing_report()
+            except Exception as err:
+                self.log_error("Could not write timing report: %s" % err)
             self.create_cluster_archive()
+            emit_event(self.config, 'complete', archive=self.archive,
+                       retrieved=self.retrieved, total=self.report_num)
         else:
             msg = 'No sosreports were collected, nothing to archive...'
             self._exit(msg, 1)
 
+    def _collect_nodes(self):
+        '''Collect a sosreport from every connected node. Cluster profile
+        extra commands, such as the ovirt database dump, run alongside the
+        nodes in their own worker so that they neither wait for, nor take a
+        slot from, the node sosreports.
+        '''
+        extra_pool = None
+        if hasattr(self.config['cluster'], 'run_extra_cmd'):
+            extra_pool = ThreadPoolExecutor(1)
+            extra_pool.submit(self._collect_extra_cmd)
+        if self.config['detach']:
+            pool = ThreadPoolExecutor(self.config['threads'])
+            self._collect_detached(pool)
+            pool.shutdown(wait=True)
+        else:
+            self._collect_staged(self.client_list)
+        if extra_pool:
+            extra_pool.shutdown(wait=True)
+
+    def _collect_extra_cmd(self):
+        '''Runs any extra commands defined by the cluster profile on the
+        master node, and retrieves the files they generate
+        '''
+        start = time.time()
+        try:
+            self.console.info('Collecting additional data from master node...')
+            files = self.config['cluster']._run_extra_cmd()
+            if files:
+                self.master.collect_extra_cmd(files)
+        except Exception as err:
+            self.log_error('Error collecting additional data from master: %s'
+                           % err)
+        finally:
+            self.master.timings['extra_cmd'] = time.time() - start
+
+    def _designate_scoped_node(self):
+        '''Pick the single node that collects the cluster-scoped plugins and
+        plugin options of the cluster profile, if it declares any'''
+        cluster = self.config['cluster']
+        if self.config['no_cluster_scoping'] or not cluster or not \
+                (cluster.get_scoped_plugins() or cluster.get_scoped_options()):
+            return
+        clients = [c for c in self.client_list
+                   if not (c.local and self.config['no_local'])]
+        node = cluster.designate_scoped_node(clients)
+        if node:
+            self.config['scoped_node'] = node.address
+            self.log_info('Cluster-scoped data will only be collected from '
+                          '%s' % node.address)
+
+    def _select_shard_nodes(self):
+        '''Mark the nodes whose sosreport is split into concurrent plugin
+        shards. These are the nodes matching a --shard pattern, and with
+        --shard-slower-than, the nodes whose last collection took at least
+        that long or was itself sharded.
+        '''
+        patterns = self.config['shard_nodes']
+        threshold = self.config['shard_slower_than']
+        if not (patterns or threshold) or self.config['detach']:
+            return
+        history = {}
+        path = self._get_inventory_path()
+        if threshold and os.path.exists(path):
+            inv = None
+            try:
+                inv = HostInventory(path)
+                for client in self.client_list:
+                    name = client.address
+                    if client.local:
+                        name = self.config['hostname']
+                    history[client.address] = inv.get_node(name)
+            except Exception as err:
+                # shard selection by duration is best-effort
+                self.log_error('Could not read host inventory: %s' % err)
+                history = {}
+            finally:
+                if inv:
+                    inv.close()
+        for client in self.client_list:
+            if any(fnmatch.fnmatch(client.address, p) for p in patterns):
+                client.shard = True
+            node = history.get(client.address)
+            if node:
+                slow = node['last_duration'] is not None and \
+                    node['last_duration'] >= parse_seconds(str(threshold))
+                client.shard = client.shard or slow or \
+                    bool(node['facts'].get('shards'))
+            if client.shard:
+                self.log_debug('Sosreport of %s will be split into plugin '
+                               'shards' % client.address)
+
+    def _create_controllers(self):
+        '''Create the AIMD controllers that adapt the concurrency of the
+        connect and exec stages with --adaptive. Each starts small and is
+        capped by the stage's thread count.
+        '''
+        # connection latency is a good signal of load on the collector and
+        # network, but sosreport run times vary too much between nodes
+        self.controllers['connect'] = AIMDController(
+            self._stage_threads('connect'), latency_factor=3.0
+        )
+        self.controllers['exec'] = AIMDController(
+            self._stage_threads('exec')
+        )
+
+    def _log_controllers(self):
+        for stage, ctl in sorted(self.controllers.items()):
+            rep = ctl.report()
+            self.log_debug('Adaptive %s concurrency: started at %s, peaked at '
+                           '%s, finished at %s after %s decreases'
+                           % (stage, rep['start'], rep['peak'], rep['final'],
+                              rep['decreases']))
+
+    def _stage_threads(self, stage):
+        '''Returns the number of workers for a collection stage, which is
+        --threads unless set for the stage'''
+        return self.config['%s_threads' % stage] or self.config['threads']
+
+    def _collect_staged(self, clients):
+        '''Collect from clients in three stages, each with its own pool of
+        workers: generating sosreports, transferring the archives, and
+        cleaning up the nodes. A node is handed to the next stage through a
+        bounded queue as soon as it is done with the previous one, so slow
+        transfers do not hold up sosreport generation on other nodes. Once a
+        queue is full, the stage before it waits, so that finished archives
+        do not pile up faster than they can be transferred.
+        '''
+        transfers = self._stage_threads('transfer')
+        cleanups = self._stage_threads('cleanup')
+        transfer_queue = queue.Queue(maxsize=transfers)
+        cleanup_queue = queue.Queue(maxsize=cleanups)
+
+        def generate(client):
+            '''Returns True if sosreport failed in a way that suggests
+            overload, for the adaptive exec controller'''
+            if client.local and self.config['no_local']:
+                return False
+            try:
+                if client.generate_sosreport():
+                    transfer_queue.put(client)
+                elif client.retrieved:
+                    with self._lock:
+                        self.retrieved += 1
+            except Exception as err:
+                self.log_error("Error running sosreport: %s" % err)
+                return isinstance(err, CONGESTION_ERRORS)
+            return isinstance(client.stage_exception, CONGESTION_ERRORS)
+
+        def stage_worker(stage_queue, func, next_queue=None):
+            while True:
+                client = stage_queue.get()
+                if client is None:
+                    return
+                try:
+                    func(client)
+                except Exception as err:
+                    client.log_error('Error collecting sosreport: %s' % err)
+                if next_queue is not None:
+                    next_queue.put(client)
+
+        def finish(client):
+            client.finish_sosreport()
+            if client.retrieved:
+                with self._lock:
+                    self.retrieved += 1
+
+        transfer_pool = ThreadPoolExecutor(transfers)
+        for _ in range(transfers):
+            transfer_pool.submit(stage_worker, transfer_queue,
+                                 lambda c: c.transfer_sosreport(),
+                                 cleanup_queue)
+        cleanup_pool = ThreadPoolExecutor(cleanups)
+        for _ in range(cleanups):
+            cleanup_pool.submit(stage_worker, cleanup_queue, finish)
+
+        exec_threads = self._stage_threads('exec')
+        exec_pool = ThreadPoolExecutor(exec_threads)
+        self._domain_scheduler(clients).run(generate, exec_threads, exec_pool,
+                                            self.controllers.get('exec'))
+        exec_pool.shutdown(wait=True)
+        for _ in range(transfers):
+            transfer_queue.put(None)
+        transfer_pool.shutdown(wait=True)
+        for _ in range(cleanups):
+            cleanup_queue.put(None)
+        cleanup_pool.shutdown(wait=True)
+
+    def _domain_scheduler(self, clients):
+        '''Returns a DomainScheduler for clients, grouped by the failure
+        domain of --domain-key and capped by --domain-limit'''
+        sched = DomainScheduler(clients, lambda c: c.get_domain(),
+                                self.config['domain_limit'])
+        if self.config['domain_limit']:
+            self.log_info('Collecting from at most %s nodes at once in each '
+                          'of %s failure domains'
+                          % (self.config['domain_limit'], len(sched.queues)))
+        return sched
+
+    def _collect_detached(self, pool):
+        '''Start sosreport in the background on every node, then poll the
+        nodes for completion and retrieve each archive as soon as it is
+        ready. No session is held open to a node while sosreport runs, so the
+        number of nodes generating reports at once is not limited by
+        --threads.
+
+        The localhost and containerized nodes are collected from normally.
+        '''
+        clients = [c for c in self.client_list
+                   if not (c.local and self.config['no_local'])]
+        attached = [c for c in clients if c.local or c.host.containerized]
+        for client in attached:
+            pool.submit(self._collect, client)
+        detached = [c for c in clients if c not in attached]
+        if not detached:
+            return
+        run_id = os.path.basename(self.config['tmp_dir'])
+        poll_pool = ThreadPoolExecutor(self.config['threads'])
+        transfer_pool = ThreadPoolExecutor(self._stage_threads('transfer'))
+        # with --domain-limit, nodes of a capped domain are only started as
+        # the sosreports of others in the domain complete
+        sched = self._domain_scheduler(detached)
+        pending = self._start_runnable(sched, poll_pool, run_id)
+        self.log_info('Started sosreport on %s nodes, checking for completion '
+                      'every %s seconds'
+                      % (len(pending), self.config['poll_interval']))
+        while pending:
+            time.sleep(self.config['poll_interval'])
+            states = list(poll_pool.map(
+                lambda c: (c, self._poll_detached(c, run_id)), pending
+            ))
+            pending = []
+            for client, rc in states:
+                if rc is not None:
+                    sched.done(client)
+                    transfer_pool.submit(self._harvest_detached, client,
+                                         run_id, rc)
+                elif time.time() - client.detach_start > \
+                        self.config['timeout']:
+                    sched.done(client)
+                    client.log_error('Timeout exceeded waiting for sosreport')
+                    transfer_pool.submit(self._abort_detached, client, run_id)
+                else:
+                    pending.append(client)
+            pending += self._start_runnable(sched, poll_pool, run_id)
+        poll_pool.shutdown(wait=True)
+        transfer_pool.shutdown(wait=True)
+
+    def _start_runnable(self, sched, poll_pool, run_id):
+        '''Start a detached sosreport on every node the scheduler allows to
+        run now, returning the nodes that were started'''
+        pending = []
+        while True:
+            clients = sched.runnable()
+            if not clients:
+                return pending
+            started = list(poll_pool.map(
+                lambda c: self._start_detached(c, run_id), clients
+            ))
+            for client, ret in zip(clients, started):
+                if ret:
+                    pending.append(client)
+                else:
+                    # harvested, cached or failed to start
+                    sched.done(client)
+
+    def _start_detached(self, client, run_id):
+        try:
+            if (self.config['harvest'] and
+                    client.harvest_existing_sosreport()) or \
+                    client.use_cached_sosreport():
+                with self._lock:
+                    self.retrieved += 1
+                return None
+            client.start_detached_sosreport(run_id)
+            return client
+        except Exception as err:
+            client.log_error('Error starting sosreport: %s' % err)
+            emit_event(self.config, 'failed', client.address, error=str(err))
+            return None
+
+    def _poll_detached(self, client, run_id):
+        try:
+            return client.check_detached_sosreport(run_id)
+        except Exception as err:
+            client.log_debug('Error checking for sosreport completion: %s'
+                             % err)
+            return None
+
+    def _harvest_detached(self, client, run_id, rc):
+        try:
+            client.harvest_detached_sosreport(run_id, rc)
+            if client.retrieved:
+                with self._lock:
+                    self.retrieved += 1
+        except Exception as err:
+            self.log_error("Error retrieving sosreport: %s" % err)
+
+    def _abort_detached(self, client, run_id):
+        try:
+            client.abort_detached_sosreport(run_id,
+                                            'timeout waiting for sosreport')
+        except Exception as err:
+            self.log_error("Error stopping sosreport: %s" % err)
+
     def _collect(self, client):
         '''Runs sosreport on each node'''
         try:
@@ -733,7 +1603,8 @@ this utility or remote systems that it connects to.
                 if not self.config['no_local']:
                     client.sosreport()
             if client.retrieved:
-                self.retrieved += 1
+                with self._lock:
+                    self.retrieved += 1
         except Exception as err:
             self.log_error("Error running sosreport: %s" % err)
 
@@ -742,6 +1613,12 @@ this utility or remote systems that it connects to.
         for client in self.client_list:
             self.log_debug('Closing SSH connection to %s' % client.address)
             client.close_ssh_session()
+        # close the jump host last, as the other sessions are tunnelled
+        # through it
+        if self.jump:
+            self.log_debug('Closing SSH connection to jump host %s'
+                           % self.jump.address)
+            self.jump.close_ssh_session()
 
     def create_cluster_archive(self):
         '''Calls for creation of tar archive then cleans up the temporary
@@ -758,8 +1635,16 @@ this utility or remote systems that it connects to.
     def create_sos_archive(self):
         '''Creates a tar archive containing all collected sosreports'''
         try:
-            self.archive = self._get_archive_path()
-            with tarfile.open(self.archive, "w:gz") as tar:
+            if self.config['resume_archive']:
+                # replace the archive of the resumed run, without losing it
+                # if we fail before the new one is complete
+                self.archive = self.config['resume_archive']
+                self.arc_name = os.path.basename(self.archive).split('.tar')[0]
+                tmp_archive = self.archive + '.part'
+            else:
+                self.archive = self._get_archive_path()
+                tmp_archive = self.archive
+            with tarfile.open(tmp_archive, "w:gz") as tar:
                 for fname in os.listdir(self.config['tmp_dir']):
                     arcname = fname
                     if fname == self.logfile.name.split('/')[-1]:
@@ -769,6 +1654,8 @@ this utility or remote systems that it connects to.
                     tar.add(os.path.join(self.config['tmp_dir'], fname),
                             arcname=self.arc_name + '/' + arcname)
                 tar.close()
+            if tmp_archive != self.archive:
+                os.rename(tmp_archive, self.archive)
         except Exception as e:
             msg = 'Could not create archive: %s' % e
             self._exit(msg, 2)
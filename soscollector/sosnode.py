@@ -18,21 +18,129 @@ import inspect
 import logging
 import os
 import pexpect
+import random
 import re
 import shlex
 import shutil
 import six
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from distutils.version import LooseVersion
 from pipes import quote
 from soscollector.exceptions import *
-
-
-class SosNode():
+from soscollector.api import emit_event
+from soscollector.cache import cache_key
+from soscollector.inventory import parse_seconds
+from soscollector.guardrails import (PRESSURE_CMD, parse_pressure,
+                                     parse_systemd_version, throttle_command)
+from soscollector.fdbudget import child_slot
+from soscollector.sshpool import check_control_socket, control_socket_name
+from soscollector.tuning import (RESOURCE_CMD, parse_resources,
+                                 tune_sos_options)
+
+# directories sosreport writes its archives to, searched by --harvest
+HARVEST_DIRS = ('/var/tmp', '/tmp')
+
+_shared_lock = threading.Lock()
+
+
+def share_sos_info(sos_info, table):
+    '''Returns a copy of sos_info with its plugin, option, preset and
+    profile lists replaced by tuples from table, which is shared by the
+    nodes of a run. Nodes with the same sos version that report the same
+    lists get the same tuples, and the names in them are stored once for
+    each version.
+    '''
+    shared = {}
+    with _shared_lock:
+        lists, names = table.setdefault(sos_info.get('version'), ({}, {}))
+        for key, value in sos_info.items():
+            if isinstance(value, (list, tuple)):
+                value = tuple(names.setdefault(v, v) for v in value)
+                value = lists.setdefault(value, value)
+            shared[key] = value
+    return shared
+
+
+class SosInfoMemo(object):
+    '''The parsed sos_info of each sos build seen in a run, keyed by the
+    distribution and sos package NVR of the nodes. The first node of a build
+    loads it while holding the build's lock, and nodes of the same build
+    wait for it and reuse it instead of running sosreport themselves.
+    '''
+
+    def __init__(self):
+        self.infos = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def lock(self, key):
+        '''Returns the lock held while the sos_info of key is loaded'''
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, key):
+        return self.infos.get(key)
+
+    def set(self, key, info):
+        self.infos[key] = info
+
+
+def split_plugins(plugins, count):
+    '''Split plugins into count groups whose sizes differ by at most one.
+    Plugins are dealt out in name order, so related plugins such as the
+    ones for a single product are spread across the groups.
+    '''
+    if count < 1:
+        return []
+    plugins = sorted(plugins)
+    return [plugins[i::count] for i in range(count) if plugins[i::count]]
+
+
+def select_sosreport(listing, case_id=None, label=None):
+    '''Pick the newest sosreport archive from a listing of
+    '<mtime> <path>' lines, optionally only those whose name contains the
+    given case id and label. Returns the path, or None.
+    '''
+    found = []
+    for line in listing.splitlines():
+        try:
+            mtime, path = line.strip().split(' ', 1)
+            mtime = float(mtime)
+        except ValueError:
+            continue
+        name = os.path.basename(path)
+        if not fnmatch.fnmatch(name, 'sosreport-*.tar*') or \
+                name.endswith(('.md5', '.sha256', '.asc')):
+            continue
+        if case_id and '-%s-' % case_id not in name:
+            continue
+        if label and label not in name:
+            continue
+        found.append((mtime, path))
+    return max(found)[1] if found else None
+
+
+class SosNode(object):
+
+    # collections of thousands of nodes keep one of these for each node
+    __slots__ = ('address', 'connect_timeout', 'local', 'hostname', 'config',
+                 '_password', 'sos_path', 'archive', 'retrieved',
+                 'hash_retrieved', 'cluster_label', 'timings', 'detach_start',
+                 'harvested', 'cached', 'shard', 'shard_paths', 'shard_errors',
+                 'stage_start', 'stage_error', 'stage_exception', 'resources',
+                 'systemd_version', 'guard_monitor', 'sos_info', 'sos_cmd',
+                 'control_path', 'jump_host', 'ssh_cmd', 'connected', 'host')
+
+    logger = logging.getLogger('sos_collector')
+    console = logging.getLogger('sos_collector_console')
 
     def __init__(self, address, config, password=None, force=False,
-                 load_facts=True):
+                 load_facts=True, connect_timeout=15):
         self.address = address.strip()
+        self.connect_timeout = connect_timeout
         self.local = False
         self.hostname = None
         self.config = config
@@ -40,6 +148,23 @@ class SosNode():
         self.sos_path = None
         self.retrieved = False
         self.hash_retrieved = False
+        self.cluster_label = None
+        self.timings = {}
+        self.detach_start = None
+        self.harvested = False
+        self.cached = False
+        self.shard = False
+        self.shard_paths = []
+        self.shard_errors = []
+        self.stage_start = None
+        self.stage_error = None
+        self.stage_exception = None
+        self.resources = None
+        self.systemd_version = None
+        self.guard_monitor = None
+        self.host = None
+        self.sos_cmd = None
+        self.archive = None
         self.sos_info = {
             'version': None,
             'enabled': [],
@@ -48,21 +173,33 @@ class SosNode():
             'presets': []
         }
         filt = ['localhost', '127.0.0.1', self.config['hostname']]
-        self.logger = logging.getLogger('sos_collector')
-        self.console = logging.getLogger('sos_collector_console')
-        self.control_path = ("%s/.sos-collector-%s"
-                             % (self.config['tmp_dir'], self.address))
+        self.control_path = os.path.join(
+            self.config['control_dir'] or self.config['tmp_dir'],
+            control_socket_name(self.config['ssh_user'], self.address,
+                                self.config['ssh_port'])
+        )
+        self.jump_host = None
+        if self.config['jump_control_path'] and \
+                self.address != self.config['jump_host']:
+            self.jump_host = self.config['jump_host']
         self.ssh_cmd = self._create_ssh_command()
         if self.address not in filt or force:
+            start = time.time()
             try:
                 self.connected = self._create_ssh_session()
             except Exception as err:
                 self.log_error('Unable to open SSH session: %s' % err)
                 raise
+            finally:
+                self.timings['connect'] = time.time() - start
         else:
             self.connected = True
             self.local = True
         if self.connected and load_facts:
+            if self._load_cached_facts():
+                if self.config['auto_tune'] and not self.resources:
+                    self.load_resources()
+                return
             self.host = self.determine_host()
             if not self.host:
                 self.connected = False
@@ -77,6 +214,59 @@ class SosNode():
             if self.host.containerized:
                 self.create_sos_container()
             self._load_sos_info()
+            if self.config['auto_tune']:
+                self.load_resources()
+            self._cache_facts()
+
+    def _load_cached_facts(self):
+        '''When run by the daemon, reuse the facts an earlier job discovered
+        for this node instead of querying it again. Returns True if cached
+        facts were used.
+        '''
+        cache = self.config['fact_cache']
+        if not cache or self.local:
+            return False
+        facts = cache.get(self._fact_key())
+        if not facts:
+            return False
+        self.host = facts['host']
+        self.hostname = facts['hostname']
+        self.sos_info = share_sos_info(facts['sos_info'],
+                                       self.config['sos_lists'])
+        self.resources = facts.get('resources')
+        self.log_debug('Using cached host facts: %s'
+                       % self.host.report_facts())
+        return True
+
+    def _cache_facts(self):
+        '''Save the discovered facts for later daemon jobs. Containerized
+        hosts are not cached as their sos container must be created by each
+        job.
+        '''
+        cache = self.config['fact_cache']
+        if not cache or self.local or not self.connected or \
+                self.host.containerized:
+            return
+        cache.set(self._fact_key(), {
+            'host': self.host,
+            'hostname': self.hostname,
+            'sos_info': self.sos_info,
+            'resources': self.resources
+        })
+
+    def _fact_key(self):
+        return '%s@%s:%s' % (self.config['ssh_user'], self.address,
+                             self.config['ssh_port'])
+
+    def load_resources(self):
+        '''Probe the CPU count, memory and load of the node'''
+        try:
+            res = self.run_command(RESOURCE_CMD)
+            self.resources = parse_resources(res['stdout'])
+        except Exception as err:
+            self.log_debug('Could not determine node resources: %s' % err)
+            return
+        self.log_debug('Node resources found to be %s' % self.resources)
 
     def _create_ssh_command(self):
         '''Build the complete ssh command for this node'''
@@ -216,19 +406,40 @@ class SosNode():
         cmd = self.host.pkg_query(self.host.sos_pkg_name)
         res = self.run_command(cmd, use_container=True)
         if res['status'] == 0:
-            ver = res['stdout'].splitlines()[-1].split('-')[1]
+            nvr = res['stdout'].splitlines()[-1].strip()
+            ver = nvr.split('-')[1]
             self.sos_info['version'] = ver
             self.log_debug('sos version is %s' % self.sos_info['version'])
         else:
             self.log_error('sos is not installed on this node')
             self.connected = False
             return False
+        memo = self.config['sos_memo']
+        if not memo:
+            self._load_sos_lists()
+            return
+        key = (self.host.distribution, nvr)
+        with memo.lock(key):
+            info = memo.get(key)
+            if info is None:
+                self._load_sos_lists()
+                # a failed sosreport -l is retried by the next node
+                if self.sos_info['enabled']:
+                    memo.set(key, self.sos_info)
+                return
+        self.log_debug('Reusing sos plugin information of %s' % nvr)
+        self.sos_info = share_sos_info(info, self.config['sos_lists'])
+        self.sos_info['shared'] = True
+
+    def _load_sos_lists(self):
+        '''Load the plugins, options and presets of the installed sos'''
         cmd = 'sosreport -l'
         sosinfo = self.run_command(cmd, use_container=True)
         if sosinfo['status'] == 0:
             self._load_sos_plugins(sosinfo['stdout'])
         if self.check_sos_version('3.6'):
             self._load_sos_presets()
+        self.sos_info = share_sos_info(self.sos_info, self.config['sos_lists'])
 
     def _load_sos_presets(self):
         cmd = 'sosreport --list-presets'
@@ -351,8 +562,8 @@ class SosNode():
                 self.log_debug("Error while trying to create new SSH control "
                                "socket: %s" % err)
                 raise
-        if cmd.startswith('sosreport'):
-            cmd = cmd.replace('sosreport', self.host.sos_bin_path)
+        if cmd.strip().startswith('sosreport'):
+            cmd = self._sos_bin_cmd(cmd.strip())
             need_root = True
         if need_root:
             get_pty = True
@@ -364,37 +575,470 @@ class SosNode():
             get_pty = True
         if not self.local and not force_local:
             cmd = "%s %s" % (self.ssh_cmd, quote(cmd))
-        res = pexpect.spawn(cmd, encoding='utf-8')
-        if need_root:
-            if self.config['need_sudo']:
-                res.sendline(self.config['sudo_pw'])
-            if self.config['become_root']:
-                res.sendline(self.config['root_password'])
-        output = res.expect([pexpect.EOF, pexpect.TIMEOUT],
-                            timeout=timeout)
-        if output == 0:
-            out = res.before
-            res.close()
-            rc = res.exitstatus
-            return {'status': rc, 'stdout': out}
-        elif output == 1:
-            raise CommandTimeoutException(cmd)
+        with child_slot(self.config['fd_budget']):
+            res = pexpect.spawn(cmd, encoding='utf-8', use_poll=True)
+            if need_root:
+                if self.config['need_sudo']:
+                    res.sendline(self.config['sudo_pw'])
+                if self.config['become_root']:
+                    res.sendline(self.config['root_password'])
+            output = res.expect([pexpect.EOF, pexpect.TIMEOUT],
+                                timeout=timeout)
+            if output == 0:
+                out = res.before
+                res.close()
+                rc = res.exitstatus
+                return {'status': rc, 'stdout': out}
+            res.close(force=True)
+        raise CommandTimeoutException(cmd)
 
     def sosreport(self):
         '''Run a sosreport on the node, then collect it'''
+        if self.generate_sosreport():
+            self.transfer_sosreport()
+            self.finish_sosreport()
+
+    def generate_sosreport(self):
+        '''First stage of a collection: run sosreport on the node. Returns
+        True if the transfer and finish stages must follow, or False if the
+        node is already finished with, as when a harvested or cached
+        sosreport was used.
+        '''
+        self.stage_start = time.time()
+        self.stage_error = 'unable to determine path of sos archive'
+        self.stage_exception = None
+        if self.config['harvest'] and self.harvest_existing_sosreport():
+            return False
+        if self.use_cached_sosreport():
+            return False
         self.finalize_sos_cmd()
+        self.guard_start()
+        if self.shard and not self.config['sos_opt_line']:
+            shards = self.get_plugin_shards()
+            if len(shards) > 1:
+                self.generate_shards(shards)
+                return True
         self.log_debug('Final sos command set to %s' % self.sos_cmd)
         try:
+            emit_event(self.config, 'progress', self.address,
+                       stage='sosreport')
             path = self.execute_sos_command()
+            self.timings['sosreport'] = time.time() - self.stage_start
             if path:
                 self.finalize_sos_path(path)
             else:
                 self.log_error('Unable to determine path of sos archive')
-            if self.sos_path:
-                self.retrieved = self.retrieve_sosreport()
-        except Exception:
-            pass
+        except Exception as err:
+            self.stage_error = str(err)
+            self.stage_exception = err
+        return True
+
+    def transfer_sosreport(self):
+        '''Second stage of a collection: retrieve the generated archive'''
+        if self.shard_paths:
+            self.transfer_shards()
+            return
+        if not self.sos_path:
+            return
+        emit_event(self.config, 'progress', self.address, stage='retrieve')
+        _start = time.time()
+        self.stage_error = 'failed to retrieve sosreport'
+        try:
+            self.retrieved = self.retrieve_sosreport()
+        except (Exception, SystemExit) as err:
+            # retrieve_sosreport() raises a bare SystemExit on failure
+            if str(err):
+                self.stage_error = str(err)
+        self.timings['retrieve'] = time.time() - _start
+
+    def finish_sosreport(self):
+        '''Last stage of a collection: clean up the node and report the
+        result'''
+        self._finish_sosreport(self.stage_start, self.stage_error)
+
+    def _finish_sosreport(self, start, error):
+        '''Clean up after a sosreport run and report the result'''
+        self.guard_stop()
         self.cleanup()
+        self.timings['total'] = time.time() - start
+        if self.retrieved and not (self.harvested or self.cached or
+                                   self.shard_paths):
+            self._cache_sosreport()
+        if self.retrieved:
+            emit_event(self.config, 'report', self.address,
+                       path=os.path.join(self.config['tmp_dir'],
+                                         self.sos_path.split('/')[-1]),
+                       timings=dict(self.timings))
+        else:
+            emit_event(self.config, 'failed', self.address, error=error)
+        self.release_state()
+
+    def release_state(self):
+        '''Drop what is only needed while collecting from the node, once its
+        archive is written, so that the memory held for finished nodes does
+        not grow with the size of the collection. The sos version, timings
+        and facts are kept for the inventory and the timing report.
+        '''
+        self.sos_info = {'version': self.sos_info['version']}
+        self.sos_cmd = None
+        self.shard_errors = []
+        self.stage_exception = None
+
+    def _sos_bin_cmd(self, cmd):
+        '''Returns the sosreport command cmd using the path to sosreport on
+        the host, throttled if requested'''
+        cmd = cmd.replace('sosreport', self.host.sos_bin_path, 1)
+        mode = self.config['throttle']
+        if mode == 'systemd' and self.host.containerized:
+            # sosreport runs in a container, where there is no systemd
+            mode = 'nice'
+        if mode == 'systemd' and self.systemd_version is None:
+            try:
+                res = self.run_command('systemctl --version')
+                self.systemd_version = parse_systemd_version(res['stdout'])
+            except Exception as err:
+                self.log_debug('Could not determine systemd version: %s'
+                               % err)
+            self.systemd_version = self.systemd_version or 0
+        return throttle_command(cmd, mode, self.systemd_version)
+
+    def sample_pressure(self):
+        '''Returns the current load and pressure of the node, or None if
+        they could not be read'''
+        try:
+            res = self.run_command(PRESSURE_CMD, timeout=10)
+            return parse_pressure(res['stdout'])
+        except Exception as err:
+            self.log_debug('Could not sample node load: %s' % err)
+            return None
+
+    def guard_start(self):
+        '''With load or pressure thresholds set, wait until neither this node
+        nor its failure domain is over them, then monitor the node until its
+        sosreport has finished'''
+        guard = self.config['guardrail']
+        if not guard:
+            return
+        domain = self.get_domain()
+        held = guard.wait(domain, self.address, self.sample_pressure)
+        if held >= guard.interval:
+            self.log_info('Waited %d seconds for load to fall before '
+                          'starting sosreport' % held)
+            self.timings['held'] = held
+        self.guard_monitor = guard.monitor(domain, self.address,
+                                           self.sample_pressure)
+
+    def get_domain(self):
+        '''Returns the failure domain the cluster profile places this node
+        in'''
+        if not self.config['cluster']:
+            # without a cluster profile every node shares the default domain
+            return None
+        name = self.config['hostname'] if self.local else self.address
+        return self.config['cluster'].get_node_domain(name)
+
+    def guard_stop(self):
+        if self.guard_monitor:
+            self.guard_monitor.stop()
+            self.guard_monitor = None
+
+    def get_cpu_count(self):
+        '''Returns the number of CPUs on the node, or 1 if unknown'''
+        if self.resources and self.resources['cpus']:
+            return self.resources['cpus']
+        try:
+            res = self.run_command('nproc')
+            if res['status'] == 0:
+                return max(int(res['stdout'].split()[0]), 1)
+        except Exception as err:
+            self.log_debug('Could not determine CPU count: %s' % err)
+        return 1
+
+    def get_plugin_shards(self):
+        '''Split the plugins sosreport would run on this node into groups,
+        one per concurrent sosreport. There are no more groups than
+        --shard-max or the node has CPUs.
+        '''
+        if self.sos_info.get('shared'):
+            # which plugins are enabled depends on what is installed on the
+            # node, and shards force their plugins on with --only-plugins
+            self.sos_info = {'version': self.sos_info['version'],
+                             'enabled': [], 'disabled': [], 'options': [],
+                             'presets': []}
+            self._load_sos_lists()
+        skip, enable, _ = self._get_plugin_lists()
+        if self.config['only_plugins']:
+            plugins = [p for p in self.config['only_plugins']
+                       if self._plugin_exists(p)]
+        else:
+            plugins = [p for p in self.sos_info['enabled'] if p not in skip]
+            plugins += [p for p in enable if p not in plugins and
+                        p not in skip and self._plugin_exists(p)]
+        count = min(self.config['shard_max'], len(plugins))
+        if count > 1:
+            count = min(count, self.get_cpu_count())
+        return split_plugins(plugins, count)
+
+    def _shard_cmd(self, idx, plugins, shards=1):
+        '''Returns the sos command for one shard of the node's plugins'''
+        cmd = self.config['sos_cmd']
+        label = self.determine_sos_label(suffix='shard%s' % idx)
+        cmd = '%s %s' % (cmd, quote(label))
+        cmd += ' --only-plugins=%s' % quote(','.join(plugins))
+        cmd += self._tuned_sos_options(shards)
+        _, _, options = self._get_plugin_lists()
+        opts = [o for o in options if o.split('.')[0] in plugins
+                and self._plugin_option_exists(o.split('=')[0])]
+        if opts:
+            cmd += ' -k %s' % quote(','.join(opts))
+        if self.config['preset'] and \
+                self._preset_exists(self.config['preset']):
+            cmd += ' --preset=%s' % quote(self.config['preset'])
+        return cmd
+
+    def _run_shard(self, shard, shards=1):
+        '''Run the sosreport of one shard, returning its archive path'''
+        idx, plugins = shard
+        cmd = self._shard_cmd(idx, plugins, shards)
+        self.log_debug('Shard %s sos command set to %s' % (idx, cmd))
+        try:
+            path = self.execute_sos_command(cmd)
+        except Exception as err:
+            return None, str(err)
+        if not path:
+            return None, 'unable to determine path of sos archive'
+        return self._strip_sos_path(path), None
+
+    def generate_shards(self, shards):
+        '''Run one sosreport for each group of plugins in shards at the same
+        time'''
+        self.log_info('Generating sosreport in %s shards...' % len(shards))
+        emit_event(self.config, 'progress', self.address, stage='sosreport')
+        pool = ThreadPoolExecutor(len(shards))
+        results = list(pool.map(lambda s: self._run_shard(s, len(shards)),
+                                enumerate(shards, 1)))
+        pool.shutdown(wait=True)
+        self.timings['sosreport'] = time.time() - self.stage_start
+        self.shard_paths = [r[0] for r in results if r[0]]
+        self.shard_errors = [r[1] for r in results if r[1]]
+        self.stage_error = '; '.join(self.shard_errors)
+
+    def transfer_shards(self):
+        '''Retrieve the shard archives into a directory for this node'''
+        errors = self.shard_errors
+        emit_event(self.config, 'progress', self.address, stage='retrieve')
+        _start = time.time()
+        self.sos_path = os.path.join(self.config['tmp_dir'],
+                                     'sosreport-%s-shards' % self.address)
+        self.archive = os.path.basename(self.sos_path)
+        if not os.path.isdir(self.sos_path):
+            os.makedirs(self.sos_path)
+        for path in self.shard_paths:
+            if not self._retrieve_shard(path):
+                errors.append('failed to retrieve %s' % path)
+        self.timings['retrieve'] = time.time() - _start
+        self.retrieved = not errors
+        if errors:
+            self.log_error('Failed to collect all sosreport shards: %s'
+                           % '; '.join(errors))
+        self.stage_error = '; '.join(errors) or None
+
+    def _retrieve_shard(self, path):
+        if self.config['need_sudo'] or self.config['become_root']:
+            try:
+                self.make_archive_readable(path)
+                self.make_archive_readable(path + '.md5')
+            except Exception:
+                self.log_debug('Failed to make %s readable' % path)
+        if not self.retrieve_file(path, self.sos_path):
+            return False
+        self.retrieve_file(path + '.md5', self.sos_path)
+        return True
+
+    def _cache_key(self):
+        return cache_key(self.address, self.sos_cmd, self.sos_info['version'],
+                         self.sos_info['enabled'])
+
+    def use_cached_sosreport(self):
+        '''If run with --cache, use the sosreport a recent collection
+        retrieved with the same sos command, if there is one. Returns True
+        if a cached sosreport was used.
+        '''
+        cache = self.config['archive_cache']
+        if not cache:
+            return False
+        start = time.time()
+        self.finalize_sos_cmd()
+        try:
+            path = cache.get(self._cache_key(), self.config['tmp_dir'])
+        except Exception as err:
+            self.log_debug('Could not read sosreport cache: %s' % err)
+            return False
+        if not path:
+            return False
+        self.log_info('Using sosreport cached from a recent collection')
+        self.cached = True
+        self.retrieved = True
+        self.sos_path = path
+        self.archive = os.path.basename(path)
+        self._finish_sosreport(start, None)
+        return True
+
+    def _cache_sosreport(self):
+        '''Add the retrieved sosreport to the cache for later collections'''
+        cache = self.config['archive_cache']
+        if not cache:
+            return
+        path = os.path.join(self.config['tmp_dir'],
+                            self.sos_path.split('/')[-1])
+        try:
+            cache.put(self._cache_key(), self.address, path)
+        except Exception as err:
+            self.log_debug('Could not add sosreport to cache: %s' % err)
+
+    def find_existing_sosreport(self):
+        '''Look for a sosreport archive on the node that is recent enough to
+        be collected instead of generating a new one, matching the case id
+        and label if given. Returns the path of the newest one, or None.
+        '''
+        age = parse_seconds(str(self.config['harvest_age']))
+        cmd = ("find %s -maxdepth 1 -type f -name 'sosreport-*.tar*' "
+               "-mmin -%s -printf '%%T@ %%p\\n'"
+               % (' '.join(HARVEST_DIRS), max(1, int((age + 59) // 60))))
+        res = self.run_command(cmd, timeout=30)
+        return select_sosreport(res['stdout'], self.config['case_id'],
+                                self.config['label'])
+
+    def harvest_existing_sosreport(self):
+        '''Retrieve an existing sosreport from the node, if there is one that
+        is recent enough. The archive is left on the node, as it was not
+        created by us. Returns True if a sosreport was retrieved.
+        '''
+        if self.host.containerized:
+            return False
+        start = time.time()
+        try:
+            path = self.find_existing_sosreport()
+        except Exception as err:
+            self.log_debug('Could not look for existing sosreports: %s' % err)
+            return False
+        if not path:
+            self.log_debug('No recent sosreport found to harvest')
+            return False
+        self.log_info('Harvesting existing sosreport %s' % path)
+        self.harvested = True
+        self.sos_path = path
+        self.archive = path.split('/')[-1]
+        try:
+            self.retrieved = self.retrieve_sosreport()
+        except (Exception, SystemExit) as err:
+            # retrieve_sosreport() raises SystemExit on failed copies
+            self.log_error('Failed to harvest sosreport: %s' % err)
+        if self.config['need_sudo'] or self.config['become_root']:
+            # undo the change retrieve_sosreport() made for us
+            for fname in (path, path + '.md5'):
+                self.run_command('chmod o-r %s' % fname, timeout=10,
+                                 need_root=True)
+        self.timings['retrieve'] = time.time() - start
+        if not self.retrieved:
+            # fall back to generating a new sosreport
+            self.harvested = False
+            self.sos_path = None
+            return False
+        self._finish_sosreport(start, None)
+        return True
+
+    def _detached_files(self, run_id):
+        '''Returns the paths on the node of the output, exit code and process
+        id files of a detached sosreport'''
+        base = '/var/tmp/sos-collector-%s' % run_id
+        return base + '.out', base + '.rc', base + '.pid'
+
+    def start_detached_sosreport(self, run_id):
+        '''Start sosreport on the node in the background and return without
+        waiting for it. The output of sosreport and its exit code are written
+        to files on the node, which check_detached_sosreport() polls for.
+        '''
+        self.detach_start = time.time()
+        self.finalize_sos_cmd()
+        out, rc, pid = self._detached_files(run_id)
+        sos_cmd = self.sos_cmd.strip()
+        if sos_cmd.startswith('sosreport'):
+            sos_cmd = self._sos_bin_cmd(sos_cmd)
+        run = ("echo $$ >%s; %s >%s 2>&1 </dev/null; echo $? >%s"
+               % (pid, sos_cmd, out, rc))
+        # the sudo or su must stay in the foreground to be given the
+        # password, so the backgrounding is done by the shell it runs. The
+        # shell leads its own session so that abort_detached_sosreport() can
+        # stop sosreport along with the commands its plugins run
+        cmd = "sh -c %s" % quote("nohup setsid sh -c %s >/dev/null 2>&1 "
+                                 "</dev/null &" % quote(run))
+        self.log_debug('Starting detached sosreport: %s' % run)
+        self.guard_start()
+        res = self.run_command(cmd, timeout=60, need_root=True)
+        if res['status'] != 0:
+            self.guard_stop()
+            raise Exception('could not start sosreport: %s'
+                            % res['stdout'].strip())
+        self.log_info('Generating sosreport in the background...')
+        emit_event(self.config, 'progress', self.address, stage='sosreport')
+
+    def check_detached_sosreport(self, run_id):
+        '''Returns the exit code of a detached sosreport, or None if it is
+        still running'''
+        res = self.run_command('cat %s' % self._detached_files(run_id)[1],
+                               timeout=30)
+        if res['status'] != 0:
+            return None
+        try:
+            return int(res['stdout'].strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            # the exit code is being written
+            return None
+
+    def harvest_detached_sosreport(self, run_id, rc):
+        '''Retrieve the archive of a finished detached sosreport, and remove
+        the files it left behind on the node'''
+        self.timings['sosreport'] = time.time() - self.detach_start
+        error = 'unable to determine path of sos archive'
+        out, rcfile, pidfile = self._detached_files(run_id)
+        try:
+            output = self.run_command('cat %s' % out, timeout=30)['stdout']
+            if rc != 0:
+                error = self.determine_sos_error(rc, output)
+                self.log_error('Error running sosreport: %s' % error)
+            else:
+                for line in output.splitlines():
+                    if fnmatch.fnmatch(line, '*sosreport-*tar*'):
+                        self.finalize_sos_path(line.strip())
+                if self.sos_path:
+                    emit_event(self.config, 'progress', self.address,
+                               stage='retrieve')
+                    _start = time.time()
+                    error = 'failed to retrieve sosreport'
+                    self.retrieved = self.retrieve_sosreport()
+                    self.timings['retrieve'] = time.time() - _start
+                else:
+                    self.log_error('Unable to determine path of sos archive')
+        except Exception as err:
+            error = str(err)
+        for fname in (out, rcfile, pidfile):
+            self.remove_file(fname)
+        self._finish_sosreport(self.detach_start, error)
+
+    def abort_detached_sosreport(self, run_id, error):
+        '''Stop a detached sosreport that did not finish in time, and remove
+        the files it left behind on the node'''
+        out, rcfile, pidfile = self._detached_files(run_id)
+        kill = "sh -c %s" % quote("[ -s %s ] && kill -TERM -- -$(cat %s)"
+                                  % (pidfile, pidfile))
+        try:
+            self.run_command(kill, timeout=30, need_root=True)
+        except Exception as err:
+            self.log_debug('Could not stop sosreport: %s' % err)
+        for fname in (out, rcfile, pidfile):
+            self.remove_file(fname)
+        self._finish_sosreport(self.detach_start, error)
 
     def _create_ssh_session(self):
         '''
@@ -405,34 +1049,106 @@ class SosNode():
 
         At most, we will wait 30 seconds for a connection. This involves a 15
         second wait for the initial connection attempt, and a subsequent 15
-        second wait for a response when we supply a password.
+        second wait for a response when we supply a password. Nodes that the
+        cluster reports as offline are given a shorter connect_timeout.
 
         Since we connect to nodes in parallel (using the --threads value), this
         means that the time between 'Connecting to nodes...' and 'Beginning
         collection of sosreports' that users see can be up to an amount of time
         equal to 30*(num_nodes/threads) seconds.
 
+        If the node resets or closes the connection before authentication, as
+        sshd does once its MaxStartups limit is reached, the attempt is
+        retried up to ssh_retries times with an exponential backoff. New
+        connections are also rate limited per node through the configured
+        ConnectionLimiter.
+
+        When persistent connections are used, the control socket lives in a
+        directory shared between runs of sos-collector. If a healthy socket
+        for this node already exists it is reused without a new handshake.
+
         Returns
             True if session is successfully opened, else raise Exception
         '''
+        if self.config['persist_connections'] and self.control_socket_exists:
+            if check_control_socket(self.control_path):
+                self.log_debug('Reusing existing control socket at %s'
+                               % self.control_path)
+                return True
+            self.log_debug('Removing stale control socket at %s'
+                           % self.control_path)
+            try:
+                os.remove(self.control_path)
+            except OSError:
+                pass
+        limiter = self.config['conn_limiter']
+        attempt = 0
+        while True:
+            if limiter:
+                limiter.acquire(self.address, self.jump_host)
+                limiter.acquire_slot(self.jump_host)
+            try:
+                with child_slot(self.config['fd_budget']):
+                    connected = self._open_ssh_session()
+                if limiter:
+                    limiter.recover(self.address, self.jump_host)
+                return connected
+            except ConnectionRejectedException:
+                if limiter:
+                    limiter.throttle(self.address, self.jump_host)
+                if attempt >= self.config['ssh_retries']:
+                    raise
+                delay = min(30, 2 ** attempt) * random.uniform(0.5, 1.5)
+                attempt += 1
+                self.log_debug('Connection rejected, retrying in %.1f '
+                               'seconds (attempt %s of %s)'
+                               % (delay, attempt, self.config['ssh_retries']))
+            finally:
+                if limiter:
+                    limiter.release_slot(self.jump_host)
+            # back off without holding the jump host slot, so that other
+            # sessions through the jump host are not held up
+            time.sleep(delay)
+
+    def _get_proxy_command(self):
+        '''If the node is reached through a jump host, returns the ssh option
+        that tunnels the connection through the existing master connection
+        to the jump host, so that no new handshake with it is needed
+        '''
+        if not self.jump_host:
+            return ''
+        return ('-oProxyCommand="ssh -oControlPath=%s -W %%h:%%p %s@%s"'
+                % (self.config['jump_control_path'], self.config['ssh_user'],
+                   self.jump_host))
+
+    def _open_ssh_session(self):
+        '''Make a single attempt at opening the ControlPersist session'''
         # Don't use self.ssh_cmd here as we need to add a few additional
         # parameters to establish the initial connection
         self.log_debug('Opening SSH session to create control socket')
         connected = False
         ssh_key = ''
         ssh_port = ''
+        keepalive = ''
         if self.config['ssh_port'] != 22:
             ssh_port = "-p%s " % self.config['ssh_port']
         if self.config['ssh_key']:
             ssh_key = "-i%s" % self.config['ssh_key']
-        cmd = ("ssh %s %s -oControlPersist=600 -oControlMaster=auto "
-               "-oStrictHostKeyChecking=no -oControlPath=%s %s@%s "
-               "\"echo Connected\"" % (ssh_key,
-                                       ssh_port,
-                                       self.control_path,
-                                       self.config['ssh_user'],
-                                       self.address))
-        res = pexpect.spawn(cmd, encoding='utf-8')
+        if self.config['persist_connections']:
+            keepalive = "-oServerAliveInterval=30 -oServerAliveCountMax=3"
+        cmd = ("ssh %s %s %s %s -oControlPersist=%s -oControlMaster=auto "
+               "-oStrictHostKeyChecking=no -oConnectTimeout=%s "
+               "-oControlPath=%s %s@%s \"echo Connected\""
+               % (ssh_key,
+                  ssh_port,
+                  keepalive,
+                  self._get_proxy_command(),
+                  self.config['control_persist'],
+                  self.connect_timeout,
+                  self.control_path,
+                  self.config['ssh_user'],
+                  self.address))
+        res = pexpect.spawn(cmd, encoding='utf-8', use_poll=True)
 
         connect_expects = [
             u'Connected',
@@ -440,10 +1156,12 @@ class SosNode():
             u'.*Permission denied.*',
             u'.* port .*: No route to host',
             u'.*Could not resolve hostname.*',
-            pexpect.TIMEOUT
+            pexpect.TIMEOUT,
+            u'.*(Connection reset|Connection closed|exchange_identification)',
+            u'.* port .*: Connection refused'
         ]
 
-        index = res.expect(connect_expects, timeout=15)
+        index = res.expect(connect_expects, timeout=self.connect_timeout)
         if index == 0:
             connected = True
         elif index == 1:
@@ -474,6 +1192,10 @@ class SosNode():
             raise ConnectionException(self.address)
         elif index == 5:
             raise ConnectionTimeoutException
+        elif index == 6:
+            raise ConnectionRejectedException(self.address)
+        elif index == 7:
+            raise ConnectionException(self.address, self.config['ssh_port'])
         else:
             raise Exception("Unknown error, client returned %s" % res.before)
         if connected:
@@ -486,6 +1208,12 @@ class SosNode():
         '''Remove the control socket to effectively terminate the session'''
         if self.local:
             return True
+        if self.config['persist_connections']:
+            # leave the master running for the next run of sos-collector, it
+            # will exit on its own after control_persist seconds of idling
+            self.log_debug('Keeping control socket %s for reuse'
+                           % self.control_path)
+            return True
         try:
             res = self.run_command("rm -f %s" % self.control_path,
                                    force_local=True)
@@ -537,17 +1265,58 @@ class SosNode():
         to exist on the node'''
         return ','.join(o for o in opts if self._plugin_exists(o))
 
+    def _tuned_sos_options(self, shards=1):
+        '''With --auto-tune, returns the sos options chosen for this node's
+        resources, leaving out any the user set. The threads are divided
+        between the shards of a sharded node.
+        '''
+        if not (self.config['auto_tune'] and self.resources):
+            return ''
+        tuned = tune_sos_options(self.resources)
+        opts = ''
+        if self.check_sos_version('3.6'):
+            opts += ' --threads=%s' % max(tuned['threads'] // shards, 1)
+        if tuned['compression'] and not self.config['compression']:
+            opts += ' -z %s' % tuned['compression']
+        if tuned['log_size'] and not (self.config['log_size'] or
+                                      self.config['all_logs']):
+            opts += ' --log-size=%s' % tuned['log_size']
+        return opts
+
+    def _get_plugin_lists(self):
+        '''Returns the plugins to skip, the plugins to enable and the plugin
+        options to use on this node'''
+        skip_plugins = list(self.config['skip_plugins'])
+        enable_plugins = list(self.config['enable_plugins'])
+        plugin_options = list(self.config['plugin_options'])
+        cluster = self.config['cluster']
+        if cluster and not self.is_scoped_node():
+            # cluster-scoped data is only collected by the designated node
+            scoped = cluster.get_scoped_plugins()
+            scoped_opts = cluster.get_scoped_options()
+            if scoped or scoped_opts:
+                self.log_debug('Not collecting cluster-scoped plugins %s and '
+                               'options %s on this node'
+                               % (scoped, scoped_opts))
+            enable_plugins = [p for p in enable_plugins if p not in scoped]
+            skip_plugins += [p for p in scoped if p not in skip_plugins]
+            plugin_options = [o for o in plugin_options
+                              if o not in scoped_opts]
+        return skip_plugins, enable_plugins, plugin_options
+
     def finalize_sos_cmd(self):
         '''Use host facts and compare to the cluster type to modify the sos
         command if needed'''
         self.sos_cmd = self.config['sos_cmd']
         label = self.determine_sos_label()
         if label:
-            self.sos_cmd = ' %s %s' % (self.sos_cmd, quote(label))
+            self.sos_cmd = '%s %s' % (self.sos_cmd, quote(label))
 
         if self.config['sos_opt_line']:
             return True
 
+        self.sos_cmd += self._tuned_sos_options()
+
         if self.config['only_plugins']:
             plugs = [o for o in self.config['only_plugins']
                      if self._plugin_exists(o)]
@@ -560,33 +1329,42 @@ class SosNode():
                 self.sos_cmd += ' --only-plugins=%s' % quote(only)
             return True
 
-        if self.config['skip_plugins']:
+        skip_plugins, enable_plugins, plugin_options = \
+            self._get_plugin_lists()
+        # plugin information reused from another node of the same sos build
+        # may not match which plugins are enabled on this node, so skip and
+        # enable any plugin that exists
+        shared = self.sos_info.get('shared')
+
+        if skip_plugins:
             # only run skip-plugins for plugins that are enabled
-            skip = [o for o in self.config['skip_plugins']
-                    if self._check_enabled(o)]
-            if len(skip) != len(self.config['skip_plugins']):
-                not_skip = list(set(self.config['skip_plugins']) - set(skip))
+            skip = [o for o in skip_plugins
+                    if self._check_enabled(o) or
+                    (shared and self._plugin_exists(o))]
+            if len(skip) != len(skip_plugins):
+                not_skip = list(set(skip_plugins) - set(skip))
                 self.log_debug('Requested to skip plugins %s, but plugins are '
                                'already not enabled' % not_skip)
             skipln = self._fmt_sos_opt_list(skip)
             if skipln:
                 self.sos_cmd += ' --skip-plugins=%s' % quote(skipln)
 
-        if self.config['enable_plugins']:
+        if enable_plugins:
             # only run enable for plugins that are disabled
-            opts = [o for o in self.config['enable_plugins']
-                    if o not in self.config['skip_plugins']
-                    and self._check_disabled(o) and self._plugin_exists(o)]
-            if len(opts) != len(self.config['enable_plugins']):
-                not_on = list(set(self.config['enable_plugins']) - set(opts))
+            opts = [o for o in enable_plugins
+                    if o not in skip_plugins
+                    and (self._check_disabled(o) or shared)
+                    and self._plugin_exists(o)]
+            if len(opts) != len(enable_plugins):
+                not_on = list(set(enable_plugins) - set(opts))
                 self.log_debug('Requested to enable plugins %s, but plugins '
                                'are already enabled or do not exist' % not_on)
             enable = self._fmt_sos_opt_list(opts)
             if enable:
                 self.sos_cmd += ' --enable-plugins=%s' % quote(enable)
 
-        if self.config['plugin_options']:
-            opts = [o for o in self.config['plugin_options']
+        if plugin_options:
+            opts = [o for o in plugin_options
                     if self._plugin_exists(o.split('.')[0])
                     and self._plugin_option_exists(o.split('=')[0])]
             if opts:
@@ -599,15 +1377,26 @@ class SosNode():
                 self.log_debug('Requested to enable preset %s but preset does '
                                'not exist on node' % self.config['preset'])
 
-    def determine_sos_label(self):
+    def is_scoped_node(self):
+        '''Is this node the one designated to collect the cluster-scoped
+        plugins and options of the cluster profile'''
+        scoped = self.config['scoped_node']
+        return scoped is None or scoped == self.address
+
+    def determine_sos_label(self, suffix=None):
         '''Determine what, if any, label should be added to the sosreport'''
         label = ''
-        label += self.config['cluster'].get_node_label(self)
+        if self.config['cluster']:
+            self.cluster_label = self.config['cluster'].get_node_label(self)
+        label += self.cluster_label or ''
 
         if self.config['label']:
             label += ('%s' % self.config['label'] if not label
                       else '-%s' % self.config['label'])
 
+        if suffix:
+            label += '%s' % suffix if not label else '-%s' % suffix
+
         if not label:
             return None
 
@@ -622,14 +1411,17 @@ class SosNode():
     def finalize_sos_path(self, path):
         '''Use host facts to determine if we need to change the sos path
         we are retrieving from'''
-        pstrip = self.host.sos_path_strip
-        if pstrip:
-            path = path.replace(pstrip, '')
-        path = path.split()[0]
+        path = self._strip_sos_path(path)
         self.log_debug('Final sos path: %s' % path)
         self.sos_path = path
         self.archive = path.split('/')[-1]
 
+    def _strip_sos_path(self, path):
+        pstrip = self.host.sos_path_strip
+        if pstrip:
+            path = path.replace(pstrip, '')
+        return path.split()[0]
+
     def determine_sos_error(self, rc, stdout):
         if rc == -1:
             return 'sosreport process received SIGKILL on node'
@@ -643,12 +1435,12 @@ class SosNode():
         else:
             return 'sos exited with code %s' % rc
 
-    def execute_sos_command(self):
+    def execute_sos_command(self, sos_cmd=None):
         '''Run sosreport and capture the resulting file path'''
         self.log_info("Generating sosreport...")
         try:
             path = False
-            res = self.run_command(self.sos_cmd,
+            res = self.run_command(sos_cmd or self.sos_cmd,
                                    timeout=self.config['timeout'],
                                    get_pty=True, need_root=True,
                                    use_container=True)
@@ -670,9 +1462,10 @@ class SosNode():
             self.log_error('Error running sosreport: %s' % e)
             raise
 
-    def retrieve_file(self, path):
-        '''Copies the specified file from the host to our temp dir'''
-        destdir = self.config['tmp_dir'] + '/'
+    def retrieve_file(self, path, destdir=None):
+        '''Copies the specified file from the host to our temp dir, or to
+        destdir if given'''
+        destdir = (destdir or self.config['tmp_dir']) + '/'
         dest = destdir + path.split('/')[-1]
         try:
             if not self.local:
@@ -773,9 +1566,16 @@ class SosNode():
 
     def cleanup(self):
         '''Remove the sos archive from the node once we have it locally'''
-        self.remove_sos_archive()
-        if self.hash_retrieved:
-            self.remove_file(self.sos_path + '.md5')
+        # harvested archives were not created by us, so they are kept, and
+        # cached archives never existed on the node
+        if self.shard_paths:
+            for path in self.shard_paths:
+                self.remove_file(path)
+                self.remove_file(path + '.md5')
+        elif not (self.harvested or self.cached):
+            self.remove_sos_archive()
+            if self.hash_retrieved:
+                self.remove_file(self.sos_path + '.md5')
         cleanup = self.host.set_cleanup_cmd()
         if cleanup:
             self.run_command(cleanup)
@@ -0,0 +1,103 @@
+# Copyright Red Hat 2019, Jake Hunsaker <jhunsake@redhat.com>
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Management of a long-lived directory of SSH ControlMaster sockets, shared by
+consecutive runs of sos-collector so that connections opened by one run are
+reused by the next rather than paying for a new SSH handshake.
+'''
+
+import hashlib
+import os
+import stat
+import subprocess
+
+SOCKET_PREFIX = '.sos-collector-'
+
+# sun_path holds 108 bytes including the terminating NUL, and ssh adds a
+# '.' and 16 random characters to the ControlPath while creating the socket
+SOCKET_PATH_MAX = 107
+SOCKET_TEMP_SUFFIX = 17
+
+
+def control_socket_name(user, address, port):
+    '''Returns the name of the control socket for a connection. The name is
+    a hash of the connection so that it has the same short length for any
+    node, however long its name.
+    '''
+    conn = '%s@%s:%s' % (user, address, port)
+    return SOCKET_PREFIX + hashlib.sha1(conn.encode('utf-8')).hexdigest()[:16]
+
+
+def control_path_fits(path):
+    '''Can control sockets be created in the directory at path without
+    overflowing the socket path limit'''
+    sock = os.path.join(path, control_socket_name('', '', ''))
+    return len(sock) + SOCKET_TEMP_SUFFIX <= SOCKET_PATH_MAX
+
+
+def default_control_dir():
+    '''Returns the default location of the shared socket directory for the
+    current user'''
+    return '/var/tmp/sos-collector-sockets-%s' % os.getuid()
+
+
+def prepare_control_dir(path):
+    '''Create the shared socket directory if needed, and make sure that it
+    is private to the current user, since anyone able to use the sockets can
+    run commands on the nodes.
+    '''
+    if not os.path.isdir(path):
+        os.makedirs(path, 0o700)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise OSError("%s is not a directory" % path)
+    if st.st_uid != os.getuid():
+        raise OSError("%s is not owned by the current user" % path)
+    if st.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        os.chmod(path, 0o700)
+    return path
+
+
+def check_control_socket(path):
+    '''Ask the ssh master process behind the socket at path if it is still
+    running. Returns True if the socket can be used for new sessions.
+    '''
+    if not os.path.exists(path):
+        return False
+    # the destination is not used, since the ControlPath is given in full
+    cmd = ['ssh', '-O', 'check', '-oControlPath=%s' % path, 'sos-collector']
+    with open(os.devnull, 'w') as devnull:
+        return subprocess.call(cmd, stdout=devnull, stderr=devnull) == 0
+
+
+def sweep_control_dir(path):
+    '''Remove any sockets in the directory whose master process has exited,
+    or that are no longer responding. Returns the number of sockets that are
+    still alive.
+    '''
+    alive = 0
+    for fname in os.listdir(path):
+        if not fname.startswith(SOCKET_PREFIX):
+            continue
+        sock = os.path.join(path, fname)
+        if check_control_socket(sock):
+            alive += 1
+            continue
+        try:
+            os.remove(sock)
+        except OSError:
+            pass
+    return alive
@@ -0,0 +1,79 @@
+# Copyright Red Hat 2019, Jake Hunsaker <jhunsake@redhat.com>
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Per-node tuning of sosreport, used with --auto-tune. The CPU count, memory
+and load of each node select the number of threads sosreport runs plugins
+with, the compression type and the log size limit.
+'''
+
+import re
+
+# command run on each node to probe its resources
+RESOURCE_CMD = "sh -c 'nproc; cat /proc/loadavg; grep MemTotal /proc/meminfo'"
+
+# (minimum CPUs, minimum memory in MiB, sos threads, compression, log size)
+# The first row a node satisfies is used. A compression or log size of None
+# leaves the sos default in place.
+TUNING_POLICY = [
+    (16, 32768, 8, None, None),
+    (4, 4096, 4, None, None),
+    (0, 0, 2, 'gzip', 10)
+]
+
+# load per CPU above which a node is considered busy, and the load per CPU
+# above which it is considered overloaded
+BUSY_LOAD = 1.0
+OVERLOADED_LOAD = 2.0
+
+
+def parse_resources(output):
+    '''Parse the output of RESOURCE_CMD into a dict of the node's 'cpus',
+    'memory' in MiB and 1 minute 'load'. Values that are missing from the
+    output are None.
+    '''
+    resources = {'cpus': None, 'memory': None, 'load': None}
+    for line in output.splitlines():
+        line = line.strip()
+        if re.match(r'^\d+$', line):
+            resources['cpus'] = int(line)
+        elif line.startswith('MemTotal:'):
+            try:
+                resources['memory'] = int(line.split()[1]) // 1024
+            except (IndexError, ValueError):
+                pass
+        elif re.match(r'^\d+\.\d+ \d+\.\d+ \d+\.\d+ ', line):
+            resources['load'] = float(line.split()[0])
+    return resources
+
+
+def tune_sos_options(resources, policy=TUNING_POLICY):
+    '''Returns a dict of the sos 'threads', 'compression' and 'log_size'
+    to use on a node with the given resources. Busy nodes run with half the
+    threads, and overloaded nodes with a single thread and gzip compression.
+    '''
+    cpus = resources.get('cpus') or 1
+    memory = resources.get('memory') or 0
+    for min_cpus, min_memory, threads, compression, log_size in policy:
+        if cpus >= min_cpus and memory >= min_memory:
+            break
+    load = (resources.get('load') or 0) / float(cpus)
+    if load >= OVERLOADED_LOAD:
+        threads = 1
+        compression = 'gzip'
+    elif load >= BUSY_LOAD:
+        threads = max(threads // 2, 1)
+    return {'threads': threads, 'compression': compression,
+            'log_size': log_size}
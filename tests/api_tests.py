@@ -0,0 +1,183 @@
+import logging
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import unittest
+
+from soscollector import sos_collector
+from soscollector.api import Collection, emit_event
+from soscollector.configuration import Configuration
+
+
+class StubNode(object):
+    '''Stands in for a SosNode, writing a sosreport into tmp_dir instead of
+    collecting one over ssh'''
+
+    def __init__(self, address, config, password=None, **kwargs):
+        self.address = address
+        self.config = config
+        self.local = address == 'localhost'
+        self.hostname = config['hostname'] if self.local else address
+        self._hostname = self.hostname
+        self.connected = True
+        self.host = None
+        self.sos_info = {'version': '3.9', 'enabled': [], 'disabled': []}
+        self.timings = {}
+        self.facts = {}
+        self.retrieved = False
+        self.stage_exception = None
+        self.sos_path = None
+
+    def get_domain(self):
+        return None
+
+    def generate_sosreport(self):
+        emit_event(self.config, 'progress', self.address, stage='sosreport')
+        return True
+
+    def transfer_sosreport(self):
+        if self.address.startswith('bad'):
+            return
+        self.sos_path = os.path.join(self.config['tmp_dir'],
+                                     'sosreport-%s.tar.xz' % self.address)
+        with open(self.sos_path, 'w') as rfile:
+            rfile.write(self.address)
+        self.retrieved = True
+
+    def finish_sosreport(self):
+        if self.retrieved:
+            emit_event(self.config, 'report', self.address,
+                       path=self.sos_path, timings={})
+        else:
+            emit_event(self.config, 'failed', self.address,
+                       error='failed to retrieve sosreport')
+
+    def close_ssh_session(self):
+        pass
+
+    def log_error(self, msg):
+        pass
+
+
+class APITests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = {'batch': False, 'embedded': False, 'event_hook': None,
+                       'ui_stream': None}
+
+    def test_emit_event(self):
+        events = []
+        emit_event(self.config, 'report', 'node1')
+        self.config['event_hook'] = events.append
+        emit_event(self.config, 'report', 'node1', path='/tmp/foo')
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['event'], 'report')
+        self.assertEqual(events[0]['node'], 'node1')
+        self.assertEqual(events[0]['path'], '/tmp/foo')
+
+    def test_hook_errors_ignored(self):
+        def hook(event):
+            raise ValueError
+        self.config['event_hook'] = hook
+        emit_event(self.config, 'report', 'node1')
+
+    def test_collection_config(self):
+        Collection(self.config)
+        self.assertTrue(self.config['batch'])
+        self.assertTrue(self.config['embedded'])
+        self.assertTrue(self.config['event_hook'])
+
+
+class CollectionTests(unittest.TestCase):
+    '''Runs collections through a real SosCollector, with the nodes stubbed
+    out'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.configs = []
+        self._sosnode = sos_collector.SosNode
+        sos_collector.SosNode = StubNode
+        # a handler that is not the collection's own, which must survive it
+        self.handler = logging.NullHandler()
+        logging.getLogger('sos_collector').addHandler(self.handler)
+
+    def tearDown(self):
+        sos_collector.SosNode = self._sosnode
+        logging.getLogger('sos_collector').removeHandler(self.handler)
+        shutil.rmtree(self.tmpdir)
+        # an aborted collection leaves its tmp_dir behind
+        for config in self.configs:
+            if config['tmp_dir'] and os.path.isdir(config['tmp_dir']):
+                shutil.rmtree(config['tmp_dir'])
+
+    def _config(self, nodes):
+        config = Configuration({'nodes': nodes, 'cluster_type': 'none',
+                                'no_local': True,
+                                'out_dir': self.tmpdir + '/'})
+        self.configs.append(config)
+        return config
+
+    def _handlers(self):
+        return [h for name in ('sos_collector', 'sos_collector_console')
+                for h in logging.getLogger(name).handlers]
+
+    def test_iterate(self):
+        collection = Collection(self._config(['node1', 'node2', 'bad1']))
+        events = list(collection)
+        self.assertEqual(collection.wait(), 0)
+        # the iterator stays exhausted
+        self.assertEqual(list(collection), [])
+        reports = dict((e['node'], e['path']) for e in events
+                       if e['event'] == 'report')
+        self.assertEqual(sorted(reports), ['node1', 'node2'])
+        failed = [e['node'] for e in events if e['event'] == 'failed']
+        self.assertEqual(failed, ['bad1'])
+        self.assertTrue(any(e['event'] == 'log' for e in events))
+        complete = [e for e in events if e['event'] == 'complete'][0]
+        self.assertEqual(complete['retrieved'], 2)
+        self.assertEqual(complete['total'], 3)
+        self.assertEqual(complete['archive'], collection.archive)
+        with tarfile.open(collection.archive) as tar:
+            names = [os.path.basename(n) for n in tar.getnames()]
+        self.assertTrue('sosreport-node1.tar.xz' in names)
+        self.assertTrue('sos-collector.log' in names)
+
+    def test_logging_scoped(self):
+        collection = Collection(self._config(['node1']))
+        self.assertEqual(collection.wait(), 0)
+        # only the handlers of the collection are removed
+        self.assertEqual(self._handlers(), [self.handler])
+
+    def test_aborted(self):
+        config = self._config(['node1'])
+        config['domain_limit'] = -1
+        collection = Collection(config)
+        events = list(collection)
+        self.assertEqual(collection.wait(), 1)
+        self.assertEqual(events[-1]['event'], 'aborted')
+        self.assertEqual(self._handlers(), [self.handler])
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'async iteration needs 3.5')
+    def test_async_iterate(self):
+        import asyncio
+        collection = Collection(self._config(['node1', 'node2']))
+        events = []
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            it = collection.__aiter__()
+            while True:
+                try:
+                    event = loop.run_until_complete(it.__anext__())
+                except StopAsyncIteration:
+                    break
+                events.append(event['event'])
+        finally:
+            loop.close()
+        self.assertEqual(events.count('report'), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
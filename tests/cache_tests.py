@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from soscollector import cache
+from soscollector.cache import ArchiveCache, cache_key
+
+
+class ArchiveCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dest = os.path.join(self.tmpdir, 'dest')
+        os.mkdir(self.dest)
+        self.cache = ArchiveCache(os.path.join(self.tmpdir, 'cache'),
+                                  max_size=100, max_age=3600)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _archive(self, name, size):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as afile:
+            afile.write(name.encode('utf-8').ljust(size, b'x'))
+        return path
+
+    def test_key(self):
+        key = cache_key('node1', 'sosreport --batch', '3.6', ['b', 'a'])
+        self.assertEqual(key, cache_key('node1', ' sosreport --batch', '3.6',
+                                        ['a', 'b']))
+        self.assertNotEqual(key, cache_key('node2', 'sosreport --batch',
+                                           '3.6', ['a', 'b']))
+        self.assertNotEqual(key, cache_key('node1', 'sosreport --batch -a',
+                                           '3.6', ['a', 'b']))
+
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get('key1', self.dest))
+        self.cache.put('key1', 'node1', self._archive('sosreport-node1', 20))
+        path = self.cache.get('key1', self.dest)
+        self.assertEqual(path, os.path.join(self.dest, 'sosreport-node1'))
+        self.assertEqual(os.path.getsize(path), 20)
+
+    def test_max_age(self):
+        self.cache.max_age = -1
+        self.cache.put('key1', 'node1', self._archive('sosreport-node1', 20))
+        self.assertIsNone(self.cache.get('key1', self.dest))
+        self.assertEqual(os.listdir(self.cache.objects), [])
+
+    def test_lru_eviction(self):
+        self.cache.put('key1', 'node1', self._archive('sosreport-node1', 40))
+        self.cache.put('key2', 'node2', self._archive('sosreport-node2', 40))
+        # using key1 makes key2 the least recently used
+        self.assertTrue(self.cache.get('key1', self.dest))
+        self.cache.put('key3', 'node3', self._archive('sosreport-node3', 40))
+        self.assertTrue(self.cache.get('key1', self.dest))
+        self.assertIsNone(self.cache.get('key2', self.dest))
+        self.assertTrue(self.cache.get('key3', self.dest))
+        self.assertEqual(len(os.listdir(self.cache.objects)), 2)
+
+    def test_shared_content(self):
+        path = self._archive('sosreport-node1', 60)
+        self.cache.put('key1', 'node1', path)
+        self.cache.put('key2', 'node1', path)
+        # the content is stored, and counted against max_size, only once
+        self.assertEqual(len(os.listdir(self.cache.objects)), 1)
+        self.assertTrue(self.cache.get('key1', self.dest))
+        self.assertTrue(self.cache.get('key2', self.dest))
+
+    def test_put_concurrent_evict(self):
+        evictor = []
+
+        def evict():
+            with self.cache._lock:
+                self.cache._evict()
+
+        def rename(src, dst):
+            # another worker evicts right after the object is stored
+            _rename(src, dst)
+            evictor.append(threading.Thread(target=evict))
+            evictor[0].start()
+            evictor[0].join(0.2)
+
+        _rename = cache.os.rename
+        cache.os.rename = rename
+        try:
+            self.cache.put('key1', 'node1',
+                           self._archive('sosreport-node1', 20))
+        finally:
+            cache.os.rename = _rename
+        evictor[0].join()
+        self.assertTrue(self.cache.get('key1', self.dest))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import json
+import unittest
+
+from soscollector.configuration import Configuration
+from soscollector.clusters.kubernetes import kubernetes
+from soscollector.clusters.ovirt import ovirt
+from soscollector.clusters.pacemaker import pacemaker
+from soscollector.clusters.satellite import satellite
+from soscollector.sos_collector import SosCollector
+
+
+class FakeMaster():
+    '''Stands in for the master SosNode, returning canned command output'''
+
+    address = 'master.example.com'
+
+    def __init__(self, stdout, status=0):
+        self.stdout = stdout
+        self.status = status
+        self.cmds = []
+
+    def run_command(self, cmd, **kwargs):
+        self.cmds.append(cmd)
+        return {'status': self.status, 'stdout': self.stdout}
+
+
+KUBE_NODES = {
+    'items': [
+        {
+            'metadata': {
+                'name': 'master1',
+                'labels': {'node-role.kubernetes.io/master': '',
+                           'topology.kubernetes.io/zone': 'east-1a'}
+            },
+            'status': {'conditions': [{'type': 'Ready', 'status': 'True'}]}
+        },
+        {
+            'metadata': {
+                'name': 'worker1',
+                'labels': {'node-role.kubernetes.io/worker': ''}
+            },
+            'status': {'conditions': [{'type': 'Ready', 'status': 'False'}]}
+        },
+        {
+            'metadata': {
+                'name': 'infra1',
+                'labels': {'node-role.kubernetes.io/infra': ''}
+            },
+            'status': {}
+        }
+    ]
+}
+
+CRM_MON = '''<?xml version="1.0"?>
+<crm_mon version="2.0.1">
+  <nodes>
+    <node name="node1" id="1" online="true" standby="false" type="member"/>
+    <node name="node2" id="2" online="false" standby="false" type="member"/>
+  </nodes>
+  <resources>
+    <resource id="vip" role="Started">
+      <node name="node1" id="1" cached="false"/>
+    </resource>
+  </resources>
+</crm_mon>
+'''
+
+
+class FakeNode():
+    '''Stands in for a SosNode with a set of enabled plugins'''
+
+    local = False
+
+    def __init__(self, address, enabled):
+        self.address = address
+        self.enabled = enabled
+
+    def _check_enabled(self, plugin):
+        return plugin in self.enabled
+
+
+class ClusterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Configuration({})
+
+    def _cluster(self, cls, stdout, options=None):
+        if options:
+            self.config['cluster_options'] = options
+            self.config.parse_cluster_options()
+        cluster = cls(self.config)
+        cluster.master = FakeMaster(stdout)
+        return cluster
+
+    def test_kubernetes_nodes(self):
+        kube = self._cluster(kubernetes, json.dumps(KUBE_NODES))
+        self.assertEqual(sorted(kube._get_nodes()),
+                         ['infra1', 'master1', 'worker1'])
+        self.assertEqual(kube.master.cmds, ['kubectl get nodes -o json'])
+        self.assertEqual(kube.get_node_attrs('worker1')['roles'], ['worker'])
+        self.assertFalse(kube.get_node_attrs('worker1')['online'])
+        self.assertIsNone(kube.get_node_attrs('infra1')['online'])
+
+    def test_node_domain(self):
+        kube = self._cluster(kubernetes, json.dumps(KUBE_NODES))
+        kube._get_nodes()
+        self.assertIsNone(kube.get_node_domain('master1'))
+        self.config['domain_key'] = 'rack'
+        self.assertEqual(kube.get_node_domain('master1'), 'east-1a')
+        self.config['domain_key'] = 'role'
+        self.assertEqual(kube.get_node_domain('worker1'), 'worker')
+        self.config['domain_key'] = 'label.topology.kubernetes.io/zone'
+        self.assertEqual(kube.get_node_domain('master1'), 'east-1a')
+
+    def test_kubernetes_role_filters(self):
+        kube = self._cluster(kubernetes, json.dumps(KUBE_NODES),
+                             ['kubernetes.role=worker'])
+        kube._get_nodes()
+        self.assertEqual(kube.master.cmds,
+                         ["kubectl get nodes -o json -l "
+                          "node-role.kubernetes.io/worker"])
+        kube = self._cluster(kubernetes, json.dumps(KUBE_NODES),
+                             ['kubernetes.role=worker,master'])
+        self.assertEqual(sorted(kube._get_nodes()), ['master1', 'worker1'])
+
+    def test_pacemaker_nodes(self):
+        pcmk = self._cluster(pacemaker, CRM_MON)
+        self.assertEqual(sorted(pcmk._get_nodes()), ['node1', 'node2'])
+        self.assertTrue(pcmk.get_node_attrs('node1')['online'])
+        self.assertFalse(pcmk.get_node_attrs('node2')['online'])
+
+    def test_pacemaker_offline_option(self):
+        pcmk = self._cluster(pacemaker, CRM_MON)
+        for opt in pcmk.options:
+            if opt.name == 'offline':
+                opt.value = False
+        self.assertEqual(pcmk._get_nodes(), ['node1'])
+
+    def test_ovirt_nodes(self):
+        out = ('host1.example.com|3|Default|dc1\r\n'
+               'host2.example.com|4|Default|dc1\r\n')
+        engine = self._cluster(ovirt, out)
+        engine.format_db_cmd()
+        self.assertEqual(sorted(engine._get_nodes()),
+                         ['host1.example.com', 'host2.example.com'])
+        attrs = engine.get_node_attrs('host2.example.com')
+        self.assertEqual(attrs['status'], 'non-responsive')
+        self.assertFalse(attrs['online'])
+        self.assertEqual(attrs['datacenter'], 'dc1')
+
+    def test_kubernetes_scoped_options(self):
+        kube = self._cluster(kubernetes, '')
+        kube.modify_sos_cmd()
+        self.assertEqual(kube.get_scoped_plugins(), [])
+        self.assertEqual(kube.get_scoped_options(), ['kubernetes.all=on'])
+        worker = FakeNode('worker1', [])
+        master = FakeNode('master2', ['kubernetes'])
+        self.assertEqual(kube.designate_scoped_node([worker, master]),
+                         master)
+        kube.master = worker
+        self.assertEqual(kube.designate_scoped_node([worker, master]),
+                         worker)
+
+    def test_no_cluster_scoping(self):
+        # with --master and no profile detected there is no cluster
+        sc = SosCollector.__new__(SosCollector)
+        sc.config = self.config
+        sc.config['cluster'] = None
+        sc.client_list = [FakeNode('node1', [])]
+        sc._designate_scoped_node()
+        self.assertFalse(sc.config['scoped_node'])
+
+    def test_user_options_not_scoped(self):
+        self.config['plugin_options'] = ['kubernetes.all=off']
+        kube = self._cluster(kubernetes, '')
+        kube.modify_sos_cmd()
+        self.assertEqual(kube.get_scoped_options(), [])
+        self.config['enable_plugins'] = ['pacemaker']
+        pcmk = self._cluster(pacemaker, '')
+        pcmk.cluster_scoped_plugins = ['pacemaker']
+        pcmk.modify_sos_cmd()
+        self.assertEqual(pcmk.get_scoped_plugins(), [])
+
+    def test_satellite_nodes(self):
+        out = ('could not change directory to "/root": Permission denied\r\n'
+               'capsule1.example.com\r\ncapsule2.example.com\r\n')
+        sat = self._cluster(satellite, out)
+        self.assertEqual(sorted(sat._get_nodes()),
+                         ['capsule1.example.com', 'capsule2.example.com'])
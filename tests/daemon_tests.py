@@ -0,0 +1,134 @@
+import json
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import unittest
+
+from soscollector.configuration import Configuration
+from soscollector.daemon import (CollectorDaemon, FactCache, daemon_available,
+                                 default_daemon_socket, prepare_job_options,
+                                 send_request)
+from soscollector.hosts.redhat import RedHatHost
+from soscollector.sosnode import SosNode
+
+
+class CachedNode(SosNode):
+    '''SosNode that only exercises the fact cache'''
+
+    def __init__(self, config, address):
+        self.config = config
+        self.address = address
+        self.local = False
+        self.connected = True
+        self.resources = None
+
+
+class FactCacheTests(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = FactCache()
+        self.assertEqual(cache.get('node1'), None)
+        facts = {'hostname': 'node1', 'sos_info': {'enabled': ['kernel']}}
+        cache.set('node1', facts)
+        cached = cache.get('node1')
+        self.assertEqual(cached, facts)
+        # callers get their own copy to modify
+        cached['sos_info']['enabled'].append('foo')
+        self.assertEqual(cache.get('node1')['sos_info']['enabled'],
+                         ['kernel'])
+
+    def test_expiry(self):
+        cache = FactCache(ttl=-1)
+        cache.set('node1', {'hostname': 'node1'})
+        self.assertEqual(cache.get('node1'), None)
+        self.assertEqual(cache.facts, {})
+
+    def test_node_facts(self):
+        config = Configuration({})
+        config['fact_cache'] = FactCache()
+        node = CachedNode(config, 'node1')
+        node.host = RedHatHost('node1')
+        node.host._check_enabled('Red Hat Enterprise Linux release 8.1')
+        node.hostname = 'node1.example.com'
+        node.sos_info = {'version': '3.8', 'enabled': ('kernel',)}
+        node._cache_facts()
+        other = CachedNode(config, 'node1')
+        self.assertTrue(other._load_cached_facts())
+        self.assertEqual(other.host.release,
+                         'Red Hat Enterprise Linux release 8.1')
+        self.assertEqual(other.sos_info['enabled'], ('kernel',))
+        # another user or port is another connection, with its own facts
+        config['ssh_port'] = 2222
+        self.assertFalse(CachedNode(config, 'node1')._load_cached_facts())
+
+
+class DaemonTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sock = os.path.join(self.tmpdir, 'daemon.sock')
+        self.daemon = CollectorDaemon(self.sock,
+                                      os.path.join(self.tmpdir, 'sockets'))
+        self.daemon.bind()
+        self.thread = threading.Thread(target=self.daemon.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def test_ping(self):
+        self.assertTrue(daemon_available(self.sock))
+        self.assertFalse(daemon_available(self.sock + '.missing'))
+        self.assertEqual(stat.S_IMODE(os.stat(self.sock).st_mode), 0o600)
+
+    def test_invalid_request(self):
+        res = send_request(self.sock, {'action': 'foo'})
+        self.assertEqual(res['status'], 1)
+
+    def test_already_running(self):
+        other = CollectorDaemon(self.sock, self.daemon.control_dir)
+        self.assertRaises(OSError, other.bind)
+
+    def test_stale_socket_replaced(self):
+        path = os.path.join(self.tmpdir, 'stale.sock')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        other = CollectorDaemon(path, self.daemon.control_dir)
+        other.bind()
+        other.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_socket_in_control_dir(self):
+        cdir = os.path.join(self.tmpdir, 'other-sockets')
+        other = CollectorDaemon(control_dir=cdir)
+        self.assertEqual(other.socket_path, default_daemon_socket(cdir))
+        other.bind()
+        try:
+            self.assertTrue(os.path.exists(os.path.join(cdir, 'daemon.sock')))
+        finally:
+            other.close()
+
+    def test_shutdown_removes_socket(self):
+        res = send_request(self.sock, {'action': 'shutdown'})
+        self.assertEqual(res['status'], 0)
+        self.thread.join()
+        self.assertFalse(os.path.exists(self.sock))
+
+
+class JobOptionsTests(unittest.TestCase):
+
+    def test_paths_made_absolute(self):
+        opts = prepare_job_options({'ssh_key': 'id_rsa', 'tmp_dir': None})
+        self.assertEqual(opts['ssh_key'], os.path.abspath('id_rsa'))
+        self.assertEqual(opts['tmp_dir'], None)
+        json.dumps(opts)
+
+
+if __name__ == "__main__":
+    unittest.main()
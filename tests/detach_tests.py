@@ -0,0 +1,171 @@
+import logging
+import threading
+import unittest
+
+from soscollector.configuration import Configuration
+from soscollector.sos_collector import SosCollector
+from soscollector.sosnode import SosNode
+
+RUN_ID = 'sos-collector-run1'
+BASE = '/var/tmp/sos-collector-%s' % RUN_ID
+ARCHIVE = '/var/tmp/sosreport-node1-2019-abcdef.tar.xz'
+
+
+class FakeHost(object):
+    sos_bin_path = '/usr/sbin/sosreport'
+    sos_path_strip = None
+    containerized = False
+
+    def set_cleanup_cmd(self):
+        return None
+
+
+class DetachNode(SosNode):
+    '''SosNode whose commands act on a fake remote filesystem'''
+
+    def __init__(self, config, address='node1', start_status=0):
+        self.config = config
+        self.address = address
+        self.host = FakeHost()
+        self.local = False
+        self.timings = {}
+        self.sos_info = {'version': '3.7'}
+        self.sos_path = None
+        self.retrieved = False
+        self.hash_retrieved = False
+        self.harvested = False
+        self.cached = False
+        self.shard_paths = []
+        self.guard_monitor = None
+        self.systemd_version = None
+        self.start_status = start_status
+        self.files = {}
+        self.commands = []
+        self.killed = False
+
+    def log_debug(self, msg):
+        pass
+
+    def log_info(self, msg):
+        pass
+
+    def log_error(self, msg):
+        pass
+
+    def finalize_sos_cmd(self):
+        self.sos_cmd = 'sosreport --batch'
+
+    def retrieve_sosreport(self):
+        return True
+
+    def run_command(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        path = cmd.split()[-1]
+        if 'nohup setsid' in cmd:
+            if self.start_status == 0:
+                self.files[BASE + '.pid'] = '4242\n'
+            return {'status': self.start_status, 'stdout': 'denied'}
+        if 'kill -TERM' in cmd:
+            self.killed = True
+            return {'status': 0, 'stdout': ''}
+        if cmd.startswith(('cat', 'stat')):
+            if path in self.files:
+                return {'status': 0, 'stdout': self.files[path]}
+            return {'status': 1, 'stdout': 'No such file'}
+        if cmd.startswith('rm -f'):
+            self.files.pop(path, None)
+        return {'status': 0, 'stdout': ''}
+
+    def finish(self, rc, output):
+        self.files[BASE + '.out'] = output
+        self.files[BASE + '.rc'] = '%s\n' % rc
+
+
+class DetachedNodeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Configuration({})
+        self.config['tmp_dir'] = '/var/tmp'
+        self.events = []
+        self.config['event_hook'] = self.events.append
+        self.node = DetachNode(self.config)
+
+    def test_start(self):
+        self.node.start_detached_sosreport(RUN_ID)
+        cmd = self.node.commands[-1]
+        self.assertTrue('/usr/sbin/sosreport --batch' in cmd)
+        for ext in ('.out', '.rc', '.pid'):
+            self.assertTrue(BASE + ext in cmd)
+        failing = DetachNode(self.config, start_status=1)
+        self.assertRaises(Exception, failing.start_detached_sosreport, RUN_ID)
+
+    def test_poll(self):
+        self.node.start_detached_sosreport(RUN_ID)
+        self.assertEqual(self.node.check_detached_sosreport(RUN_ID), None)
+        self.node.finish(0, 'Your sosreport has been generated:\n')
+        self.assertEqual(self.node.check_detached_sosreport(RUN_ID), 0)
+
+    def test_harvest(self):
+        self.node.start_detached_sosreport(RUN_ID)
+        self.node.finish(0, 'Your sosreport has been generated and saved '
+                            'in:\n  %s\n' % ARCHIVE)
+        self.node.harvest_detached_sosreport(RUN_ID, 0)
+        self.assertTrue(self.node.retrieved)
+        self.assertEqual(self.node.files, {})
+        self.assertEqual(self.events[-1]['event'], 'report')
+
+    def test_harvest_failed(self):
+        self.node.start_detached_sosreport(RUN_ID)
+        self.node.finish(1, 'sosreport failed\n')
+        self.node.harvest_detached_sosreport(RUN_ID, 1)
+        self.assertFalse(self.node.retrieved)
+        self.assertEqual(self.node.files, {})
+        self.assertEqual(self.events[-1]['event'], 'failed')
+
+    def test_abort(self):
+        self.node.start_detached_sosreport(RUN_ID)
+        self.node.files[BASE + '.out'] = 'partial output'
+        self.node.abort_detached_sosreport(RUN_ID, 'timeout')
+        self.assertTrue(self.node.killed)
+        self.assertTrue(BASE + '.pid' in [c for c in self.node.commands
+                                          if 'kill' in c][0])
+        self.assertEqual(self.node.files, {})
+        self.assertEqual(self.events[-1]['event'], 'failed')
+        self.assertEqual(self.events[-1]['error'], 'timeout')
+
+
+class DetachedCollectionTests(unittest.TestCase):
+
+    def setUp(self):
+        # the collector is not initialized, as that would set up a run
+        self.sc = SosCollector.__new__(SosCollector)
+        self.sc.config = Configuration({})
+        self.sc.config['tmp_dir'] = '/var/tmp/' + RUN_ID
+        self.sc.config['poll_interval'] = 0
+        self.sc.logger = logging.getLogger('sos_collector')
+        self.sc.console = logging.getLogger('sos_collector_console')
+        self.sc._lock = threading.Lock()
+        self.sc.retrieved = 0
+
+    def _collect(self, nodes):
+        for node in nodes:
+            node.get_domain = lambda: None
+        self.sc.client_list = nodes
+        self.sc._collect_detached(None)
+
+    def test_collect_and_timeout(self):
+        # node1 has finished by the first poll, node2 never finishes
+        done = DetachNode(self.sc.config, 'node1')
+        done.finish(0, '  %s\n' % ARCHIVE)
+        hung = DetachNode(self.sc.config, 'node2')
+        self.sc.config['timeout'] = 0
+        self._collect([done, hung])
+        self.assertTrue(done.retrieved)
+        self.assertFalse(done.killed)
+        self.assertTrue(hung.killed)
+        self.assertEqual(hung.files, {})
+        self.assertEqual(self.sc.retrieved, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from soscollector.configuration import Configuration
+from soscollector.fdbudget import (FdBudget, child_slot, raise_nofile_limit,
+                                   RESERVED_FDS, FDS_PER_CHILD)
+from soscollector.sosnode import SosNode
+from soscollector.sshpool import (control_socket_name, control_path_fits,
+                                  SOCKET_PATH_MAX, SOCKET_TEMP_SUFFIX)
+
+NODES = ['node%04d.rack%02d.datacenter-east.production.example.com'
+         % (i, i % 40) for i in range(2000)]
+
+
+class FdBudgetTests(unittest.TestCase):
+
+    def test_slots(self):
+        budget = FdBudget(RESERVED_FDS + FDS_PER_CHILD * 25)
+        self.assertEqual(budget.slots, 25)
+        self.assertEqual(FdBudget(16).slots, 1)
+
+    def test_raise_nofile_limit(self):
+        limit = raise_nofile_limit()
+        if limit is not None:
+            self.assertTrue(limit >= RESERVED_FDS)
+
+    def test_simulated_nodes(self):
+        budget = FdBudget(RESERVED_FDS + FDS_PER_CHILD * 25)
+        lock = threading.Lock()
+        done = []
+
+        def collect(node):
+            # connect, run sosreport and retrieve the archive
+            for _ in range(3):
+                with child_slot(budget):
+                    rfd, wfd = os.pipe()
+                    time.sleep(0.0005)
+                    os.close(rfd)
+                    os.close(wfd)
+            with lock:
+                done.append(node)
+
+        pool = ThreadPoolExecutor(200)
+        list(pool.map(collect, NODES))
+        pool.shutdown(wait=True)
+        self.assertEqual(len(done), 2000)
+        self.assertEqual(budget.in_flight, 0)
+        self.assertTrue(budget.peak <= 25)
+        self.assertTrue(budget.waits > 0)
+
+    def test_commands_above_fd_setsize(self):
+        limit = raise_nofile_limit()
+        if limit is not None and limit < 1200:
+            self.skipTest('open file limit of %s is too low' % limit)
+        config = Configuration({})
+        config['tmp_dir'] = '/var/tmp'
+        config['fd_budget'] = FdBudget(limit or 65536)
+        node = SosNode('localhost', config, load_facts=False)
+        fds = []
+        try:
+            while not fds or fds[-1] < 1100:
+                fds.extend(os.pipe())
+            res = node.run_command('echo sos-collector')
+        finally:
+            for fd in fds:
+                os.close(fd)
+        self.assertEqual(res['status'], 0)
+        self.assertEqual(res['stdout'].strip(), 'sos-collector')
+
+    def test_no_budget(self):
+        with child_slot(None):
+            pass
+
+
+class ControlPathTests(unittest.TestCase):
+
+    def test_unique_names(self):
+        names = set(control_socket_name('root', n, 22) for n in NODES)
+        self.assertEqual(len(names), 2000)
+        self.assertEqual(len(set(len(n) for n in names)), 1)
+        self.assertNotEqual(control_socket_name('root', NODES[0], 22),
+                            control_socket_name('root', NODES[0], 2222))
+
+    def test_path_fits(self):
+        sdir = '/var/tmp/sos-collector-sockets-%s' % os.getuid()
+        self.assertTrue(control_path_fits(sdir))
+        for node in NODES:
+            path = os.path.join(sdir, control_socket_name('root', node, 22))
+            self.assertTrue(len(path) + SOCKET_TEMP_SUFFIX <= SOCKET_PATH_MAX)
+        self.assertFalse(control_path_fits('/var/tmp/' + 'x' * 80))
+
+
+if __name__ == "__main__":
+    unittest.main()
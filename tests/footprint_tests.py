@@ -0,0 +1,49 @@
+import unittest
+
+from soscollector.configuration import Configuration
+from soscollector.sosnode import SosNode, share_sos_info
+
+PLUGINS = ['plugin%03d' % i for i in range(300)]
+
+
+def sos_info(version='3.7', enabled=None):
+    return {'version': version, 'enabled': list(enabled or PLUGINS[:200]),
+            'disabled': list(PLUGINS[200:]),
+            'options': ['%s.all' % p for p in PLUGINS], 'presets': ['none']}
+
+
+class FootprintTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Configuration({})
+        self.config['tmp_dir'] = '/var/tmp'
+
+    def test_shared_lists(self):
+        infos = [share_sos_info(sos_info(), self.config['sos_lists'])
+                 for _ in range(10000)]
+        for key in ('enabled', 'disabled', 'options', 'presets'):
+            self.assertEqual(len(set(id(i[key]) for i in infos)), 1)
+        self.assertEqual(infos[0]['enabled'], tuple(PLUGINS[:200]))
+
+    def test_shared_names(self):
+        table = self.config['sos_lists']
+        first = share_sos_info(sos_info(), table)
+        other = share_sos_info(sos_info(enabled=PLUGINS[:100]), table)
+        self.assertFalse(first['enabled'] is other['enabled'])
+        self.assertTrue(first['enabled'][0] is other['enabled'][0])
+        newer = share_sos_info(sos_info(version='3.8'), table)
+        self.assertEqual(newer['enabled'], first['enabled'])
+        self.assertEqual(sorted(table), ['3.7', '3.8'])
+
+    def test_compact_node(self):
+        node = SosNode('127.0.0.1', self.config, load_facts=False)
+        self.assertFalse(hasattr(node, '__dict__'))
+        node.sos_info = share_sos_info(sos_info(), self.config['sos_lists'])
+        node.sos_cmd = 'sosreport --batch'
+        node.release_state()
+        self.assertEqual(node.sos_info, {'version': '3.7'})
+        self.assertEqual(node.sos_cmd, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import threading
+import time
+import unittest
+
+from soscollector.configuration import Configuration
+from soscollector.guardrails import (Guardrail, parse_pressure,
+                                     parse_systemd_version, throttle_command)
+from soscollector.sosnode import SosNode
+
+PRESSURE = '''4\r
+6.20 3.01 2.50 3/812 9911\r
+some avg10=12.50 avg60=8.00 avg300=2.11 total=123456\r
+some avg10=41.07 avg60=20.00 avg300=5.00 total=654321\r
+full avg10=30.00 avg60=10.00 avg300=1.00 total=111111\r
+'''
+
+
+class FakeHost(object):
+    sos_bin_path = '/usr/sbin/sosreport'
+    containerized = False
+
+
+class ThrottleNode(SosNode):
+    '''Local SosNode that records the sosreport command it would run'''
+
+    def _format_cmd(self, cmd):
+        self.cmds.append(cmd)
+        return 'true'
+
+
+class GuardrailTests(unittest.TestCase):
+
+    def test_throttle_command(self):
+        self.assertEqual(throttle_command('sos', 'nice'),
+                         'nice -n 19 ionice -c 2 -n 7 sos')
+        self.assertIn('CPUShares', throttle_command('sos', 'systemd', 219))
+        self.assertIn('CPUWeight', throttle_command('sos', 'systemd', 239))
+        self.assertEqual(throttle_command('sos', None), 'sos')
+        self.assertEqual(parse_systemd_version('systemd 219\n+PAM'), 219)
+
+    def test_throttle_labelled_sos_cmd(self):
+        config = Configuration({})
+        config['tmp_dir'] = '/var/tmp'
+        config['throttle'] = 'nice'
+        node = ThrottleNode('localhost', config, load_facts=False)
+        node.host = FakeHost()
+        node.cmds = []
+        # a label used to leave the sos command with a leading space
+        node.run_command(' sosreport --batch --label=mylabel')
+        self.assertEqual(node.cmds, ['nice -n 19 ionice -c 2 -n 7 '
+                                     '/usr/sbin/sosreport --batch '
+                                     '--label=mylabel'])
+
+    def test_parse_pressure(self):
+        sample = parse_pressure(PRESSURE)
+        self.assertEqual(sample, {'load': 1.55, 'cpu': 12.5, 'io': 41.07})
+        self.assertEqual(parse_pressure('2\n0.50 0.40 0.30 1/99 100\n'),
+                         {'load': 0.25, 'cpu': None, 'io': None})
+
+    def test_thresholds(self):
+        guard = Guardrail(max_load=1.5)
+        self.assertTrue(guard.over_threshold(parse_pressure(PRESSURE)))
+        guard = Guardrail(max_pressure=50)
+        self.assertFalse(guard.over_threshold(parse_pressure(PRESSURE)))
+
+    def test_domain_hold(self):
+        guard = Guardrail(max_load=1.0, hold_timeout=5, interval=0.05)
+        guard.update('dc1', 'node1', True)
+        self.assertTrue(guard.is_held('dc1', 'node2'))
+        self.assertFalse(guard.is_held('dc1', 'node1'))
+        self.assertFalse(guard.is_held('dc2', 'node3'))
+
+        timer = threading.Timer(0.2, guard.update, ('dc1', 'node1', False))
+        timer.start()
+        start = time.time()
+        guard.wait('dc1', 'node2', lambda: {'load': 0.1, 'cpu': None,
+                                            'io': None})
+        self.assertTrue(time.time() - start >= 0.15)
+        self.assertFalse(guard.is_held('dc1'))
+
+    def test_hold_timeout(self):
+        guard = Guardrail(max_load=1.0, hold_timeout=0.1, interval=0.02)
+        waited = guard.wait(None, 'node1', lambda: {'load': 3.0, 'cpu': None,
+                                                    'io': None})
+        self.assertTrue(waited >= 0.1)
+        self.assertFalse(guard.is_held(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
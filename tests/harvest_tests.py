@@ -0,0 +1,33 @@
+import unittest
+
+from soscollector.sosnode import select_sosreport
+
+LISTING = '''1546300800.0 /var/tmp/sosreport-node1-2019-01-01-abcde.tar.xz\r
+1546387200.0 /var/tmp/sosreport-node1-12345-2019-01-02-fghij.tar.xz\r
+1546387300.0 /var/tmp/sosreport-node1-12345-2019-01-02-fghij.tar.xz.md5\r
+1546300900.0 /tmp/sosreport-node1-mylabel-12345-2019-01-01-klmno.tar.xz\r
+find: '/tmp/private': Permission denied\r
+'''
+
+
+class HarvestTests(unittest.TestCase):
+
+    def test_newest(self):
+        self.assertEqual(
+            select_sosreport(LISTING),
+            '/var/tmp/sosreport-node1-12345-2019-01-02-fghij.tar.xz'
+        )
+
+    def test_case_id_and_label(self):
+        self.assertEqual(
+            select_sosreport(LISTING, case_id='12345', label='mylabel'),
+            '/tmp/sosreport-node1-mylabel-12345-2019-01-01-klmno.tar.xz'
+        )
+        self.assertIsNone(select_sosreport(LISTING, case_id='99999'))
+
+    def test_empty(self):
+        self.assertIsNone(select_sosreport(''))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import time
+import unittest
+
+from soscollector.exceptions import InventoryQueryException
+from soscollector.inventory import HostInventory, is_query, parse_seconds
+
+
+class InventoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.inv = HostInventory(':memory:')
+        self.inv.update_node('node1.example.com', cluster='prod',
+                             cluster_type='kubernetes', roles=['worker'],
+                             labels={'zone': 'east'}, success=True,
+                             duration=120)
+        self.inv.update_node('node2.example.com', cluster='prod',
+                             cluster_type='kubernetes', roles=['master'],
+                             labels={'zone': 'west'})
+        self.inv.update_node('node3.example.com', cluster='test',
+                             cluster_type='pacemaker', roles=['worker'],
+                             success=True, duration=600)
+        # pretend node3 was last collected from two weeks ago
+        self.inv.db.execute('UPDATE nodes SET last_success = ? WHERE '
+                            'name = ?', (time.time() - 14 * 86400,
+                                         'node3.example.com'))
+
+    def tearDown(self):
+        self.inv.close()
+
+    def test_is_query(self):
+        self.assertTrue(is_query('role=worker'))
+        self.assertTrue(is_query('last_success>7d'))
+        self.assertFalse(is_query('mygroup'))
+
+    def test_parse_seconds(self):
+        self.assertEqual(parse_seconds('90'), 90)
+        self.assertEqual(parse_seconds('30m'), 1800)
+        self.assertEqual(parse_seconds('7d'), 604800)
+        self.assertRaises(InventoryQueryException, parse_seconds, '7 days')
+
+    def test_query_role(self):
+        self.assertEqual(self.inv.query('role=worker'),
+                         ['node1.example.com', 'node3.example.com'])
+
+    def test_query_age(self):
+        self.assertEqual(self.inv.query('role=worker and last_success>7d'),
+                         ['node3.example.com'])
+        # nodes that were never collected from are always old enough
+        self.assertEqual(self.inv.query('cluster=prod,last_success>1d'),
+                         ['node2.example.com'])
+        self.assertEqual(self.inv.query('last_success<7d'),
+                         ['node1.example.com'])
+
+    def test_query_labels_and_globs(self):
+        self.assertEqual(self.inv.query('label.zone=west'),
+                         ['node2.example.com'])
+        self.assertEqual(self.inv.query('name=node[12]*,role!=master'),
+                         ['node1.example.com'])
+
+    def test_query_duration(self):
+        self.assertEqual(self.inv.query('last_duration>=5m'),
+                         ['node3.example.com'])
+
+    def test_update_preserves_success(self):
+        self.inv.update_node('node1.example.com', cluster='prod',
+                             success=False)
+        node = self.inv.get_node('node1.example.com')
+        self.assertEqual(node['last_duration'], 120)
+        self.assertEqual(node['roles'], ['worker'])
+
+    def test_invalid_query(self):
+        self.assertRaises(InventoryQueryException, self.inv.query, 'foo=bar')
+        self.assertRaises(InventoryQueryException, self.inv.query,
+                          'last_success=7d')
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from soscollector.journal import (RunJournal, JOURNAL_NAME, preserve_logs,
+                                  extract_run_archive, archive_member_path)
+
+
+class JournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.journal = RunJournal(os.path.join(self.tmpdir, JOURNAL_NAME))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _report(self, node, content=b'sosreport'):
+        path = os.path.join(self.tmpdir, 'sosreport-%s.tar.xz' % node)
+        with open(path, 'wb') as rfile:
+            rfile.write(content)
+        self.journal.record_event({'event': 'report', 'node': node,
+                                   'time': 1, 'path': path})
+        return path
+
+    def test_read_ignores_partial_line(self):
+        self.journal.record('start', version='1.7')
+        self.journal.record_event({'event': 'log', 'node': None,
+                                   'message': 'not journaled'})
+        with open(self.journal.path, 'a') as jfile:
+            jfile.write('{"event": "report", "no')
+        records = self.journal.read()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(self.journal.last_start()['version'], '1.7')
+
+    def test_completed_nodes(self):
+        self._report('node1')
+        path = self._report('node2')
+        self._report('node3')
+        self.journal.record_event({'event': 'failed', 'node': 'node3',
+                                   'error': 'timeout'})
+        self.journal.record_event({'event': 'progress', 'node': 'node4',
+                                   'stage': 'sosreport'})
+        # a report that changed since it was retrieved is collected again
+        with open(path, 'ab') as rfile:
+            rfile.write(b'corrupt')
+        self.assertEqual(self.journal.completed_nodes(), set(['node1']))
+        self.assertEqual(self.journal.node_states()['node4']['event'],
+                         'progress')
+
+    def test_completed_sharded_nodes(self):
+        shards = {}
+        for node in ('node1', 'node2', 'node3'):
+            path = os.path.join(self.tmpdir, 'sosreport-%s-shards' % node)
+            os.makedirs(path)
+            for idx in (1, 2):
+                with open(os.path.join(path, 'shard%s.tar.xz' % idx),
+                          'wb') as sfile:
+                    sfile.write(('shard %s' % idx).encode('utf-8'))
+            self.journal.record_event({'event': 'report', 'node': node,
+                                       'time': 1, 'path': path})
+            shards[node] = path
+        self.assertTrue(self.journal.node_states()['node1']['sha256'])
+        # a changed or missing shard means the node is collected again
+        with open(os.path.join(shards['node2'], 'shard2.tar.xz'),
+                  'ab') as sfile:
+            sfile.write(b'corrupt')
+        os.remove(os.path.join(shards['node3'], 'shard1.tar.xz'))
+        self.assertEqual(self.journal.completed_nodes(), set(['node1']))
+
+    def test_relay_reports_ignored(self):
+        path = os.path.join(self.tmpdir, 'sosreport-node5.tar.xz')
+        open(path, 'w').close()
+        self.journal.record_event({'event': 'report', 'node': 'relay1',
+                                   'path': path, 'relay': 'relay1'})
+        self.assertEqual(self.journal.completed_nodes(), set())
+
+    def test_preserve_logs(self):
+        open(os.path.join(self.tmpdir, 'tmpabc'), 'w').close()
+        open(os.path.join(self.tmpdir, 'ui.log'), 'w').close()
+        open(os.path.join(self.tmpdir, 'ui.1.log'), 'w').close()
+        preserve_logs(self.tmpdir, {'sos-collector.log': 'tmpabc',
+                                    'ui.log': 'tmpdef'})
+        files = sorted(os.listdir(self.tmpdir))
+        self.assertEqual(files, ['sos-collector.1.log', 'ui.1.log',
+                                 'ui.2.log'])
+
+    def test_extract_run_archive(self):
+        self._report('node1')
+        shards = os.path.join(self.tmpdir, 'sosreport-node2-shards')
+        os.makedirs(shards)
+        with open(os.path.join(shards, 'shard1.tar.xz'), 'w') as sfile:
+            sfile.write('shard1')
+        self.journal.record_event({'event': 'report', 'node': 'node2',
+                                   'time': 1, 'path': shards})
+        archive = os.path.join(self.tmpdir, 'sos-collector-test.tar.gz')
+        with tarfile.open(archive, 'w:gz') as tar:
+            for fname in (JOURNAL_NAME, 'sosreport-node1.tar.xz',
+                          'sosreport-node2-shards'):
+                tar.add(os.path.join(self.tmpdir, fname),
+                        arcname='sos-collector-test/%s' % fname)
+        dest = tempfile.mkdtemp(dir=self.tmpdir)
+        extract_run_archive(archive, dest)
+        self.assertTrue(os.path.isfile(
+            os.path.join(dest, 'sosreport-node2-shards', 'shard1.tar.xz')
+        ))
+        journal = RunJournal(os.path.join(dest, JOURNAL_NAME))
+        self.assertEqual(journal.completed_nodes(), set(['node1', 'node2']))
+
+    def test_archive_member_path(self):
+        self.assertEqual(archive_member_path('sos-collector-test/ui.log'),
+                         'ui.log')
+        self.assertEqual(
+            archive_member_path('sos-collector-test/sosreport-n1-shards/s1'),
+            os.path.join('sosreport-n1-shards', 's1')
+        )
+        for name in ('/etc/passwd', 'sos-collector-test/../../etc/passwd'):
+            self.assertRaises(ValueError, archive_member_path, name)
+
+
+if __name__ == "__main__":
+    unittest.main()
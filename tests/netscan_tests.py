@@ -0,0 +1,65 @@
+import socket
+import threading
+import time
+import unittest
+
+from soscollector import netscan
+from soscollector.netscan import resolve_nodes, scan_nodes
+
+
+class NetscanTests(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(128)
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_reachable(self):
+        self.assertEqual(scan_nodes(['127.0.0.1'], self.port, timeout=2), {})
+
+    def test_many_reachable(self):
+        nodes = ['127.0.0.%s' % i for i in range(1, 50)]
+        self.listener.close()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('0.0.0.0', 0))
+        self.listener.listen(128)
+        port = self.listener.getsockname()[1]
+        self.assertEqual(scan_nodes(nodes, port, timeout=2), {})
+
+    def test_refused(self):
+        self.listener.close()
+        failed = scan_nodes(['127.0.0.1'], self.port, timeout=2)
+        self.assertIn('127.0.0.1', failed)
+
+    def test_resolve_timeout(self):
+        release = threading.Event()
+        real_resolve = netscan._resolve
+
+        def slow_resolve(node, port):
+            if node == 'slow':
+                release.wait(10)
+            return real_resolve('127.0.0.1', port)
+
+        netscan._resolve = slow_resolve
+        try:
+            start = time.time()
+            resolved, failed = resolve_nodes(['slow', 'fast'], self.port, 0.5)
+            self.assertTrue(time.time() - start < 5)
+            self.assertEqual(list(resolved), ['fast'])
+            self.assertEqual(failed, {'slow': 'timeout resolving hostname'})
+            # the lookup still running must not block the exit of the process
+            lookups = [t for t in threading.enumerate()
+                       if t is not threading.current_thread() and
+                       t.is_alive() and not t.daemon]
+            self.assertEqual(lookups, [])
+        finally:
+            release.set()
+            netscan._resolve = real_resolve
+
+    def test_unresolvable(self):
+        failed = scan_nodes(['node.invalid'], self.port, timeout=2)
+        self.assertIn('node.invalid', failed)
@@ -0,0 +1,73 @@
+import logging
+import threading
+import unittest
+
+from soscollector import sos_collector
+from soscollector.clusters import Cluster
+from soscollector.configuration import Configuration
+from soscollector.sos_collector import SosCollector
+
+
+class FakeNode(object):
+    '''Stands in for a SosNode, recording the timeout it connected with'''
+
+    attempts = []
+
+    def __init__(self, address, config, password=None, connect_timeout=15):
+        self.attempts.append((address, connect_timeout))
+        self.address = address
+        self.hostname = address
+        self.host = None
+        self.sos_info = {'version': '3.9'}
+        self.timings = {'connect': 0.1}
+        if address.startswith('down'):
+            raise Exception('Timeout exceeded')
+        self.connected = True
+
+
+class OfflineNodeTests(unittest.TestCase):
+
+    def setUp(self):
+        # the collector is not initialized, as that would set up a run
+        self.sc = SosCollector.__new__(SosCollector)
+        self.sc.config = Configuration({})
+        self.sc.config['offline_timeout'] = 2
+        self.sc.logger = logging.getLogger('sos_collector')
+        self.sc.console = logging.getLogger('sos_collector_console')
+        self.sc._lock = threading.Lock()
+        self.sc.client_list = []
+        self.sc.controllers = {}
+        self.events = []
+        self.sc.config['event_hook'] = self.events.append
+        cluster = Cluster(self.sc.config)
+        cluster.add_node('node1', online=True)
+        cluster.add_node('down1', online=False)
+        cluster.add_node('node2')
+        cluster.add_node('down2', online=False)
+        self.sc.config['cluster'] = cluster
+        self._sosnode = sos_collector.SosNode
+        sos_collector.SosNode = FakeNode
+        FakeNode.attempts = []
+
+    def tearDown(self):
+        sos_collector.SosNode = self._sosnode
+
+    def test_offline_last(self):
+        nodes = ['down1', 'node1', 'down2', 'node2', 'node3']
+        self.assertEqual(self.sc._offline_last(nodes),
+                         ['node1', 'node2', 'node3', 'down1', 'down2'])
+
+    def test_offline_timeout(self):
+        for node in ('node1', 'down1', 'node2'):
+            self.sc._connect_to_node((node, None))
+        self.assertEqual(FakeNode.attempts,
+                         [('node1', 15), ('down1', 2), ('node2', 15)])
+        self.assertEqual([c.address for c in self.sc.client_list],
+                         ['node1', 'node2'])
+        failed = [e['node'] for e in self.events
+                  if e['event'] == 'connect_failed']
+        self.assertEqual(failed, ['down1'])
+
+
+if __name__ == "__main__":
+    unittest.main()
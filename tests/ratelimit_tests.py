@@ -0,0 +1,123 @@
+import logging
+import time
+import unittest
+
+from soscollector import sosnode
+from soscollector.configuration import Configuration
+from soscollector.exceptions import ConnectionRejectedException
+from soscollector.ratelimit import TokenBucket, ConnectionLimiter
+from soscollector.sos_collector import SosCollector
+from soscollector.sosnode import SosNode
+
+
+class RejectedNode(SosNode):
+    '''SosNode behind a jump host whose first connection is rejected'''
+
+    def __init__(self, config):
+        self.config = config
+        self.address = 'node1'
+        self.jump_host = 'jump'
+        self.attempts = 0
+
+    def log_debug(self, msg):
+        pass
+
+    def _open_ssh_session(self):
+        self.attempts += 1
+        if self.attempts == 1:
+            raise ConnectionRejectedException(self.address)
+        return True
+
+
+class RateLimitTests(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=20, burst=5)
+        start = time.time()
+        for i in range(5):
+            bucket.acquire()
+        self.assertLess(time.time() - start, 0.1)
+        for i in range(4):
+            bucket.acquire()
+        # the 4 acquisitions after the burst need roughly 4/20 seconds
+        self.assertGreaterEqual(time.time() - start, 0.15)
+
+    def test_invalid_rate(self):
+        self.assertRaises(ValueError, TokenBucket, 0)
+        self.assertRaises(ValueError, TokenBucket, -1)
+        # the collector refuses the option before any bucket is made
+        sc = SosCollector.__new__(SosCollector)
+        sc.config = Configuration({})
+        sc.config['ssh_rate'] = 0
+        sc.logger = logging.getLogger('sos_collector')
+        sc.console = logging.getLogger('sos_collector_console')
+        sc.client_list = []
+        sc.jump = None
+        self.assertRaises(SystemExit, sc._parse_options)
+
+    def test_backoff_releases_slot(self):
+        config = Configuration({})
+        config['conn_limiter'] = ConnectionLimiter(rate=100)
+        config['conn_limiter'].set_concurrency('jump', 1)
+        node = RejectedNode(config)
+        free = []
+
+        class BackoffClock(object):
+            '''Stands in for the time module used by sosnode'''
+
+            time = staticmethod(time.time)
+
+            @staticmethod
+            def sleep(delay):
+                # another session through the jump host may start meanwhile
+                slot = config['conn_limiter'].slots['jump']
+                free.append(slot.acquire(False))
+                if free[-1]:
+                    slot.release()
+
+        sosnode.time = BackoffClock
+        try:
+            self.assertTrue(node._create_ssh_session())
+        finally:
+            sosnode.time = time
+        self.assertEqual(node.attempts, 2)
+        self.assertEqual(free, [True])
+
+    def test_throttle_and_recover(self):
+        bucket = TokenBucket(rate=10)
+        bucket.throttle()
+        self.assertEqual(bucket.rate, 5)
+        bucket.throttle()
+        self.assertEqual(bucket.rate, 2.5)
+        for i in range(20):
+            bucket.recover()
+        self.assertEqual(bucket.rate, 10)
+
+    def test_throttle_floor(self):
+        bucket = TokenBucket(rate=1, min_rate=0.5)
+        for i in range(5):
+            bucket.throttle()
+        self.assertEqual(bucket.rate, 0.5)
+
+    def test_limiter_keys(self):
+        limiter = ConnectionLimiter(rate=10)
+        limiter.acquire('node1', None)
+        limiter.acquire('node2', 'jump')
+        self.assertEqual(sorted(limiter.buckets), ['jump', 'node1', 'node2'])
+        limiter.throttle('node1', 'jump')
+        self.assertEqual(limiter.buckets['node1'].rate, 5)
+        self.assertEqual(limiter.buckets['node2'].rate, 10)
+        self.assertEqual(limiter.buckets['jump'].rate, 5)
+
+    def test_limiter_slots(self):
+        limiter = ConnectionLimiter(rate=10)
+        limiter.set_concurrency('jump', 1)
+        limiter.acquire_slot('jump')
+        self.assertFalse(limiter.slots['jump'].acquire(False))
+        limiter.release_slot('jump')
+        self.assertTrue(limiter.slots['jump'].acquire(False))
+        limiter.release_slot('jump')
+        # hosts without a concurrency limit, or no jump host, never block
+        limiter.acquire_slot('node1')
+        limiter.acquire_slot(None)
+        limiter.release_slot(None)
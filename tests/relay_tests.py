@@ -0,0 +1,204 @@
+import io
+import json
+import logging
+import os
+import shlex
+import shutil
+import stat
+import tarfile
+import tempfile
+import threading
+import unittest
+
+from soscollector import relay
+from soscollector.configuration import Configuration
+from soscollector.relay import (parse_relays, shard_nodes, build_relay_cmd,
+                                find_relay_archive, merge_relay_archive)
+from soscollector.sos_collector import SosCollector
+
+
+def make_relay_archive(directory, extra=None):
+    '''Build an archive laid out the same as a sub-collector's, with any
+    extra members given as {name: data}'''
+    path = os.path.join(directory, 'sos-collector-2019-01-01-abcde.tar.gz')
+    members = {
+        'sosreport-node1-2019-01-01-xyz.tar.xz': b'node1',
+        'sosreport-node1-2019-01-01-xyz.tar.xz.md5': b'abc',
+        'sos-collector.log': b'log',
+        'ui.log': b'ui',
+        'timings.json': json.dumps(
+            {'nodes': {'node1': {'total': 10}}}).encode('utf-8')
+    }
+    members.update(extra or {})
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo('sos-collector-2019-01-01-abcde/%s'
+                                   % name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+class RelayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_relays(self):
+        relays = parse_relays(['site1=*.site1.com,site2', 'site3'])
+        self.assertEqual(relays, [('site1', '*.site1.com'), ('site2', None),
+                                  ('site3', None)])
+
+    def test_shard_nodes_patterns(self):
+        relays = [('r1', '*.site1.com'), ('r2', '*.site2.com')]
+        nodes = ['a.site1.com', 'b.site2.com', 'c.site3.com']
+        shards, direct = shard_nodes(nodes, relays)
+        self.assertEqual(shards, {'r1': ['a.site1.com'],
+                                  'r2': ['b.site2.com']})
+        self.assertEqual(direct, ['c.site3.com'])
+
+    def test_shard_nodes_round_robin(self):
+        relays = [('localhost', None), ('127.0.0.1', None)]
+        nodes = ['node%s' % i for i in range(10)]
+        shards, direct = shard_nodes(nodes, relays)
+        self.assertEqual(direct, [])
+        self.assertEqual(len(shards['localhost']), 5)
+        self.assertEqual(len(shards['127.0.0.1']), 5)
+        self.assertEqual(sorted(shards['localhost'] + shards['127.0.0.1']),
+                         sorted(nodes))
+
+    def test_build_relay_cmd(self):
+        config = Configuration({'enable_plugins': 'foo,bar',
+                                'case_id': '12345'})
+        cmd = build_relay_cmd(config, ['node1', 'node2'])
+        self.assertTrue(cmd.startswith('sos-collector --batch '
+                                       '--cluster-type=none '
+                                       '--nodes=node1,node2 --no-local'))
+        self.assertIn('--case-id=12345', cmd)
+        self.assertIn('--enable-plugins=foo,bar', cmd)
+        cmd = build_relay_cmd(config, ['node1'], collect_local=True)
+        self.assertNotIn('--no-local', cmd)
+
+    def test_build_relay_cmd_sos_opt_line(self):
+        opt_line = '--all-logs -k foo.bar=$(touch x)'
+        config = Configuration({'sos_opt_line': opt_line})
+        args = shlex.split(build_relay_cmd(config, ['node1']))
+        self.assertIn('--sos-cmd=%s' % opt_line, args)
+        # also when set on the configuration without being quoted
+        config['sos_opt_line'] = '--all-logs `id`'
+        args = shlex.split(build_relay_cmd(config, ['node1']))
+        self.assertIn('--sos-cmd=--all-logs `id`', args)
+
+    def test_find_relay_archive(self):
+        out = ('The following archive has been created.\r\n'
+               '    /var/tmp/sos-collector-2019-01-01-abcde.tar.gz\r\n')
+        self.assertEqual(find_relay_archive(out),
+                         '/var/tmp/sos-collector-2019-01-01-abcde.tar.gz')
+        self.assertIsNone(find_relay_archive('Aborting...'))
+
+    def test_merge_relay_archive(self):
+        archive = make_relay_archive(self.tmpdir, {
+            'journal.jsonl': b'{"event": "start"}\n',
+            'sosreport-node2-shards/sosreport-node2-1.tar.xz': b'shard1',
+            'sosreport-node2-shards/sosreport-node2-2.tar.xz': b'shard2'
+        })
+        dest = os.path.join(self.tmpdir, 'dest')
+        os.mkdir(dest)
+        with open(os.path.join(dest, 'journal.jsonl'), 'w') as jfile:
+            jfile.write('top level\n')
+        reports, timings = merge_relay_archive(archive, dest, 'relay1')
+        self.assertEqual(sorted(reports), [
+            'sosreport-node1-2019-01-01-xyz.tar.xz',
+            'sosreport-node2-shards'
+        ])
+        self.assertEqual(timings, {'nodes': {'node1': {'total': 10}}})
+        self.assertEqual(sorted(os.listdir(dest)), [
+            'journal.jsonl',
+            'sos-collector-relay1.log',
+            'sosreport-node1-2019-01-01-xyz.tar.xz',
+            'sosreport-node1-2019-01-01-xyz.tar.xz.md5',
+            'sosreport-node2-shards',
+            'ui-relay1.log'
+        ])
+        # the journal of this collection is not replaced by the relay's
+        with open(os.path.join(dest, 'journal.jsonl')) as jfile:
+            self.assertEqual(jfile.read(), 'top level\n')
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(dest, 'sosreport-node2-shards'))),
+            ['sosreport-node2-1.tar.xz', 'sosreport-node2-2.tar.xz']
+        )
+
+
+class RelayCollectionTests(unittest.TestCase):
+    '''Runs _collect_relay() end to end against localhost, with a script in
+    place of the sub-collector that reports a prepared archive'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.archive = make_relay_archive(self.tmpdir)
+        self.script = os.path.join(self.tmpdir, 'sub-collector')
+        self._relay_cmd = relay.RELAY_CMD
+        relay.RELAY_CMD = self.script
+        # the collector is not initialized, as that would set up a run
+        self.sc = SosCollector.__new__(SosCollector)
+        self.sc.config = Configuration({})
+        self.sc.config['tmp_dir'] = os.path.join(self.tmpdir, 'run')
+        os.mkdir(self.sc.config['tmp_dir'])
+        self.sc.logger = logging.getLogger('sos_collector')
+        self.sc.console = logging.getLogger('sos_collector_console')
+        self.sc._lock = threading.Lock()
+        self.sc.retrieved = 0
+        self.sc.relay_timings = {}
+        self.events = []
+        self.sc.config['event_hook'] = self.events.append
+
+    def tearDown(self):
+        relay.RELAY_CMD = self._relay_cmd
+        shutil.rmtree(self.tmpdir)
+
+    def _write_script(self, status):
+        with open(self.script, 'w') as sfile:
+            sfile.write('#!/bin/sh\n'
+                        'echo "$@" > %s.args\n'
+                        'echo "The following archive has been created."\n'
+                        'echo "    %s"\n'
+                        'exit %s\n' % (self.script, self.archive, status))
+        os.chmod(self.script, stat.S_IRWXU)
+
+    def test_collect_relay(self):
+        self._write_script(0)
+        self.sc._collect_relay('localhost', ['node1', 'node2'])
+        with open(self.script + '.args') as afile:
+            args = afile.read()
+        self.assertIn('--nodes=node1,node2 --no-local', args)
+        report = 'sosreport-node1-2019-01-01-xyz.tar.xz'
+        self.assertEqual(sorted(os.listdir(self.sc.config['tmp_dir'])), [
+            'sos-collector-localhost.log', report, report + '.md5',
+            'ui-localhost.log'
+        ])
+        self.assertEqual(self.sc.retrieved, 1)
+        self.assertEqual(
+            [(e['event'], e['node'], os.path.basename(e['path']))
+             for e in self.events],
+            [('report', 'localhost', report)]
+        )
+        self.assertEqual(self.sc.relay_timings['nodes'],
+                         {'node1': {'total': 10, 'relay': 'localhost'}})
+        self.assertEqual(
+            self.sc.relay_timings['relays']['localhost']['retrieved'], 1
+        )
+        # the relay's archive is removed once merged
+        self.assertFalse(os.path.exists(self.archive))
+
+    def test_collect_relay_failed(self):
+        self._write_script(1)
+        self.sc._collect_relay('localhost', ['node1', 'node2'])
+        self.assertEqual(os.listdir(self.sc.config['tmp_dir']), [])
+        self.assertEqual(self.sc.retrieved, 0)
+        self.assertEqual(
+            self.sc.relay_timings['relays']['localhost']['retrieved'], 0
+        )
+        self.assertTrue(os.path.exists(self.archive))
@@ -0,0 +1,159 @@
+import threading
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from soscollector.configuration import Configuration
+from soscollector.scheduler import AIMDController, DomainScheduler
+from soscollector.sosnode import SosNode
+
+NODES = {'a1': 'dc-a', 'a2': 'dc-a', 'a3': 'dc-a', 'b1': 'dc-b',
+         'b2': 'dc-b', 'c1': None}
+
+
+class DomainNode(SosNode):
+    '''SosNode with only what is needed to find its failure domain'''
+
+    def __init__(self, config, address):
+        self.config = config
+        self.address = address
+        self.local = False
+        self.sos_info = {'version': '3.9'}
+        self.cluster_label = None
+
+    def log_debug(self, msg):
+        pass
+
+
+class SchedulerTests(unittest.TestCase):
+
+    def _sched(self, limit=0):
+        return DomainScheduler(sorted(NODES), NODES.get, limit)
+
+    def test_interleave(self):
+        sched = self._sched()
+        order = []
+        node = sched.next()
+        while node:
+            order.append(node)
+            sched.done(node)
+            node = sched.next()
+        self.assertEqual(order, ['a1', 'b1', 'c1', 'a2', 'b2', 'a3'])
+
+    def test_no_cluster(self):
+        # with --master and no profile detected there is no cluster
+        config = Configuration({})
+        config['cluster'] = None
+        config['scoped_node'] = 'node2'
+        config['skip_plugins'] = ['kernel']
+        config['label'] = 'mylabel'
+        nodes = [DomainNode(config, 'node1'), DomainNode(config, 'node2')]
+        sched = DomainScheduler(nodes, lambda n: n.get_domain(), 1)
+        self.assertEqual(sched.runnable(), [nodes[0]])
+        self.assertEqual(nodes[0]._get_plugin_lists(), (['kernel'], [], []))
+        self.assertEqual(nodes[0].determine_sos_label(),
+                         '--label=mylabel')
+
+    def test_runnable_limit(self):
+        sched = self._sched(limit=1)
+        self.assertEqual(sched.runnable(), ['a1', 'b1', 'c1'])
+        self.assertEqual(sched.runnable(), [])
+        sched.done('a1')
+        self.assertEqual(sched.runnable(), ['a2'])
+        self.assertEqual(sched.remaining(), 2)
+
+    def test_run_respects_limit(self):
+        sched = self._sched(limit=1)
+        lock = threading.Lock()
+        running = {}
+        peak = {}
+
+        def collect(node):
+            domain = NODES[node]
+            with lock:
+                running[domain] = running.get(domain, 0) + 1
+                peak[domain] = max(peak.get(domain, 0), running[domain])
+            time.sleep(0.02)
+            with lock:
+                running[domain] -= 1
+
+        pool = ThreadPoolExecutor(6)
+        sched.run(collect, 6, pool)
+        pool.shutdown(wait=True)
+        self.assertEqual(peak, {'dc-a': 1, 'dc-b': 1, None: 1})
+        self.assertEqual(sched.remaining(), 0)
+
+
+class AIMDControllerTests(unittest.TestCase):
+
+    def _ctl(self, maximum=8, **kwargs):
+        return AIMDController(maximum, pressure_func=None, **kwargs)
+
+    def _round(self, ctl, error=False, latency=1.0):
+        tokens = [ctl.acquire() for _ in range(ctl.current())]
+        for token in tokens:
+            ctl.release(token, error=error, latency=latency)
+
+    def test_additive_increase(self):
+        ctl = self._ctl()
+        self.assertEqual(ctl.current(), 2)
+        self._round(ctl)
+        self.assertEqual(ctl.current(), 3)
+        for _ in range(10):
+            self._round(ctl)
+        self.assertEqual(ctl.current(), 8)
+        self.assertEqual(ctl.report()['peak'], 8)
+
+    def test_decrease_once_per_burst(self):
+        ctl = self._ctl()
+        for _ in range(4):
+            self._round(ctl)
+        self.assertEqual(ctl.current(), 6)
+        self._round(ctl, error=True)
+        self.assertEqual(ctl.current(), 3)
+        self.assertEqual(ctl.decreases, 1)
+        self._round(ctl, error=True)
+        self.assertEqual(ctl.current(), 1)
+        self._round(ctl, error=True)
+        self.assertEqual(ctl.current(), 1)
+        self.assertEqual(ctl.report()['final'], 1)
+
+    def test_slow_latency_holds(self):
+        ctl = self._ctl(latency_factor=3.0)
+        self._round(ctl, latency=1.0)
+        self.assertEqual(ctl.current(), 3)
+        self._round(ctl, latency=5.0)
+        self.assertEqual(ctl.current(), 3)
+
+    def test_pressure_decreases(self):
+        ctl = AIMDController(8, start=4, pressure_func=lambda: True)
+        ctl.release(ctl.acquire())
+        self.assertEqual(ctl.current(), 2)
+
+    def test_run_with_controller(self):
+        sched = DomainScheduler(sorted(NODES), NODES.get)
+        ctl = self._ctl(maximum=6)
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def collect(node):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+            return node == 'a1'
+
+        pool = ThreadPoolExecutor(6)
+        sched.run(collect, 6, pool, ctl)
+        pool.shutdown(wait=True)
+        self.assertEqual(sched.remaining(), 0)
+        self.assertEqual(ctl.in_flight, 0)
+        self.assertEqual(state['peak'], 2)
+        self.assertEqual(ctl.decreases, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import shutil
+import tempfile
+import unittest
+
+from soscollector.configuration import Configuration
+from soscollector.sos_collector import SosCollector
+from soscollector.sosnode import SosNode, split_plugins
+
+
+class ShardNode(SosNode):
+    '''SosNode with canned plugin information that never connects'''
+
+    def __init__(self, config, enabled, cpus):
+        self.config = config
+        self.address = 'node1'
+        self.cpus = cpus
+        self.sos_info = {'enabled': enabled, 'disabled': ['ovirt'],
+                         'options': []}
+
+    def get_cpu_count(self):
+        return self.cpus
+
+
+class SelectNode(object):
+    '''Stands in for a connected SosNode when choosing nodes to shard'''
+
+    local = False
+
+    def __init__(self, address):
+        self.address = address
+        self.shard = False
+
+
+class ShardTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Configuration({})
+        self.config['scoped_node'] = None
+
+    def test_split_plugins(self):
+        shards = split_plugins(['e', 'b', 'd', 'a', 'c'], 2)
+        self.assertEqual(shards, [['a', 'c', 'e'], ['b', 'd']])
+        self.assertEqual(split_plugins(['a'], 4), [['a']])
+        self.assertEqual(split_plugins(['a', 'b'], 0), [])
+
+    def test_plugin_shards(self):
+        self.config['skip_plugins'] = ['kernel']
+        self.config['enable_plugins'] = ['ovirt']
+        node = ShardNode(self.config, ['block', 'kernel', 'memory', 'yum'],
+                         cpus=16)
+        shards = node.get_plugin_shards()
+        self.assertEqual(len(shards), 4)
+        self.assertEqual(sorted(sum(shards, [])),
+                         ['block', 'memory', 'ovirt', 'yum'])
+
+    def test_shards_limited_by_cpus(self):
+        node = ShardNode(self.config, ['block', 'kernel', 'memory', 'yum'],
+                         cpus=2)
+        self.assertEqual(len(node.get_plugin_shards()), 2)
+        self.config['shard_max'] = 1
+        self.assertEqual(len(node.get_plugin_shards()), 1)
+
+    def test_select_unreadable_inventory(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        # the collector is not initialized, as that would set up a run
+        sc = SosCollector.__new__(SosCollector)
+        sc.config = self.config
+        sc.config['shard_nodes'] = ['db*']
+        sc.config['shard_slower_than'] = '1h'
+        # a directory, which cannot be opened as the inventory database
+        sc._get_inventory_path = lambda: tmpdir
+        errors = []
+        sc.log_error = errors.append
+        sc.log_debug = lambda msg: None
+        sc.client_list = [SelectNode('db1'), SelectNode('web1')]
+        sc._select_shard_nodes()
+        self.assertEqual([c.shard for c in sc.client_list], [True, False])
+        self.assertEqual(len(errors), 1)
+        self.assertIn('Could not read host inventory', errors[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from soscollector.clusters import Cluster
+from soscollector.configuration import Configuration
+from soscollector.sosnode import SosNode, SosInfoMemo
+
+SOS_LIST = '''
+The following plugins are currently enabled:
+
+ kernel               system and device driver information
+ networking           network and device configuration
+
+The following plugins are currently disabled:
+
+ ovirt                inactive   oVirt Engine
+
+The following plugin options are available:
+
+ kernel.with-timer    off   gather /proc/timer* statistics
+ networking.traceroute off  collect a traceroute
+
+Profiles:
+
+ boot, cluster, network
+
+'''
+
+
+class FakeHost(object):
+    distribution = 'Red Hat'
+    sos_pkg_name = 'sos'
+    containerized = False
+
+    def pkg_query(self, pkg):
+        return 'rpm -q %s' % pkg
+
+
+class MemoNode(SosNode):
+    '''SosNode with canned sos output that never connects'''
+
+    def __init__(self, config, address, nvr='sos-3.7-1.el7.noarch'):
+        self.config = config
+        self.address = address
+        self.host = FakeHost()
+        self.nvr = nvr
+        self.commands = []
+        self.sos_info = {'version': None, 'enabled': [], 'disabled': [],
+                         'options': [], 'presets': []}
+
+    def log_debug(self, msg):
+        pass
+
+    def run_command(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        if cmd.startswith('rpm'):
+            return {'status': 0, 'stdout': self.nvr + '\n'}
+        if cmd == 'sosreport -l':
+            return {'status': 0, 'stdout': SOS_LIST}
+        return {'status': 0, 'stdout': 'name: none\n'}
+
+
+class SosInfoMemoTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Configuration({})
+        self.config['sos_memo'] = SosInfoMemo()
+
+    def test_one_listing_per_build(self):
+        nodes = [MemoNode(self.config, 'node%s' % i) for i in range(20)]
+        nodes.append(MemoNode(self.config, 'newer', 'sos-3.8-2.el7.noarch'))
+        pool = ThreadPoolExecutor(8)
+        list(pool.map(lambda n: n._load_sos_info(), nodes))
+        pool.shutdown(wait=True)
+        listed = [n for n in nodes if 'sosreport -l' in n.commands]
+        self.assertEqual(len(listed), 2)
+        self.assertTrue(nodes[-1] in listed)
+        for node in nodes[:-1]:
+            self.assertEqual(node.sos_info['enabled'],
+                             ('kernel', 'networking'))
+            self.assertEqual(node.sos_info['presets'], ('none',))
+            self.assertEqual(node.sos_info.get('shared'),
+                             None if node in listed else True)
+        self.assertEqual(nodes[-1].sos_info['version'], '3.8')
+
+    def test_no_memo(self):
+        self.config['sos_memo'] = None
+        nodes = [MemoNode(self.config, 'node%s' % i) for i in range(3)]
+        for node in nodes:
+            node._load_sos_info()
+            self.assertTrue('sosreport -l' in node.commands)
+
+    def test_shared_enable(self):
+        self.config['enable_plugins'] = ['kernel', 'ovirt']
+        self.config['cluster'] = Cluster(self.config)
+        first = MemoNode(self.config, 'node1')
+        first._load_sos_info()
+        first.finalize_sos_cmd()
+        self.assertTrue('--enable-plugins=ovirt ' in first.sos_cmd + ' ')
+        other = MemoNode(self.config, 'node2')
+        other._load_sos_info()
+        other.finalize_sos_cmd()
+        self.assertTrue('--enable-plugins=kernel,ovirt' in other.sos_cmd)
+
+
+if __name__ == "__main__":
+    unittest.main()
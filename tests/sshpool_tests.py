@@ -0,0 +1,39 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from soscollector.sshpool import (prepare_control_dir, sweep_control_dir,
+                                  check_control_socket)
+
+
+class SSHPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_prepare_control_dir(self):
+        path = os.path.join(self.tmpdir, 'sockets')
+        prepare_control_dir(path)
+        os.chmod(path, 0o755)
+        prepare_control_dir(path)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o700)
+
+    def test_prepare_control_dir_file(self):
+        path = os.path.join(self.tmpdir, 'file')
+        open(path, 'w').close()
+        self.assertRaises(OSError, prepare_control_dir, path)
+
+    def test_sweep_stale_sockets(self):
+        stale = os.path.join(self.tmpdir, '.sos-collector-root@node1:22')
+        other = os.path.join(self.tmpdir, 'unrelated')
+        for path in (stale, other):
+            open(path, 'w').close()
+        self.assertFalse(check_control_socket(stale))
+        self.assertEqual(sweep_control_dir(self.tmpdir), 0)
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(other))
@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+import unittest
+
+from soscollector.clusters import Cluster
+from soscollector.configuration import Configuration
+from soscollector.sos_collector import SosCollector
+
+
+class StageNode(object):
+    '''Stands in for a SosNode, recording the stages it goes through'''
+
+    local = False
+
+    def __init__(self, address, tracker, ready=True):
+        self.address = address
+        self.tracker = tracker
+        self.ready = ready
+        self.retrieved = False
+        self.stage_exception = None
+        self.stages = []
+
+    def get_domain(self):
+        return None
+
+    def generate_sosreport(self):
+        self.stages.append('generate')
+        if not self.ready:
+            self.retrieved = True
+        return self.ready
+
+    def transfer_sosreport(self):
+        self.stages.append('transfer')
+        with self.tracker['lock']:
+            self.tracker['running'] += 1
+            self.tracker['peak'] = max(self.tracker['peak'],
+                                       self.tracker['running'])
+        time.sleep(0.01)
+        with self.tracker['lock']:
+            self.tracker['running'] -= 1
+        self.retrieved = True
+
+    def finish_sosreport(self):
+        self.stages.append('finish')
+
+    def log_error(self, msg):
+        pass
+
+
+def make_collector(threads):
+    # the collector is not initialized, as that would set up a run
+    sc = SosCollector.__new__(SosCollector)
+    sc.config = Configuration({})
+    sc.config['threads'] = threads
+    sc.config['transfer_threads'] = 2
+    sc.logger = logging.getLogger('sos_collector')
+    sc.console = logging.getLogger('sos_collector_console')
+    sc._lock = threading.Lock()
+    sc.retrieved = 0
+    sc.controllers = {}
+    return sc
+
+
+class StageTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sc = make_collector(8)
+
+    def test_stages(self):
+        tracker = {'lock': threading.Lock(), 'running': 0, 'peak': 0}
+        nodes = [StageNode('node%s' % i, tracker) for i in range(10)]
+        cached = StageNode('cached', tracker, ready=False)
+        self.sc._collect_staged(nodes + [cached])
+        for node in nodes:
+            self.assertEqual(node.stages, ['generate', 'transfer', 'finish'])
+        self.assertEqual(cached.stages, ['generate'])
+        self.assertEqual(self.sc.retrieved, 11)
+        self.assertTrue(tracker['peak'] <= 2)
+
+
+class ExtraCmdCluster(Cluster):
+    '''A cluster profile whose extra command waits for a node sosreport to
+    finish, which it only can if both run at the same time'''
+
+    def __init__(self, config, done, fail=False):
+        super(ExtraCmdCluster, self).__init__(config)
+        self.done = done
+        self.fail = fail
+
+    def run_extra_cmd(self):
+        if self.fail:
+            raise Exception('database dump failed')
+        if not self.done.wait(5):
+            return None
+        return '/tmp/db-dump.tar.gz'
+
+
+class ExtraCmdMaster(object):
+
+    def __init__(self):
+        self.timings = {}
+        self.files = []
+
+    def collect_extra_cmd(self, files):
+        self.files.extend(files)
+
+
+class ExtraCmdNode(StageNode):
+
+    def __init__(self, address, tracker, done):
+        super(ExtraCmdNode, self).__init__(address, tracker)
+        self.done = done
+
+    def finish_sosreport(self):
+        super(ExtraCmdNode, self).finish_sosreport()
+        self.done.set()
+
+
+class ExtraCmdTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sc = make_collector(1)
+        self.sc.master = ExtraCmdMaster()
+        self.errors = []
+        self.sc.log_error = self.errors.append
+        self.done = threading.Event()
+        tracker = {'lock': threading.Lock(), 'running': 0, 'peak': 0}
+        self.sc.client_list = [ExtraCmdNode('node1', tracker, self.done)]
+
+    def test_extra_cmd_concurrent(self):
+        self.sc.config['cluster'] = ExtraCmdCluster(self.sc.config, self.done)
+        self.sc._collect_nodes()
+        # the extra command did not take the only node slot
+        self.assertEqual(self.sc.retrieved, 1)
+        self.assertEqual(self.sc.master.files, ['/tmp/db-dump.tar.gz'])
+        self.assertTrue('extra_cmd' in self.sc.master.timings)
+        self.assertEqual(self.errors, [])
+
+    def test_extra_cmd_failure(self):
+        self.sc.config['cluster'] = ExtraCmdCluster(self.sc.config, self.done,
+                                                    fail=True)
+        self.sc._collect_nodes()
+        self.assertEqual(self.sc.retrieved, 1)
+        self.assertEqual(self.sc.master.files, [])
+        self.assertTrue('extra_cmd' in self.sc.master.timings)
+        self.assertEqual(len(self.errors), 1)
+        self.assertTrue('database dump failed' in self.errors[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
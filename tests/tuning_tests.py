@@ -0,0 +1,39 @@
+import unittest
+
+from soscollector.tuning import parse_resources, tune_sos_options
+
+OUTPUT = '''96\r
+3.52 2.10 1.93 2/1530 48211\r
+MemTotal:       394877428 kB\r
+'''
+
+
+class TuningTests(unittest.TestCase):
+
+    def test_parse_resources(self):
+        res = parse_resources(OUTPUT)
+        self.assertEqual(res, {'cpus': 96, 'memory': 385622, 'load': 3.52})
+        self.assertEqual(parse_resources('sh: nproc: not found'),
+                         {'cpus': None, 'memory': None, 'load': None})
+
+    def test_policy(self):
+        big = tune_sos_options(parse_resources(OUTPUT))
+        self.assertEqual(big, {'threads': 8, 'compression': None,
+                               'log_size': None})
+        small = tune_sos_options({'cpus': 2, 'memory': 3800, 'load': 0.1})
+        self.assertEqual(small, {'threads': 2, 'compression': 'gzip',
+                                 'log_size': 10})
+        unknown = tune_sos_options({'cpus': None, 'memory': None,
+                                    'load': None})
+        self.assertEqual(unknown['threads'], 2)
+
+    def test_load(self):
+        busy = tune_sos_options({'cpus': 8, 'memory': 16384, 'load': 9.0})
+        self.assertEqual(busy['threads'], 2)
+        loaded = tune_sos_options({'cpus': 8, 'memory': 16384, 'load': 17})
+        self.assertEqual(loaded['threads'], 1)
+        self.assertEqual(loaded['compression'], 'gzip')
+
+
+if __name__ == "__main__":
+    unittest.main()